@@ -0,0 +1,67 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Optional
+
+
+class BusyError(Exception):
+    """Raised when the wait queue of a RequestLimiter is full."""
+
+
+class RequestLimiter:
+    """Caps how many requests run at once and how many may wait for a slot.
+
+    Requests beyond `max_concurrency` queue up to `max_queue` deep; past that,
+    or after waiting `queue_timeout` seconds, `slot()` raises BusyError so the
+    caller can answer "busy" right away instead of piling up latency.
+    Optional gauges (anything with inc/dec) track the active and waiting counts.
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int, queue_timeout: Optional[float] = None,
+                 active_gauge=None, waiting_gauge=None):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active_gauge = active_gauge
+        self.waiting_gauge = waiting_gauge
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._waiting = 0
+        self._active = 0
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting
+
+    @asynccontextmanager
+    async def slot(self):
+        if not self._semaphore.locked():
+            # A free slot is taken without suspending
+            await self._semaphore.acquire()
+        elif self._waiting >= self.max_queue:
+            raise BusyError("too many requests waiting")
+        else:
+            self._waiting += 1
+            if self.waiting_gauge is not None:
+                self.waiting_gauge.inc()
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                raise BusyError("timed out waiting for a free slot")
+            finally:
+                self._waiting -= 1
+                if self.waiting_gauge is not None:
+                    self.waiting_gauge.dec()
+
+        self._active += 1
+        if self.active_gauge is not None:
+            self.active_gauge.inc()
+        try:
+            yield
+        finally:
+            self._active -= 1
+            if self.active_gauge is not None:
+                self.active_gauge.dec()
+            self._semaphore.release()
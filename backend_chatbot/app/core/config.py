@@ -1,24 +1,192 @@
-# from pydantic import BaseSettings, Field
-# from dotenv import load_dotenv
-# from pydantic import Field
-# from pydantic_settings import BaseSettings
+from typing import Literal, Optional
 
+from dotenv import load_dotenv
+from pydantic import Field
+from pydantic_settings import BaseSettings, SettingsConfigDict
 
-# # Tải biến môi trường từ file .env
-# load_dotenv()
 
-# class Settings(BaseSettings):
-#     MODEL_PATH: str = Field(..., env="MODEL_PATH", description="Đường dẫn đến mô hình Llama")
-#     N_THREADS: int = Field(8, env="N_THREADS", ge=1, description="Số luồng xử lý cho mô hình")
-#     N_CTX: int = Field(2048, env="N_CTX", ge=1, description="Số lượng context tokens tối đa mà mô hình có thể xử lý")
+# Tải biến môi trường từ file .env
+load_dotenv()
 
-#     class Config:
-#         env_file = ".env"  # Đường dẫn tới file .env
 
-# # Tạo đối tượng settings
-# settings = Settings()
+class Settings(BaseSettings):
+    model_config = SettingsConfigDict(env_file=".env", extra="ignore")
 
-# # Ví dụ truy cập các cấu hình
-# print(settings.MODEL_PATH)
-# print(settings.N_THREADS)
-# print(settings.N_CTX)
+    CSV_FOLDER: str = Field("csv_files", description="Thư mục CSV cũ, chỉ dùng để import vào corpus lần đầu")
+    EMBEDDING_MODEL: str = Field("thenlper/gte-small", description="Mô hình embedding dùng cho vector database")
+    CHUNK_SIZE: int = Field(512, ge=1, description="Số token tối đa của mỗi chunk")
+    INDEX_MODE: Literal["incremental", "full"] = Field(
+        "incremental",
+        description="incremental: chỉ embed lại các CV thay đổi; full: build lại toàn bộ index mỗi lần CSV thay đổi",
+    )
+    INDEX_DIR: str = Field("index_store", description="Thư mục lưu index FAISS và docstore trên đĩa")
+    INDEX_MMAP: bool = Field(True, description="Memory-map index khi khởi động thay vì đọc toàn bộ vào RAM")
+    INDEX_ROLE: Literal["auto", "builder", "reader"] = Field(
+        "auto",
+        description="builder: ingest CV và publish index; reader: chỉ map index đã publish (nhiều worker uvicorn); "
+        "auto: worker đầu tiên giữ được lock là builder",
+    )
+    INDEX_POLL_INTERVAL: float = Field(1.0, gt=0, description="Chu kỳ (giây) reader kiểm tra phiên bản index mới")
+    INDEX_DEBOUNCE: float = Field(
+        2.0, ge=0, description="Gom các thay đổi CV đến liên tiếp trong khoảng (giây) này vào một lần build index"
+    )
+    INDEX_MAX_DELAY: float = Field(30.0, gt=0, description="Thời gian tối đa (giây) một thay đổi chờ được build")
+    # Mỗi shard (thư mục con của UPLOAD_FOLDER: công ty, job, đợt upload) có index riêng
+    INDEX_SHARD_MEMORY_MB: Optional[float] = Field(
+        None, gt=0,
+        description="Dung lượng (MB, trên đĩa) tối đa của các shard index giữ trong bộ nhớ; "
+                    "shard ít dùng nhất bị bỏ ra trước (mặc định: không giới hạn)",
+    )
+    INDEX_SHARD_WORKERS: Optional[int] = Field(
+        None, ge=1, description="Số luồng tìm kiếm song song trên các shard của một truy vấn (mặc định: số CPU)"
+    )
+    INDEX_ALLOW_ALL_SHARDS: bool = Field(
+        False,
+        description="Cho phép một truy vấn tìm trên mọi shard (shards=*); mặc định truy vấn chỉ tìm trong các shard "
+                    "được chỉ định, hoặc shard default",
+    )
+    EMBEDDING_BACKEND: Literal["torch", "onnx", "onnx_int8"] = Field(
+        "torch",
+        description="torch: sentence-transformers fp32; onnx: onnxruntime; onnx_int8: onnxruntime với trọng số int8 "
+        "(model được export một lần vào EMBEDDING_ONNX_DIR)",
+    )
+    EMBEDDING_ONNX_DIR: str = Field("index_store/onnx", description="Thư mục lưu model embedding đã export sang ONNX")
+    EMBEDDING_THREADS: Optional[int] = Field(None, ge=1, description="Số luồng onnxruntime (mặc định: số CPU)")
+    QUERY_BATCH_MAX: int = Field(
+        32, ge=1, description="Số câu hỏi tối đa được embed chung một lần (1 để tắt gom batch)"
+    )
+    QUERY_BATCH_WAIT_MS: float = Field(
+        2.0, ge=0, description="Thời gian (ms) chờ gom thêm câu hỏi đồng thời trước khi embed"
+    )
+    CHUNK_BATCH_SIZE: int = Field(
+        64, ge=1, description="Số CV được chia chunk và embed chung trong một batch khi build index"
+    )
+    CHUNK_WORKERS: Optional[int] = Field(
+        None, ge=1, description="Số process chia chunk song song khi build lại toàn bộ index (mặc định: số CPU)"
+    )
+    CHUNK_POOL_MIN: int = Field(
+        2000, ge=0, description="Chỉ dùng các process chia chunk khi một lần build có nhiều CV hơn ngưỡng này"
+    )
+    NEAR_DUPLICATE_DOCUMENT_SIMILARITY: float = Field(
+        0.0, ge=0, le=1,
+        description="CV có độ tương đồng (Jaccard, MinHash) từ ngưỡng này với một CV đã index sẽ dùng chung chunk "
+                    "(và nội dung) của CV đó; 0 để tắt (mặc định)"
+    )
+    NEAR_DUPLICATE_CHUNK_SIMILARITY: float = Field(
+        0.0, ge=0, le=1,
+        description="Chunk gần trùng với một chunk đã lưu từ ngưỡng này sẽ dùng lại vector (và nội dung) của chunk đó; "
+                    "0 để tắt (mặc định)"
+    )
+    EMBEDDING_CACHE_DIR: str = Field(
+        "index_store/embedding_cache", description="Cache embedding theo hash nội dung của từng chunk"
+    )
+    INDEX_TYPE: Literal["flat", "ivf_flat", "ivf_pq", "hnsw"] = Field(
+        "flat", description="Loại index FAISS: flat (chính xác), ivf_flat, ivf_pq (nén) hoặc hnsw (đồ thị)"
+    )
+    INDEX_TRAIN_MIN: int = Field(
+        4096, ge=256, description="Số chunk tối thiểu để train index xấp xỉ; ít hơn thì vẫn dùng flat"
+    )
+    INDEX_NLIST: Optional[int] = Field(None, ge=2, description="Số cụm IVF (mặc định: khoảng 4 * sqrt(số chunk))")
+    INDEX_NPROBE: int = Field(16, ge=1, description="Số cụm IVF được duyệt mỗi truy vấn")
+    INDEX_PQ_M: int = Field(48, ge=1, description="Số sub-quantizer của IVF-PQ (byte mỗi vector khi nbits=8)")
+    INDEX_PQ_NBITS: int = Field(8, ge=1, le=16, description="Số bit mỗi mã PQ")
+    INDEX_HNSW_M: int = Field(32, ge=2, description="Số cạnh mỗi nút của đồ thị HNSW")
+    INDEX_EF_CONSTRUCTION: int = Field(80, ge=1, description="efConstruction của HNSW")
+    INDEX_EF_SEARCH: int = Field(64, ge=1, description="efSearch của HNSW, cao hơn thì recall tốt hơn nhưng chậm hơn")
+
+    CHAT_MAX_CONCURRENCY: int = Field(8, ge=1, description="Số câu hỏi được xử lý đồng thời trên mỗi process")
+    CHAT_MAX_QUEUE: int = Field(32, ge=0, description="Số câu hỏi tối đa được xếp hàng chờ; vượt quá sẽ trả về busy")
+    CHAT_QUEUE_TIMEOUT: float = Field(30.0, gt=0, description="Thời gian chờ tối đa (giây) trong hàng đợi")
+    CONTEXT_MAX_TOKENS: int = Field(
+        2048, ge=64, description="Số token tối đa của phần context (các đoạn CV) trong prompt gửi LLM"
+    )
+    CONTEXT_CANDIDATES: int = Field(
+        20, ge=1, description="Số chunk được truy xuất để chọn và ghép vào context theo ngân sách token"
+    )
+    HYBRID_RETRIEVAL: bool = Field(
+        True, description="Kết hợp tìm kiếm từ khoá (BM25) với tìm kiếm vector khi chọn các chunk cho context"
+    )
+    KEYWORD_CANDIDATES: int = Field(
+        50, ge=1, description="Số CV tốt nhất theo BM25 dùng để lọc trước và kết hợp với kết quả tìm kiếm vector"
+    )
+    SKILL_FAST_PATH: bool = Field(
+        True,
+        description="Trả lời câu hỏi chỉ gồm bộ lọc kỹ năng (vd: python and (django or flask)) trực tiếp từ chỉ mục "
+        "từ khoá, không gọi LLM",
+    )
+    SKILL_FAST_PATH_LIMIT: int = Field(20, ge=1, description="Số CV tối đa được liệt kê khi trả lời bằng bộ lọc kỹ năng")
+    RETRIEVAL_WORKERS: int = Field(4, ge=1, description="Số luồng dùng cho embedding câu hỏi và tìm kiếm FAISS")
+
+    SEARCH_MAX_QUERIES: int = Field(1000, ge=1, description="Số câu truy vấn tối đa trong một request tìm kiếm theo lô")
+    SEARCH_MAX_CONCURRENCY: int = Field(
+        2, ge=1, description="Số request tìm kiếm theo lô được xử lý đồng thời trên mỗi process"
+    )
+    SEARCH_MAX_QUEUE: int = Field(8, ge=0, description="Số request tìm kiếm theo lô tối đa được xếp hàng chờ")
+
+    ANSWER_CACHE_SIZE: int = Field(1024, ge=0, description="Số câu trả lời tối đa trong cache (0 để tắt cache)")
+    ANSWER_CACHE_TTL: float = Field(3600.0, gt=0, description="Thời gian sống (giây) của một câu trả lời trong cache")
+    ANSWER_CACHE_SIMILARITY: float = Field(
+        0.95, ge=0, le=1, description="Ngưỡng cosine giữa hai câu hỏi để dùng lại câu trả lời đã cache"
+    )
+
+    LLM_BACKEND: Literal["groq", "llama_cpp"] = Field(
+        "groq", description="groq: API Groq (GROQ_API_KEY); llama_cpp: mô hình GGUF chạy local trên CPU (MODEL_PATH)"
+    )
+    LLM_MODEL: str = Field("llama3-8b-8192", description="Tên mô hình trên Groq")
+    LLM_MAX_TOKENS: int = Field(512, ge=1, description="Số token tối đa của một câu trả lời (backend llama_cpp)")
+    LLM_TEMPERATURE: float = Field(0.0, ge=0, description="Nhiệt độ sampling của backend llama_cpp (0: greedy)")
+    LLM_TOP_P: float = Field(0.95, gt=0, le=1, description="Top-p sampling của backend llama_cpp")
+    MODEL_PATH: Optional[str] = Field(None, description="Đường dẫn đến mô hình Llama (file GGUF)")
+    N_THREADS: int = Field(8, ge=1, description="Số luồng xử lý cho mô hình")
+    N_CTX: int = Field(
+        16384, ge=1,
+        description="Số ô KV cache của mô hình, dùng chung cho mọi câu trả lời được sinh đồng thời",
+    )
+    N_PARALLEL: int = Field(4, ge=1, description="Số câu trả lời được mô hình local decode cùng lúc trong một batch")
+    N_BATCH: int = Field(512, ge=1, description="Số token tối đa mỗi lần decode (token sinh ra và token prompt)")
+
+    MONGO_MAX_POOL_SIZE: int = Field(10, ge=1, description="Số kết nối MongoDB tối đa trong pool của mỗi worker")
+    MONGO_MIN_POOL_SIZE: int = Field(0, ge=0, description="Số kết nối MongoDB luôn được giữ mở trong pool")
+    CHAT_LOG_COLLECTION: Optional[str] = Field(
+        "chat_logs", description="Collection lưu mỗi lượt chat (câu hỏi, câu trả lời, nguồn, thời gian từng bước); None để tắt"
+    )
+    CHAT_LOG_BATCH_SIZE: int = Field(500, ge=1, description="Số lượt chat tối đa ghi vào MongoDB trong một lệnh insert_many")
+    CHAT_LOG_FLUSH_INTERVAL: float = Field(
+        1.0, gt=0, description="Thời gian tối đa (giây) một lượt chat nằm trong bộ đệm trước khi được ghi"
+    )
+    CHAT_LOG_MAX_BUFFER: int = Field(
+        20000, ge=1, description="Số lượt chat tối đa chờ ghi; khi đầy, lượt mới bị bỏ (và được đếm) thay vì chặn chat"
+    )
+    CHAT_LOG_WRITERS: int = Field(2, ge=1, description="Số lệnh insert_many chạy song song (không vượt quá MONGO_MAX_POOL_SIZE)")
+
+    UPLOAD_FOLDER: str = Field("uploaded_files", description="Thư mục lưu các CV được upload")
+    UPLOAD_MAX_BYTES: int = Field(20 * 1024 * 1024, ge=1, description="Kích thước tối đa (byte) của một file upload")
+    INGEST_WORKERS: Optional[int] = Field(None, ge=1, description="Số process trích xuất CV song song (mặc định: số CPU)")
+    INGEST_BATCH_SIZE: int = Field(64, ge=1, description="Số CV tối đa được ghi vào corpus trong một segment")
+    EXTRACT_TIMEOUT: float = Field(
+        60.0, gt=0, description="Thời gian tối đa (giây) trích xuất một file; quá hạn thì process trích xuất bị kill"
+    )
+    EXTRACT_MAX_MEMORY_MB: Optional[int] = Field(
+        1024, ge=64, description="Bộ nhớ tối đa (MB) process trích xuất một file được cấp thêm (None để tắt)"
+    )
+    EXTRACT_PAGE_WORKERS: int = Field(4, ge=1, description="Số process đọc song song các trang của một PDF dài")
+    EXTRACT_PARALLEL_PAGES: int = Field(
+        32, ge=2, description="Chỉ đọc song song các trang khi PDF có từ ngần này trang trở lên"
+    )
+    EXTRACT_CACHE_DIR: Optional[str] = Field(
+        "extraction_cache", description="Cache text đã trích xuất theo hash nội dung file (None để tắt)"
+    )
+    PREVIEW_DIR: Optional[str] = Field(
+        "preview_store", description="Thư mục chứa ảnh trang 1 và đoạn text xem trước của CV, tạo khi ingest (None để tắt)"
+    )
+    PREVIEW_TEXT_CHARS: int = Field(500, ge=1, description="Số ký tự đầu của CV được lưu làm text xem trước")
+    THUMBNAIL_WIDTH: int = Field(240, ge=16, description="Chiều rộng (pixel) ảnh xem trước trang 1 của CV PDF")
+
+    CORPUS_DIR: str = Field("corpus_store", description="Thư mục chứa corpus CV dạng Parquet (thay cho csv_files)")
+    CORPUS_COMPACT_SEGMENTS: int = Field(
+        32, ge=2, description="Gộp các segment của corpus khi số segment vượt quá ngưỡng này"
+    )
+
+
+# Tạo đối tượng settings
+settings = Settings()
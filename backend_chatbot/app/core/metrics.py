@@ -0,0 +1,128 @@
+import os
+from typing import Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+
+# With several uvicorn workers, point PROMETHEUS_MULTIPROC_DIR at an empty directory
+# (cleared before start): every process then writes its samples there and
+# /api/metrics aggregates all of them, whichever worker answers the scrape.
+MULTIPROCESS = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+# From a cache hit (~1ms) up to a slow LLM answer or a large index build
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+CHAT_STAGES = ("cache_lookup", "embed_query", "search", "build_prompt", "llm", "llm_first_token", "send", "total")
+INGEST_STAGES = ("extract", "corpus_write", "chunk", "embed", "train", "publish", "index_build")
+SEARCH_STAGES = ("embed", "search", "keywords", "total")
+
+CHAT_STAGE_SECONDS = Histogram(
+    "chat_stage_seconds", "Time spent in each stage of answering a question", ["stage"], buckets=STAGE_BUCKETS
+)
+INGEST_STAGE_SECONDS = Histogram(
+    "ingest_stage_seconds", "Time spent in each stage of ingesting CVs and building the index", ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+SEARCH_STAGE_SECONDS = Histogram(
+    "search_stage_seconds", "Time spent in each stage of a batch search request", ["stage"], buckets=STAGE_BUCKETS
+)
+# Children bound once, so the hot path does not look labels up
+CHAT_STAGE = {stage: CHAT_STAGE_SECONDS.labels(stage) for stage in CHAT_STAGES}
+INGEST_STAGE = {stage: INGEST_STAGE_SECONDS.labels(stage) for stage in INGEST_STAGES}
+SEARCH_STAGE = {stage: SEARCH_STAGE_SECONDS.labels(stage) for stage in SEARCH_STAGES}
+QUERY_BATCH_SIZE = Histogram(
+    "query_batch_size", "Questions embedded together in one forward pass", buckets=(1, 2, 4, 8, 16, 32, 64)
+)
+LLM_BATCH_SEQUENCES = Histogram(
+    "llm_batch_sequences", "Answers decoded together in one step of the local LLM", buckets=(1, 2, 4, 8, 16, 32)
+)
+SHARD_FANOUT = Histogram(
+    "shard_fanout", "Index shards searched by one question or search request", buckets=(1, 2, 4, 8, 16, 32, 64, 128)
+)
+
+CHAT_REQUESTS = Counter(
+    "chat_requests", "Questions received, by outcome (answered, busy, not_ready, no_data, error)", ["outcome"]
+)
+ANSWER_CACHE_LOOKUPS = Counter("answer_cache_lookups", "Answer cache lookups, by result (hit, miss)", ["result"])
+INGESTED_FILES = Counter("ingested_files", "Uploaded CVs handled by the ingestion queue, by status", ["status"])
+EXTRACTIONS = Counter(
+    "extractions", "CV text extractions, by tier (pdfium, pdfminer, docx, cache) or failure (timeout, error)",
+    ["result"],
+)
+SEARCH_QUERIES = Counter("search_queries", "Queries answered by the batch search endpoint")
+FILE_RESPONSES = Counter(
+    "file_responses", "CV files and thumbnails served, by kind (file, thumbnail) and HTTP status (200, 206, 304, 416)",
+    ["kind", "status"],
+)
+SKILL_FILTER_ANSWERS = Counter(
+    "skill_filter_answers", "Chat questions answered from the keyword index as a skill filter, without the LLM"
+)
+CONTEXT_TOKENS = Counter(
+    "context_tokens",
+    "Prompt context tokens: packed (sent to the LLM) and baseline (the same chunks pasted unchanged, "
+    "one Document each); baseline - packed is the saving",
+    ["kind"],
+)
+LLM_TOKENS = Counter(
+    "llm_tokens",
+    "Tokens of the local LLM: prompt (evaluated), cached (prompt prefix reused from the KV cache) and generated",
+    ["kind"],
+)
+CHUNKS_SPLIT = Counter("chunks_split", "Chunks produced by the text splitter")
+CHUNKS_EMBEDDED = Counter("chunks_embedded", "Chunks embedded and added to the working index")
+NEAR_DUPLICATES = Counter(
+    "near_duplicates", "CVs (document) and chunks (chunk) indexed as references to a near-duplicate", ["level"]
+)
+INDEX_BUILDS = Counter("index_builds", "Background index builds, by result (ok, error)", ["result"])
+INDEX_SHARD_LOOKUPS = Counter(
+    "index_shard_lookups",
+    "Index shards needed by queries and builds, by result (hit: in memory, load: read from disk, missing: unreadable)",
+    ["result"],
+)
+INDEX_SHARD_EVICTIONS = Counter(
+    "index_shard_evictions", "Index shards dropped from memory, least recently used first, to stay within the budget"
+)
+CHAT_LOG_RECORDS = Counter(
+    "chat_log_records", "Chat turns of the MongoDB chat log, by result (written, dropped when the buffer is full, failed)",
+    ["result"],
+)
+
+WEBSOCKET_CONNECTIONS = Gauge(
+    "websocket_connections", "Open chat WebSocket connections", multiprocess_mode="livesum"
+)
+CHAT_ACTIVE = Gauge("chat_active_requests", "Questions being answered", multiprocess_mode="livesum")
+CHAT_WAITING = Gauge("chat_waiting_requests", "Questions waiting for a free slot", multiprocess_mode="livesum")
+INGEST_QUEUE_DEPTH = Gauge(
+    "ingest_queue_depth", "CVs queued or being extracted, not yet in the corpus", multiprocess_mode="livesum"
+)
+INDEX_PENDING_CHANGES = Gauge(
+    "index_pending_changes", "Corpus changes waiting for the next index build", multiprocess_mode="livesum"
+)
+CHAT_LOG_BUFFERED = Gauge(
+    "chat_log_buffered", "Chat turns waiting in the write-behind buffer of the chat log", multiprocess_mode="livesum"
+)
+INDEX_SHARDS_LOADED = Gauge("index_shards_loaded", "Index shards held in memory", multiprocess_mode="livemax")
+INDEX_CHUNKS = Gauge("index_chunks", "Chunks in the served index versions of the loaded shards", multiprocess_mode="livemax")
+INDEX_BYTES = Gauge(
+    "index_bytes", "On-disk size of the served index versions of the loaded shards", multiprocess_mode="livemax"
+)
+INDEX_VERSION = Gauge(
+    "index_version", "Highest served index version number among the loaded shards", multiprocess_mode="livemax"
+)
+
+
+def render() -> Tuple[bytes, str]:
+    """Exposition of every metric, and its content type."""
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead():
+    """Drop the live gauges of this process when it exits (multiprocess mode only)."""
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(os.getpid())
@@ -1,16 +1,32 @@
-# from llama_cpp import Llama
-# from app.core.config import settings
-# import logging
+from app.core.config import settings
+import logging
 
-# # Cấu hình logger
-# logger = logging.getLogger("app_logger")
+# Cấu hình logger
+logger = logging.getLogger("app_logger")
 
-# # Khởi tạo mô hình Llama
-# def load_model():
-#     try:
-#         llm = Llama(model_path=settings.MODEL_PATH, n_threads=settings.N_THREADS, n_ctx=settings.N_CTX)
-#         logger.info("Mô hình Llama đã được tải thành công.")
-#         return llm
-#     except Exception as e:
-#         logger.error(f"Không thể tải mô hình: {str(e)}")
-#         raise RuntimeError(f"Không thể tải mô hình: {str(e)}")
+# Khởi tạo mô hình Llama: trả về (model, context) cấp thấp của llama.cpp.
+# KV cache có N_CTX ô, dùng chung cho `n_seq_max` chuỗi được decode cùng lúc.
+def load_model(n_seq_max: int = 1):
+    if not settings.MODEL_PATH:
+        raise RuntimeError("Chưa cấu hình MODEL_PATH cho LLM_BACKEND=llama_cpp")
+    # Chỉ import khi dùng backend local: llama_cpp nạp thư viện native ngay khi import
+    import llama_cpp
+    from llama_cpp._internals import LlamaContext, LlamaModel
+
+    # Log của llama.cpp đi qua logger này; chỉ giữ lỗi
+    logging.getLogger("llama-cpp-python").setLevel(logging.ERROR)
+    try:
+        model = LlamaModel(
+            path_model=settings.MODEL_PATH, params=llama_cpp.llama_model_default_params(), verbose=False
+        )
+        params = llama_cpp.llama_context_default_params()
+        params.n_ctx = settings.N_CTX
+        params.n_batch = params.n_ubatch = min(settings.N_BATCH, settings.N_CTX)
+        params.n_threads = params.n_threads_batch = settings.N_THREADS
+        params.n_seq_max = n_seq_max
+        context = LlamaContext(model=model, params=params, verbose=False)
+        logger.info("Mô hình Llama đã được tải thành công.")
+        return model, context
+    except Exception as e:
+        logger.error(f"Không thể tải mô hình: {str(e)}")
+        raise RuntimeError(f"Không thể tải mô hình: {str(e)}")
@@ -0,0 +1,79 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+logger = logging.getLogger("app_logger")
+
+
+class Warmup:
+    """Startup work that runs on a background thread once the server is listening.
+
+    Steps run in the order they were added; a failed step stops the ones
+    after it, since they usually depend on it. `status()` backs the
+    /api/health/ready probe, so traffic is only routed to the process once
+    every step is done.
+    """
+
+    def __init__(self):
+        self._steps: "OrderedDict[str, Callable[[], None]]" = OrderedDict()
+        self._state: "OrderedDict[str, dict]" = OrderedDict()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def add(self, name: str, step: Callable[[], None]):
+        with self._lock:
+            self._steps[name] = step
+            self._state[name] = {"status": "pending", "seconds": None}
+
+    def start(self):
+        if self._thread is None:
+            self.started_at = time.time()
+            self._thread = threading.Thread(target=self._run, name="warmup", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        started = time.perf_counter()
+        for name, step in list(self._steps.items()):
+            state = self._state[name]
+            state["status"] = "running"
+            step_started = time.perf_counter()
+            try:
+                step()
+            except Exception as e:
+                state.update(status="failed", seconds=round(time.perf_counter() - step_started, 3))
+                self.error = f"{name}: {e}"
+                logger.error(f"Warm-up step {name} failed: {e}")
+                return
+            state.update(status="done", seconds=round(time.perf_counter() - step_started, 3))
+            logger.info(f"Warm-up step {name} done in {state['seconds']:.2f}s")
+        self.finished_at = time.time()
+        logger.info(f"Warm-up finished in {time.perf_counter() - started:.2f}s")
+
+    @property
+    def ready(self) -> bool:
+        return self.finished_at is not None
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self.ready
+
+    def status(self) -> dict:
+        with self._lock:
+            steps = {name: dict(state) for name, state in self._state.items()}
+        return {
+            "ready": self.ready,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "steps": steps,
+        }
+
+
+# Process-wide; main.py adds the steps and starts it in the lifespan handler
+warmup = Warmup()
@@ -0,0 +1,47 @@
+import logging
+import os
+from functools import lru_cache
+from pathlib import Path
+
+from app.core.config import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, every process builds its own index
+    fcntl = None
+
+logger = logging.getLogger("app_logger")
+
+# Kept open for the lifetime of the process; the OS releases the lock when it exits
+_lock_file = None
+
+
+@lru_cache(maxsize=None)
+def is_index_builder() -> bool:
+    """Whether this process ingests CVs and publishes index versions.
+
+    With INDEX_ROLE=auto the first worker to take an exclusive lock on
+    `<INDEX_DIR>/builder.lock` becomes the builder; the other uvicorn
+    workers only map the published index read-only and follow new versions.
+    """
+    global _lock_file
+    if settings.INDEX_ROLE != "auto":
+        return settings.INDEX_ROLE == "builder"
+    if fcntl is None:
+        return True
+    index_dir = Path(settings.INDEX_DIR)
+    index_dir.mkdir(parents=True, exist_ok=True)
+    lock_file = open(index_dir / "builder.lock", "a+")
+    try:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        logger.info(f"Worker {os.getpid()} serves the index built by another process")
+        return False
+    lock_file.seek(0)
+    lock_file.truncate()
+    lock_file.write(str(os.getpid()))
+    lock_file.flush()
+    _lock_file = lock_file
+    logger.info(f"Worker {os.getpid()} is the index builder")
+    return True
@@ -2,6 +2,8 @@ from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
 import os
 import logging
+from app.core.config import settings
+from app.database.memory import MemoryClient
 
 # Cấu hình logging
 logger = logging.getLogger("app_logger")
@@ -24,13 +26,26 @@ async def connect_to_mongo():
         raise RuntimeError("MONGO_URL không được cấu hình!")
     
     try:
-        client = AsyncIOMotorClient(MONGO_URL)
+        if MONGO_URL.startswith("memory://"):
+            # Không cần mongod: dữ liệu chỉ nằm trong bộ nhớ của process (dùng cho test)
+            client = MemoryClient()
+            db = client[MONGO_DB_NAME or "recruitment"]
+            logger.info("Dùng MongoDB trong bộ nhớ (memory://), dữ liệu mất khi tắt server")
+            return
+        # Kích thước pool kết nối của mỗi worker; chat log ghi theo lô nên chỉ cần vài kết nối
+        client = AsyncIOMotorClient(
+            MONGO_URL, maxPoolSize=settings.MONGO_MAX_POOL_SIZE, minPoolSize=settings.MONGO_MIN_POOL_SIZE
+        )
         db = client[MONGO_DB_NAME]
         logger.info("Kết nối tới MongoDB Cloud thành công!")
     except Exception as e:
         logger.error(f"Lỗi khi kết nối MongoDB: {e}")
         raise
 
+def get_database():
+    """Database đã kết nối (None trước connect_to_mongo)."""
+    return db
+
 async def close_mongo_connection():
     global client
     if client:
@@ -0,0 +1,55 @@
+import asyncio
+import itertools
+from typing import Dict, List
+
+# Bản thay thế MongoDB trong bộ nhớ (MONGO_URL=memory://) cho test và chạy local:
+# chỉ có những thao tác mà chat log dùng tới
+
+
+class MemoryCollection:
+    """In-memory stand-in for a Motor collection: insert_many, and count_documents without filters."""
+
+    def __init__(self, name: str, latency: float = 0.0):
+        self.name = name
+        # Simulated round trip of one insert, for benchmarks
+        self.latency = latency
+        self.documents: List[dict] = []
+        self.inserts = 0
+        self._ids = itertools.count(1)
+
+    async def insert_many(self, documents: List[dict], ordered: bool = True):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        for document in documents:
+            document.setdefault("_id", next(self._ids))
+        self.documents.extend(documents)
+        self.inserts += 1
+
+    async def count_documents(self, filter: dict) -> int:
+        return len(self.documents)
+
+
+class MemoryDatabase:
+    def __init__(self, name: str, latency: float = 0.0):
+        self.name = name
+        self.latency = latency
+        self._collections: Dict[str, MemoryCollection] = {}
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        if name not in self._collections:
+            self._collections[name] = MemoryCollection(name, self.latency)
+        return self._collections[name]
+
+
+class MemoryClient:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self._databases: Dict[str, MemoryDatabase] = {}
+
+    def __getitem__(self, name: str) -> MemoryDatabase:
+        if name not in self._databases:
+            self._databases[name] = MemoryDatabase(name, self.latency)
+        return self._databases[name]
+
+    def close(self):
+        pass
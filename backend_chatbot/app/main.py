@@ -1,56 +1,125 @@
 from fastapi import FastAPI
-from app.routers import chat, health, documents
-from app.database.connection import connect_to_mongo, close_mongo_connection
+from app.routers import chat, health, documents, files, metrics, search
+from app.database.connection import connect_to_mongo, close_mongo_connection, get_database
+from app.core.config import settings
+from app.core.metrics import mark_process_dead
+from app.core.warmup import warmup
+from app.core.worker_role import is_index_builder
+from contextlib import asynccontextmanager
 import logging
-import os
+import sys
 import time
 from pathlib import Path
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
-from app.services.pdf_processing import *
+from app.services.ingestion import SUPPORTED_EXTENSIONS, get_ingestion_queue
 import threading
 
 # Cấu hình logging cho ứng dụng
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger("app_logger")
 
+# Kết nối MongoDB khi server khởi động, đóng khi server tắt
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    try:
+        await connect_to_mongo()
+        logger.info("MongoDB kết nối thành công")
+    except Exception as e:
+        logger.error(f"Không thể kết nối MongoDB: {e}")
+        raise e
+    # Mỗi lượt chat được ghi vào MongoDB theo lô ở nền, câu trả lời không bao giờ chờ MongoDB
+    if settings.CHAT_LOG_COLLECTION:
+        chat.chat_log.start(get_database()[settings.CHAT_LOG_COLLECTION])
+
+    # Model, index và watcher được nạp ở luồng nền sau khi server đã mở cổng;
+    # tiến độ xem tại /api/health/ready
+    warmup.add("embedding_model", chat.load_embedding_model)
+    warmup.add("knowledge_index", chat.start_knowledge_index)
+    warmup.add("llm", chat.llm.load)
+    # Chỉ worker builder theo dõi thư mục upload và trích xuất CV; các worker khác chỉ đọc index
+    if is_index_builder():
+        warmup.add("file_watcher", run_watcher_in_thread)
+    warmup.start()
+
+    yield
+
+    if is_index_builder():
+        get_ingestion_queue().shutdown()
+    chat.llm.close()
+    await chat.chat_log.close()
+    await close_mongo_connection()
+    logger.info("Kết nối MongoDB đã được đóng.")
+    mark_process_dead()
+
 # Khởi tạo ứng dụng FastAPI
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Đăng ký các router
 app.include_router(health.router, prefix="/api", tags=["Health"])
 app.include_router(chat.router, prefix="/api", tags=["Chat"])  # Chat có hỗ trợ WebSocket
+app.include_router(search.router, prefix="/api", tags=["Search"])  # Tìm CV theo lô, không gọi LLM
 app.include_router(documents.router, prefix="/api", tags=["Documents"])
+app.include_router(files.router, prefix="/api", tags=["Files"])  # File CV, ảnh và text xem trước cho danh sách kết quả
+app.include_router(metrics.router, prefix="/api", tags=["Metrics"])
 
 # Đường dẫn thư mục cần theo dõi
-uploaded_folder = Path('uploaded_files')
-csv_folder = Path('csv_files')
+uploaded_folder = Path(settings.UPLOAD_FOLDER)
 
 # Kiểm tra và tạo thư mục nếu không tồn tại
 uploaded_folder.mkdir(parents=True, exist_ok=True)
-csv_folder.mkdir(parents=True, exist_ok=True)
 
 # Class để theo dõi thay đổi trong thư mục
 class Watcher(FileSystemEventHandler):
-    def on_modified(self, event):
-        # Nếu là thư mục và có thay đổi, kiểm tra các file PDF mới
-        if event.is_directory and event.src_path == str(uploaded_folder):
-            for file in os.listdir(uploaded_folder):
-                file_path = uploaded_folder / file
-                if file_path.suffix.lower() == '.pdf':
-                    process_file(file_path, csv_folder)
+    # Trên Linux có sự kiện "closed" khi file ghi xong; nơi khác phải dựa vào created/modified
+    use_close_events = sys.platform.startswith("linux")
 
     def on_created(self, event):
-        # Nếu là file mới được tạo, kiểm tra nếu đó là file PDF
-        if not event.is_directory and event.src_path.endswith('.pdf'):
-            pdf_path = Path(event.src_path)
-            process_file(pdf_path, csv_folder)
+        if not self.use_close_events:
+            self._enqueue(event)
+
+    def on_modified(self, event):
+        if not self.use_close_events:
+            self._enqueue(event)
+
+    def on_closed(self, event):
+        self._enqueue(event)
+
+    def on_moved(self, event):
+        # Upload ghi ra file tạm rồi đổi tên, nên file hoàn chỉnh xuất hiện qua sự kiện moved
+        if not event.is_directory:
+            get_ingestion_queue().remove(Path(event.src_path))
+            self._submit(Path(event.dest_path))
+
+    def on_deleted(self, event):
+        # Ghi tombstone vào corpus để CV bị xoá cũng biến mất khỏi index
+        if not event.is_directory:
+            get_ingestion_queue().remove(Path(event.src_path))
+
+    def _enqueue(self, event):
+        if not event.is_directory:
+            self._submit(Path(event.src_path))
+
+    def _submit(self, file_path: Path):
+        # Hàng đợi tự bỏ qua file có nội dung đã được trích xuất trước đó;
+        # chỉ nhận file trong thư mục upload hoặc thư mục shard ngay bên dưới nó
+        queue = get_ingestion_queue()
+        if (file_path.suffix.lower() in SUPPORTED_EXTENSIONS and file_path.is_file()
+                and queue.source_of(file_path) is not None):
+            try:
+                queue.submit(file_path)
+            except (OSError, ValueError) as e:
+                logger.error(f"Không thể đưa {file_path} vào hàng đợi: {e}")
 
 # Khởi tạo observer và thêm watcher
 def start_watching():
+    # Trích xuất các file được thêm vào khi server chưa chạy; file không đổi sẽ được bỏ qua
+    get_ingestion_queue().submit_folder(uploaded_folder)
+
     event_handler = Watcher()
     observer = Observer()
-    observer.schedule(event_handler, path=str(uploaded_folder), recursive=False)
+    # Đệ quy để theo dõi cả các thư mục shard (mỗi công ty, job hoặc đợt upload một thư mục)
+    observer.schedule(event_handler, path=str(uploaded_folder), recursive=True)
     observer.start()
     logger.info("Watching for changes in 'uploaded_files'...")
     try:
@@ -65,22 +134,3 @@ def run_watcher_in_thread():
     watcher_thread = threading.Thread(target=start_watching, daemon=True)
     watcher_thread.start()
     logger.info("Started file watcher thread.")
-
-# Kết nối MongoDB và khởi động watcher khi server FastAPI khởi động
-@app.on_event("startup")
-async def startup_event():
-    try:
-        await connect_to_mongo()
-        logger.info("MongoDB kết nối thành công")
-    except Exception as e:
-        logger.error(f"Không thể kết nối MongoDB: {e}")
-        raise e
-
-    # Bắt đầu theo dõi thư mục trong luồng riêng
-    run_watcher_in_thread()
-
-# Đóng kết nối MongoDB khi server tắt
-@app.on_event("shutdown")
-async def shutdown_event():
-    await close_mongo_connection()
-    logger.info("Kết nối MongoDB đã được đóng.")
@@ -1,94 +1,195 @@
 import os
+import asyncio
+import logging
 import threading
-from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, status
+from starlette.concurrency import run_in_threadpool
 from dotenv import load_dotenv
-from groq import Groq
-import glob
-from typing import Optional, List, Tuple
-from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
-from transformers import AutoTokenizer, AutoModelForCausalLM
-from langchain.docstore.document import Document as LangchainDocument
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from tqdm import tqdm
-import pandas as pd
+from typing import AsyncIterator, Optional, List, Sequence, Tuple
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain.storage import LocalFileStore
 from pathlib import Path
+from app.core.config import settings
+from app.core.concurrency import BusyError, RequestLimiter
+from app.core.metrics import (
+    ANSWER_CACHE_LOOKUPS, CHAT_ACTIVE, CHAT_REQUESTS, CHAT_STAGE, CHAT_WAITING, CONTEXT_TOKENS, SKILL_FILTER_ANSWERS,
+    WEBSOCKET_CONNECTIONS
+)
+from app.core.warmup import warmup
+from app.core.worker_role import is_index_builder
+from app.routers.files import cv_urls
+from app.services.ann_index import AnnConfig
+from app.services.corpus_store import get_corpus_store
+from app.services.ingestion import get_ingestion_queue
+from app.services.index_updater import IndexUpdater
+from app.services.chunking import get_text_splitter
+from app.services.context_builder import PackedContext, get_context_builder
+from app.services.embeddings import QueryBatcher, create_embeddings
+from app.services.hybrid_search import hybrid_chunks
+from app.services.keyword_index import describe, parse_skill_filter
+from app.services.knowledge_index import KnowledgeIndex, chunk_id
+from app.services.sharded_index import ShardedIndex, ShardedSnapshot
+from app.services.shards import DEFAULT_SHARD, parse_shards, shard_scope
+from app.services.llm import create_llm_backend
+from app.services.answer_cache import AnswerCache, CachedAnswer
+from app.services.chat_log import ChatLog
 
 # Load environment variables
 load_dotenv()
 
-# Initialize router and Groq client
+# Initialize router
 router = APIRouter()
-client = Groq()
+logger = logging.getLogger("app_logger")
+
+# Retrieval (query embedding + FAISS search) is CPU-bound and runs off the event loop
+retrieval_executor = ThreadPoolExecutor(max_workers=settings.RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+chat_limiter = RequestLimiter(
+    max_concurrency=settings.CHAT_MAX_CONCURRENCY,
+    max_queue=settings.CHAT_MAX_QUEUE,
+    queue_timeout=settings.CHAT_QUEUE_TIMEOUT,
+    active_gauge=CHAT_ACTIVE,
+    waiting_gauge=CHAT_WAITING,
+)
+answer_cache = AnswerCache(
+    max_entries=settings.ANSWER_CACHE_SIZE,
+    ttl=settings.ANSWER_CACHE_TTL,
+    similarity_threshold=settings.ANSWER_CACHE_SIMILARITY,
+)
+# Every chat turn goes to MongoDB through a write-behind buffer, started with the
+# MongoDB connection (see app/main.py): the answer never waits on the database
+chat_log = ChatLog(
+    batch_size=settings.CHAT_LOG_BATCH_SIZE,
+    flush_interval=settings.CHAT_LOG_FLUSH_INTERVAL,
+    max_buffer=settings.CHAT_LOG_MAX_BUFFER,
+    writers=settings.CHAT_LOG_WRITERS,
+)
+# The chat turn being answered: filled in along the pipeline, then handed to chat_log
+current_turn: ContextVar[Optional[dict]] = ContextVar("current_turn", default=None)
 
-# CSV folder setup
-csv_folder = Path('csv_files')
 
-# Function to read and combine CSV files
-def load_csv_files():
-    csv_files = glob.glob(str(csv_folder / "*.csv"))
-    if not csv_files:
-        print("No CSV files found.")
-        return None
+def annotate_turn(**fields):
+    turn = current_turn.get()
+    if turn is not None:
+        turn.update(fields)
 
-    dataframes = []
-    for file in csv_files:
-        print(f"Reading {file}...")
-        df = pd.read_csv(file)
-        dataframes.append(df)
 
-    # Combine all DataFrames if needed
-    combined_df = pd.concat(dataframes, ignore_index=True)
+def observe_stage(stage: str, seconds: float):
+    """Record the duration of a stage in the metrics and in the current chat turn."""
+    CHAT_STAGE[stage].observe(seconds)
+    turn = current_turn.get()
+    if turn is not None:
+        turn["stages"][stage] = round(turn["stages"].get(stage, 0.0) + seconds, 6)
 
-    # Create RAW_KNOWLEDGE_BASE
-    raw_knowledge_base = [
-        LangchainDocument(
-            page_content=f"Resume: {row['Resume']}",
-            metadata={"source": row['source']}
-        )
-        for _, row in tqdm(combined_df.iterrows(), total=len(combined_df))
-    ]
-    return raw_knowledge_base
-
-# Initialize the knowledge base
-RAW_KNOWLEDGE_BASE = load_csv_files() or []
-
-# Function to split documents into chunks
-def split_documents(chunk_size: int, knowledge_base: List[LangchainDocument]) -> List[LangchainDocument]:
-    text_splitter = RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
-        AutoTokenizer.from_pretrained("thenlper/gte-small"),
-        chunk_size=chunk_size,
-        chunk_overlap=int(chunk_size / 10),
-        add_start_index=False,
-        strip_whitespace=True,
-        separators=[". ", ", "]
+
+@contextmanager
+def stage_timer(stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
+# Create vector database: one index per shard (company, job or upload collection, see
+# app/services/shards.py). Nothing heavy happens at import: the embedding model is loaded
+# by the warm-up steps below (see app/main.py), after the server is already listening,
+# and each shard by the first query or build that needs it.
+index_dir = Path(settings.INDEX_DIR)
+
+
+def new_shard_index() -> KnowledgeIndex:
+    return KnowledgeIndex(
+        None,
+        chunk_size=settings.CHUNK_SIZE,
+        model_name=settings.EMBEDDING_MODEL,
+        ann=AnnConfig.from_settings(settings),
+        batch_size=settings.CHUNK_BATCH_SIZE,
+        chunk_workers=settings.CHUNK_WORKERS or os.cpu_count() or 1,
+        chunk_pool_min=settings.CHUNK_POOL_MIN,
+        embedding_backend=settings.EMBEDDING_BACKEND,
+        document_similarity=settings.NEAR_DUPLICATE_DOCUMENT_SIMILARITY,
+        chunk_similarity=settings.NEAR_DUPLICATE_CHUNK_SIMILARITY,
+        report_metrics=False,
     )
 
-    docs_processed = []
-    for doc in knowledge_base:
-        docs_processed += text_splitter.split_documents([doc])
-
-    # Remove duplicates
-    unique_texts = {}
-    docs_processed_unique = []
-    for doc in docs_processed:
-        if doc.page_content not in unique_texts:
-            unique_texts[doc.page_content] = True
-            docs_processed_unique.append(doc)
-
-    return docs_processed_unique
-
-# Create vector database
-embedding_model = HuggingFaceEmbeddings(
-    model_name="thenlper/gte-small",
-    model_kwargs={"device": "cpu"},
-    encode_kwargs={"normalize_embeddings": True}
+
+KNOWLEDGE_VECTOR_DATABASE = ShardedIndex(
+    index_dir,
+    new_shard_index,
+    memory_budget=int(settings.INDEX_SHARD_MEMORY_MB * 1024 * 1024) if settings.INDEX_SHARD_MEMORY_MB else None,
+    mmap=settings.INDEX_MMAP,
+    workers=settings.INDEX_SHARD_WORKERS,
 )
+index_updater: Optional[IndexUpdater] = None
+query_batcher: Optional[QueryBatcher] = None
 
-docs_processed = split_documents(512, RAW_KNOWLEDGE_BASE)
-KNOWLEDGE_VECTOR_DATABASE = FAISS.from_documents(docs_processed, embedding_model, distance_strategy="cosine")
+
+def load_embedding_model():
+    """Warm-up step: load the embedding model, and the tokenizer on the builder."""
+    global query_batcher
+    base_embedding_model = create_embeddings(
+        settings.EMBEDDING_BACKEND, settings.EMBEDDING_MODEL, Path(settings.EMBEDDING_ONNX_DIR),
+        threads=settings.EMBEDDING_THREADS,
+    )
+    if settings.QUERY_BATCH_MAX > 1:
+        base_embedding_model = query_batcher = QueryBatcher(
+            base_embedding_model, max_batch=settings.QUERY_BATCH_MAX, max_wait=settings.QUERY_BATCH_WAIT_MS / 1000
+        )
+    # Chunks are cached by a hash of their text, so restarts and re-ingests only embed unseen chunks
+    embedding_model = CacheBackedEmbeddings.from_bytes_store(
+        base_embedding_model,
+        LocalFileStore(settings.EMBEDDING_CACHE_DIR),
+        namespace=settings.EMBEDDING_MODEL if settings.EMBEDDING_BACKEND == "torch"
+        else f"{settings.EMBEDDING_MODEL}/{settings.EMBEDDING_BACKEND}",
+    )
+    # The first forward pass is slow; do it here rather than on a user's question
+    embedding_model.embed_query("warm up")
+    KNOWLEDGE_VECTOR_DATABASE.embedding_model = embedding_model
+    # Every worker counts prompt tokens with the chunking tokenizer
+    get_context_builder(settings.EMBEDDING_MODEL, settings.CONTEXT_MAX_TOKENS)
+    if is_index_builder():
+        get_text_splitter(settings.CHUNK_SIZE, settings.EMBEDDING_MODEL)
+
+
+def follow_published_index():
+    """Reader workers swap in every version the builder publishes."""
+    while True:
+        time.sleep(settings.INDEX_POLL_INTERVAL)
+        try:
+            KNOWLEDGE_VECTOR_DATABASE.refresh()
+        except Exception as e:
+            logger.error(f"Error loading the published index: {e}")
+
+
+def start_knowledge_index():
+    """Warm-up step: serve the published shards and keep them up to date."""
+    global index_updater
+    if is_index_builder():
+        # An index published before sharding becomes the default shard
+        KNOWLEDGE_VECTOR_DATABASE.adopt_unsharded()
+    # Shards are only listed here: each is mapped when first needed, whatever their number
+    KNOWLEDGE_VECTOR_DATABASE.discover()
+    if is_index_builder():
+        # Catch up with the corpus in the background; queries are served meanwhile
+        index_updater = IndexUpdater(
+            KNOWLEDGE_VECTOR_DATABASE,
+            corpus_records=lambda shard: get_corpus_store().iter_records(shard=shard),
+            corpus_shards=lambda: get_corpus_store().shards(),
+            mode=settings.INDEX_MODE,
+            debounce=settings.INDEX_DEBOUNCE,
+            max_delay=settings.INDEX_MAX_DELAY,
+        )
+        get_ingestion_queue().add_listener(index_updater.submit)
+        index_updater.request_sync()
+        index_updater.start()
+    else:
+        # Other uvicorn workers map the builder's index read-only instead of building their own
+        threading.Thread(target=follow_published_index, name="index-follower", daemon=True).start()
 
 # Define prompt format for ChatGPT
 prompt_in_chat_format = [
@@ -98,28 +199,170 @@ prompt_in_chat_format = [
     }
 ]
 
-# Function to answer questions using Groq API
-def answer_with_groq_api(question: str, knowledge_index: FAISS, num_retrieved_docs: int = 5) -> Tuple[str, List[dict]]:
-    relevant_docs = knowledge_index.similarity_search(query=question, k=num_retrieved_docs)
-    relevant_content = [doc.page_content for doc in relevant_docs]
-    relevant_metadatas = [doc.metadata for doc in relevant_docs]
-
-    context = "\nExtracted documents:\n"
-    context += "\n".join([f"Document {i + 1} ({doc_metadata['source']}):\n{doc_content}" for i, (doc_content, doc_metadata) in enumerate(zip(relevant_content, relevant_metadatas))])
-
-    final_prompt = prompt_in_chat_format[0]["content"].format(question=question, context=context)
-
-    # Send prompt to Groq API
-    response = client.chat.completions.create(
-        messages=[{"role": "user", "content": final_prompt}],
-        model="llama3-8b-8192",
-        stream=False,
+CONTEXT_HEADER = "\nExtracted documents:\n"
+
+def build_prompt(question: str, context: PackedContext) -> str:
+    return prompt_in_chat_format[0]["content"].format(question=question, context=CONTEXT_HEADER + context.text)
+
+# Every prompt starts with the instructions: the local backend keeps them evaluated in its KV cache.
+# Groq (LLM_BACKEND=groq) or the local llama.cpp model, loaded by a warm-up step (see app/main.py)
+PROMPT_PREFIX = prompt_in_chat_format[0]["content"].split("{context}")[0] + CONTEXT_HEADER
+llm = create_llm_backend(settings, prefix=PROMPT_PREFIX)
+
+def build_context(scored_docs) -> PackedContext:
+    return get_context_builder(settings.EMBEDDING_MODEL, settings.CONTEXT_MAX_TOKENS).build(scored_docs)
+
+# Retrieved chunks grouped per CV, without repeated overlap, within CONTEXT_MAX_TOKENS.
+# Tokenizing and merging the chunks runs in the retrieval pool; the turn is annotated here,
+# on the event loop, where the current turn is known
+async def pack_context(scored_docs) -> PackedContext:
+    with stage_timer("build_prompt"):
+        context = await run_in_retrieval_pool(build_context, scored_docs)
+    CONTEXT_TOKENS.labels("packed").inc(context.tokens)
+    CONTEXT_TOKENS.labels("baseline").inc(context.baseline_tokens)
+    annotate_turn(
+        route="llm",
+        chunks=[{"id": chunk_id(doc.page_content), "source": doc.metadata.get("source"), "score": round(float(score), 6)}
+                for doc, score in scored_docs],
+        context=context.stats(),
     )
-
-    # Extract answer from API response
-    answer = response.choices[0].message.content
+    return context
+
+async def run_in_retrieval_pool(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(retrieval_executor, func, *args)
+
+async def embed_question(question: str, knowledge_index: ShardedIndex) -> List[float]:
+    if query_batcher is not None:
+        # Wait on the event loop rather than in a retrieval thread, so every
+        # concurrent question can join the same batch
+        return await asyncio.wrap_future(query_batcher.submit(question))
+    return await run_in_retrieval_pool(knowledge_index.embed_query, question)
+
+# More candidates than fit in the prompt: the context builder picks among them (chunk, similarity) pairs
+async def retrieve(question: str, knowledge_index: ShardedIndex, num_retrieved_docs: int = settings.CONTEXT_CANDIDATES,
+                   query_embedding: Optional[List[float]] = None, snapshot: Optional[ShardedSnapshot] = None):
+    if query_embedding is None:
+        with stage_timer("embed_query"):
+            query_embedding = await embed_question(question, knowledge_index)
+    if snapshot is None:
+        snapshot = await run_in_retrieval_pool(knowledge_index.snapshot, [DEFAULT_SHARD])
+    with stage_timer("search"):
+        if settings.HYBRID_RETRIEVAL and snapshot.keywords is not None:
+            return await run_in_retrieval_pool(
+                hybrid_chunks, snapshot, question, query_embedding, num_retrieved_docs, settings.KEYWORD_CANDIDATES
+            )
+        return await run_in_retrieval_pool(snapshot.similarity_search_with_score_by_vector, query_embedding, num_retrieved_docs)
+
+# A question that is only a skill filter ("who knows python and (django or flask)?") is answered
+# from the keyword index in milliseconds: no embedding, no retrieval, no LLM
+def answer_skill_filter(question: str, snapshot: ShardedSnapshot) -> Optional[Tuple[str, List[dict]]]:
+    if not settings.SKILL_FAST_PATH or snapshot.keywords is None:
+        return None
+    expression = parse_skill_filter(question)
+    if expression is None:
+        return None
+    with stage_timer("search"):
+        total, matches = snapshot.keywords.filter(expression, settings.SKILL_FAST_PATH_LIMIT)
+    SKILL_FILTER_ANSWERS.inc()
+    annotate_turn(route="skill_filter", skill_filter=describe(expression), matches=total)
+    lines = [f"{total} CVs match {describe(expression)}" + (":" if matches else ".")]
+    lines += [f"- {source}" for source, _ in matches]
+    if total > len(matches):
+        lines.append(f"... and {total - len(matches)} more")
+    return "\n".join(lines), [{"source": source} for source, _ in matches]
+
+# Answers are cached per set of shards asked about: the version of a set grows with any of its shards
+def cache_scope(snapshot: ShardedSnapshot) -> str:
+    return ",".join(sorted(snapshot.versions))
+
+# Exact match on the normalized question first, then the query embedding (reused for retrieval on a miss)
+async def lookup_cached_answer(question: str, knowledge_index: ShardedIndex, snapshot: ShardedSnapshot) -> Tuple[Optional[CachedAnswer], Optional[List[float]]]:
+    started = time.perf_counter()
+    cached = answer_cache.get(question, snapshot.version, scope=cache_scope(snapshot))
+    if cached is not None:
+        observe_stage("cache_lookup", time.perf_counter() - started)
+        ANSWER_CACHE_LOOKUPS.labels("hit").inc()
+        return cached, None
+    lookup_seconds = time.perf_counter() - started
+    with stage_timer("embed_query"):
+        query_embedding = await embed_question(question, knowledge_index)
+    started = time.perf_counter()
+    cached = answer_cache.get(question, snapshot.version, query_embedding, scope=cache_scope(snapshot))
+    observe_stage("cache_lookup", lookup_seconds + time.perf_counter() - started)
+    ANSWER_CACHE_LOOKUPS.labels("miss" if cached is None else "hit").inc()
+    return cached, query_embedding
+
+# Function to answer questions with the configured LLM backend
+async def answer_with_llm(question: str, knowledge_index: ShardedIndex, num_retrieved_docs: int = settings.CONTEXT_CANDIDATES,
+                          shards: Sequence[str] = (DEFAULT_SHARD,)) -> Tuple[str, List[dict]]:
+    # The whole answer is computed on one version of each shard, even if a newer one goes live meanwhile
+    snapshot = await run_in_retrieval_pool(knowledge_index.snapshot, shards)
+    annotate_turn(index_version=snapshot.version, shards=snapshot.versions)
+    filtered = answer_skill_filter(question, snapshot)
+    if filtered is not None:
+        return filtered
+    cached, query_embedding = await lookup_cached_answer(question, knowledge_index, snapshot)
+    if cached is not None:
+        annotate_turn(route="cache")
+        return cached.answer, cached.sources
+
+    scored_docs = await retrieve(question, knowledge_index, num_retrieved_docs, query_embedding, snapshot)
+    context = await pack_context(scored_docs)
+    relevant_metadatas = context.sources
+    final_prompt = build_prompt(question, context)
+
+    with stage_timer("llm"):
+        answer = await llm.complete(final_prompt)
+    answer_cache.put(question, snapshot.version, answer, relevant_metadatas, query_embedding, scope=cache_scope(snapshot))
     return answer, relevant_metadatas
 
+# Same pipeline, but yields ("sources", metadatas) and ("context", token stats) first, then ("delta", text) per token
+async def stream_answer_with_llm(question: str, knowledge_index: ShardedIndex, num_retrieved_docs: int = settings.CONTEXT_CANDIDATES,
+                                 shards: Sequence[str] = (DEFAULT_SHARD,)) -> AsyncIterator[Tuple[str, object]]:
+    snapshot = await run_in_retrieval_pool(knowledge_index.snapshot, shards)
+    annotate_turn(index_version=snapshot.version, shards=snapshot.versions)
+    filtered = answer_skill_filter(question, snapshot)
+    if filtered is not None:
+        yield "sources", filtered[1]
+        yield "delta", filtered[0]
+        return
+    cached, query_embedding = await lookup_cached_answer(question, knowledge_index, snapshot)
+    if cached is not None:
+        annotate_turn(route="cache")
+        yield "sources", cached.sources
+        yield "delta", cached.answer
+        return
+
+    scored_docs = await retrieve(question, knowledge_index, num_retrieved_docs, query_embedding, snapshot)
+    context = await pack_context(scored_docs)
+    relevant_metadatas = context.sources
+    yield "sources", relevant_metadatas
+    yield "context", context.stats()
+
+    final_prompt = build_prompt(question, context)
+    started = time.perf_counter()
+    deltas = llm.stream(final_prompt)
+    parts = []
+    # Time spent waiting on the LLM, without the time the caller takes to send each delta
+    generating, resumed = 0.0, started
+    try:
+        async for delta in deltas:
+            now = time.perf_counter()
+            if not parts:
+                observe_stage("llm_first_token", now - started)
+            generating += now - resumed
+            parts.append(delta)
+            yield "delta", delta
+            resumed = time.perf_counter()
+        observe_stage("llm", generating + time.perf_counter() - resumed)
+        answer_cache.put(
+            question, snapshot.version, "".join(parts), relevant_metadatas, query_embedding, scope=cache_scope(snapshot)
+        )
+    finally:
+        # Stop generation if the client went away mid-answer
+        await deltas.aclose()
+
 # WebSocket connection manager
 class ConnectionManager:
     def __init__(self):
@@ -128,88 +371,191 @@ class ConnectionManager:
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
         self.active_connections.append(websocket)
+        WEBSOCKET_CONNECTIONS.inc()
 
     def disconnect(self, websocket: WebSocket):
         self.active_connections.remove(websocket)
+        WEBSOCKET_CONNECTIONS.dec()
 
     async def send_message(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
+        with stage_timer("send"):
+            await websocket.send_text(message)
 
     async def send_binary(self, data: bytes, websocket: WebSocket):
-        await websocket.send_bytes(data)
+        with stage_timer("send"):
+            await websocket.send_bytes(data)
 
     async def broadcast(self, message: str):
         for connection in self.active_connections:
             await connection.send_text(message)
 
+    async def send_frame(self, websocket: WebSocket, frame_type: str, request_id: int, **payload):
+        """Send one frame of the streaming protocol as a JSON text message."""
+        with stage_timer("send"):
+            await websocket.send_json({"type": frame_type, "id": request_id, **payload})
+
 manager = ConnectionManager()
 
+BUSY_MESSAGE = "The chatbot is busy right now, please try again in a moment."
+NOT_READY_MESSAGE = "The chatbot is starting up, please try again in a moment."
+
 # Function to get PDF path from metadata
 def get_pdf_path_from_metadata(metadata):
     """Retrieve PDF file path from metadata."""
     pdf_filename = metadata.get('source')
     if pdf_filename:
-        return Path("uploaded_files") / pdf_filename
+        return Path(settings.UPLOAD_FOLDER) / pdf_filename
     return None
 
-# Function to send PDF file
-async def send_pdf_file(websocket: WebSocket, pdf_path: Path):
+# Links to the related CVs instead of the files: the client fetches them (ranges, ETag) or
+# their thumbnail and preview from /api/cv, outside the chat WebSocket
+def with_cv_links(metadatas: List[dict], websocket: WebSocket) -> List[dict]:
+    linked = []
+    for metadata in metadatas:
+        pdf_path = get_pdf_path_from_metadata(metadata)
+        if pdf_path is not None and pdf_path.is_file():
+            metadata = {**metadata, **cv_urls(websocket, metadata["source"])}
+        linked.append(metadata)
+    return linked
+
+@router.get("/chat/cache")
+async def answer_cache_stats():
+    return answer_cache.stats()
+
+@router.get("/chat/log")
+async def chat_log_stats():
+    """Write-behind buffer of the MongoDB chat log: records buffered, written, dropped and failed."""
+    return chat_log.stats()
+
+@router.get("/chat/llm")
+async def llm_stats():
+    """Backend answering the questions; queue and batching counters for the local one."""
+    return llm.stats()
+
+@router.get("/chat/index")
+async def index_status():
+    """Shards served in this worker (version, size, whether loaded), plus build stats on the builder."""
+    shards = await run_in_threadpool(KNOWLEDGE_VECTOR_DATABASE.stats)
+    status = {
+        "chunks": sum(shard.get("chunks") or 0 for shard in shards.values()),
+        "builder": is_index_builder(),
+        **KNOWLEDGE_VECTOR_DATABASE.residency(),
+        "shards": shards,
+    }
+    if index_updater is not None:
+        status.update(index_updater.stats())
+        status["near_duplicates"] = KNOWLEDGE_VECTOR_DATABASE.near_duplicate_stats()
+    return status
+
+# Streaming protocol (/api/chat/ws?stream=true), one JSON frame per message:
+#   {"type": "start", "id": n}
+#   {"type": "sources", "id": n, "sources": [metadata, ...]}   sent before generation starts, with url, thumbnail_url
+#                                                              and preview_url of each CV still in the upload folder
+#   {"type": "delta", "id": n, "content": "..."}              repeated as tokens arrive
+#   {"type": "end", "id": n, "context": {"context_tokens": ..., "tokens_saved": ...}}   context absent on cache hits and skill filters
+#   {"type": "error", "id": n, "code": "busy" | "not_ready" | "no_data" | "internal", "message": "..."}
+async def stream_answer(websocket: WebSocket, question: str, request_id: int, shards: Sequence[str] = (DEFAULT_SHARD,)) -> str:
+    """Answer one question with the streaming protocol; returns the outcome for metrics."""
+    await manager.send_frame(websocket, "start", request_id)
+    if not warmup.ready:
+        await manager.send_frame(websocket, "error", request_id, code="not_ready", message=NOT_READY_MESSAGE)
+        return "not_ready"
+    if KNOWLEDGE_VECTOR_DATABASE.is_empty(shards):
+        await manager.send_frame(websocket, "error", request_id, code="no_data", message="No data available")
+        return "no_data"
+
+    usage = {}
+    parts = []
     try:
-        with open(pdf_path, "rb") as pdf_file:
-            await manager.send_binary(pdf_file.read(), websocket)
+        async with chat_limiter.slot():
+            async for kind, payload in stream_answer_with_llm(question, KNOWLEDGE_VECTOR_DATABASE, shards=shards):
+                if kind == "sources":
+                    annotate_turn(sources=[meta.get("source") for meta in payload])
+                    await manager.send_frame(websocket, "sources", request_id, sources=with_cv_links(payload, websocket))
+                elif kind == "context":
+                    usage["context"] = payload
+                else:
+                    parts.append(payload)
+                    await manager.send_frame(websocket, "delta", request_id, content=payload)
+    except BusyError:
+        await manager.send_frame(websocket, "error", request_id, code="busy", message=BUSY_MESSAGE)
+        return "busy"
+    except WebSocketDisconnect:
+        raise
     except Exception as e:
-        await manager.send_message(f"Error sending PDF: {str(e)}", websocket)
+        await manager.send_frame(websocket, "error", request_id, code="internal", message=str(e))
+        annotate_turn(error=str(e))
+        return "error"
+    annotate_turn(answer="".join(parts))
+    await manager.send_frame(websocket, "end", request_id, **usage)
+    return "answered"
+
+# Plain protocol: the whole answer as one text message
+async def send_answer(websocket: WebSocket, question: str, shards: Sequence[str] = (DEFAULT_SHARD,)) -> str:
+    if not warmup.ready:
+        await manager.send_message(NOT_READY_MESSAGE, websocket)
+        return "not_ready"
+    if KNOWLEDGE_VECTOR_DATABASE.is_empty(shards):
+        await manager.send_message("No data available", websocket)
+        return "no_data"
 
-# WebSocket endpoint for chatbot
+    try:
+        # Generate response
+        async with chat_limiter.slot():
+            response, metadata = await answer_with_llm(question, KNOWLEDGE_VECTOR_DATABASE, shards=shards)
+        annotate_turn(answer=response, sources=[meta.get("source") for meta in metadata])
+
+        # Links to the related CVs go in the same message
+        links = [meta for meta in with_cv_links(metadata, websocket) if "url" in meta]
+        if links:
+            response += "\n\nCVs:\n" + "\n".join(f"- {meta['source']}: {meta['url']}" for meta in links)
+        await manager.send_message(response, websocket)
+
+    except BusyError:
+        await manager.send_message(BUSY_MESSAGE, websocket)
+        return "busy"
+    except WebSocketDisconnect:
+        raise
+    except Exception as e:
+        await manager.send_message(f"Error: {str(e)}", websocket)
+        annotate_turn(error=str(e))
+        return "error"
+    return "answered"
+
+# WebSocket endpoint for chatbot; /api/chat/ws?shards=acme,globex only searches those shards (default: the
+# default shard). shards=* searches every shard, if INDEX_ALLOW_ALL_SHARDS is set; otherwise the connection is refused
 @router.websocket("/chat/ws")
-async def websocket_endpoint(websocket: WebSocket):
+async def websocket_endpoint(websocket: WebSocket, stream: bool = False, shards: Optional[str] = None):
+    try:
+        shard_names = shard_scope(parse_shards(shards), settings.INDEX_ALLOW_ALL_SHARDS)
+    except ValueError as e:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=str(e))
+        return
     await manager.connect(websocket)
+    session = uuid.uuid4().hex
+    request_id = 0
     try:
         while True:
             # Receive message from client
             data = await websocket.receive_text()
-
-            if not RAW_KNOWLEDGE_BASE:
-                await manager.send_message("No data available", websocket)
-                continue
-
+            request_id += 1
+
+            turn = {
+                "session": session, "request_id": request_id, "protocol": "stream" if stream else "plain",
+                "question": data, "created_at": datetime.now(timezone.utc), "stages": {},
+            }
+            token = current_turn.set(turn)
+            started = time.perf_counter()
             try:
-                # Generate response
-                response, metadata = answer_with_groq_api(data, KNOWLEDGE_VECTOR_DATABASE)
-                print(response)
-                print(metadata)
-                await manager.send_message(response, websocket)
-
-                # Send related PDF files
-                # for meta in metadata:
-                #     pdf_path = get_pdf_path_from_metadata(meta)
-                #     if pdf_path and pdf_path.exists():
-                #         await send_pdf_file(websocket, pdf_path)
-                #     else:
-                #         await manager.send_message(f"PDF not found: {meta.get('source')}", websocket)
-
-            except Exception as e:
-                await manager.send_message(f"Error: {str(e)}", websocket)
+                if stream:
+                    outcome = await stream_answer(websocket, data, request_id, shard_names)
+                else:
+                    outcome = await send_answer(websocket, data, shard_names)
+                observe_stage("total", time.perf_counter() - started)
+            finally:
+                current_turn.reset(token)
+            CHAT_REQUESTS.labels(outcome).inc()
+            turn["outcome"] = outcome
+            chat_log.log(turn)
     except WebSocketDisconnect:
         manager.disconnect(websocket)
-
-# Watchdog handler for CSV directory
-class CSVWatchdogHandler(FileSystemEventHandler):
-    def on_modified(self, event):
-        if event.src_path.endswith(".csv"):
-            print("CSV file updated, reloading data...")
-            global RAW_KNOWLEDGE_BASE
-            RAW_KNOWLEDGE_BASE = load_csv_files() or []
-            docs_processed = split_documents(512, RAW_KNOWLEDGE_BASE)
-            global KNOWLEDGE_VECTOR_DATABASE
-            KNOWLEDGE_VECTOR_DATABASE = FAISS.from_documents(docs_processed, embedding_model, distance_strategy="cosine")
-
-# Watchdog observer for CSV changes
-def start_watchdog():
-    observer = Observer()
-    observer.schedule(CSVWatchdogHandler(), path=str(csv_folder), recursive=False)
-    observer.start()
-
-# Run watchdog in a separate thread
-watchdog_thread = threading.Thread(target=start_watchdog, daemon=True)
-watchdog_thread.start()
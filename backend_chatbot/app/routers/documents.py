@@ -1,17 +1,132 @@
-from fastapi import APIRouter, File, UploadFile
-import shutil
+from fastapi import APIRouter, File, HTTPException, Query, Request, UploadFile
+from starlette.concurrency import run_in_threadpool
+from pathlib import Path
+from typing import AsyncIterator, List, Optional
 import os
+import tempfile
+import xxhash
+from app.core.config import settings
+from app.core.worker_role import is_index_builder
+from app.services.ingestion import SUPPORTED_EXTENSIONS, get_ingestion_queue
+from app.services.shards import DEFAULT_SHARD, is_shard_name, shard_source
 
 router = APIRouter()
 
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+def _upload_name(filename: str) -> str:
+    # Chỉ giữ tên file để tránh ghi ra ngoài thư mục upload (../)
+    name = Path(filename or "").name
+    if not name:
+        raise HTTPException(status_code=400, detail="Missing file name")
+    if Path(name).suffix.lower() not in SUPPORTED_EXTENSIONS:
+        raise HTTPException(status_code=415, detail=f"Unsupported file type: {name}")
+    return name
+
+
+def _shard(shard: Optional[str]) -> Optional[str]:
+    # Mỗi shard là một thư mục con của thư mục upload; None là thư mục upload
+    if shard is None or shard == DEFAULT_SHARD:
+        return None
+    if not is_shard_name(shard):
+        raise HTTPException(status_code=400, detail=f"Invalid shard name: {shard!r}")
+    return shard
+
+
+SHARD_QUERY = Query(None, description="Shard (company, job or upload collection) the CVs belong to; default: the top of the upload folder")
+
+
+async def _upload_file_chunks(file: UploadFile) -> AsyncIterator[bytes]:
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        yield chunk
+
+
+async def _store_upload(name: str, chunks: AsyncIterator[bytes], shard: Optional[str] = None) -> dict:
+    """Stream an upload into the upload folder (its `shard` folder, if given) and queue its ingestion.
+
+    The content hash is computed while streaming and the file is written to
+    a temporary name, then renamed into place, so the watcher never sees a
+    half-written CV.
+    """
+    upload_folder = Path(settings.UPLOAD_FOLDER) if shard is None else Path(settings.UPLOAD_FOLDER) / shard
+    upload_folder.mkdir(parents=True, exist_ok=True)  # Tạo thư mục nếu chưa tồn tại
+
+    digest = xxhash.xxh3_128()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=upload_folder, prefix=".", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as buffer:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > settings.UPLOAD_MAX_BYTES:
+                    raise HTTPException(status_code=413, detail=f"{name} is larger than {settings.UPLOAD_MAX_BYTES} bytes")
+                digest.update(chunk)
+                await run_in_threadpool(buffer.write, chunk)
+        file_path = upload_folder / name
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+    result = {
+        "filename": name,
+        "source": shard_source(shard, name),
+        "shard": shard or DEFAULT_SHARD,
+        "file_location": f"{upload_folder}/{name}",
+        "size": size,
+        "content_hash": digest.hexdigest(),
+        "job_id": None,
+        # Other workers only store the file; the builder's upload watcher ingests it
+        "status": "stored",
+    }
+    if is_index_builder():
+        job = get_ingestion_queue().submit(file_path, content_hash=digest.hexdigest())
+        result.update(job_id=job.id, status=job.status)
+    return result
+
 
 @router.post("/upload_pdf")
-async def upload_pdf(file: UploadFile = File(...)):
-    upload_folder = "./uploaded_files"
-    if not os.path.exists(upload_folder):
-        os.makedirs(upload_folder)  # Tạo thư mục nếu chưa tồn tại
-    
-    file_location = f"{upload_folder}/{file.filename}"
-    with open(file_location, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    return {"filename": file.filename, "file_location": file_location}
\ No newline at end of file
+async def upload_pdf(file: UploadFile = File(...), shard: Optional[str] = SHARD_QUERY):
+    shard = _shard(shard)
+    return await _store_upload(_upload_name(file.filename), _upload_file_chunks(file), shard)
+
+
+@router.post("/upload_pdfs")
+async def upload_pdfs(files: List[UploadFile] = File(...), shard: Optional[str] = SHARD_QUERY):
+    """Upload many CVs in one request; each file gets its own result or error."""
+    shard = _shard(shard)
+    results = []
+    for file in files:
+        try:
+            results.append(await _store_upload(_upload_name(file.filename), _upload_file_chunks(file), shard))
+        except HTTPException as e:
+            results.append({"filename": file.filename, "error": e.detail, "status_code": e.status_code})
+    return {"files": results}
+
+
+@router.put("/upload_stream")
+async def upload_stream(request: Request, filename: str = Query(...), shard: Optional[str] = SHARD_QUERY):
+    """Raw request body upload, written to disk as it arrives (no multipart buffering)."""
+    shard = _shard(shard)
+    name = _upload_name(filename)
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > settings.UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"{name} is larger than {settings.UPLOAD_MAX_BYTES} bytes")
+    return await _store_upload(name, request.stream(), shard)
+
+
+@router.get("/ingest/jobs")
+async def ingestion_stats():
+    if not is_index_builder():
+        return {"builder": False}
+    return get_ingestion_queue().stats()
+
+
+@router.get("/ingest/jobs/{job_id}")
+async def ingestion_job(job_id: str):
+    job = get_ingestion_queue().get(job_id) if is_index_builder() else None
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
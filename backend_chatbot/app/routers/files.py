@@ -0,0 +1,105 @@
+from fastapi import APIRouter, HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+from pathlib import Path
+import os
+from typing import BinaryIO
+from app.core.config import settings
+from app.core.metrics import FILE_RESPONSES
+from app.services.file_delivery import ContentHashes, file_response
+from app.services.ingestion import SUPPORTED_EXTENSIONS
+from app.services.previews import get_preview_store
+from app.services.shards import is_shard_name
+
+router = APIRouter()
+
+MEDIA_TYPES = {
+    ".pdf": "application/pdf",
+    ".doc": "application/msword",
+    ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+}
+
+content_hashes = ContentHashes()
+
+
+def _open_cv(name: str) -> BinaryIO:
+    # Chỉ phục vụ file nằm trong thư mục upload hoặc một thư mục shard của nó (không cho ../)
+    parts = name.split("/")
+    if (len(parts) > 2 or (len(parts) == 2 and not is_shard_name(parts[0])) or Path(parts[-1]).name != parts[-1]
+            or Path(name).suffix.lower() not in SUPPORTED_EXTENSIONS):
+        raise HTTPException(status_code=404, detail="CV not found")
+    try:
+        return open(Path(settings.UPLOAD_FOLDER) / name, "rb")
+    except (FileNotFoundError, IsADirectoryError):
+        raise HTTPException(status_code=404, detail="CV not found")
+
+
+def _open_cv_with_hash(name: str):
+    """The open CV and its content hash; the hash covers exactly the bytes that will be sent."""
+    file = _open_cv(name)
+    try:
+        return file, content_hashes.get(file)
+    except BaseException:
+        file.close()
+        raise
+
+
+def cv_urls(request, name: str) -> dict:
+    """Links to a CV (its source: "<shard>/<file name>" or a file name), its preview and (PDF only) its thumbnail.
+
+    `request` is the HTTP request or WebSocket.
+    """
+    urls = {
+        "url": str(request.app.url_path_for("cv_file", name=name)),
+        "preview_url": str(request.app.url_path_for("cv_preview", name=name)),
+    }
+    if Path(name).suffix.lower() == ".pdf":
+        urls["thumbnail_url"] = str(request.app.url_path_for("cv_thumbnail", name=name))
+    return urls
+
+
+@router.api_route("/cv/{name:path}/thumbnail", methods=["GET", "HEAD"])
+async def cv_thumbnail(request: Request, name: str):
+    """JPEG of page 1 of a PDF CV, rendered at ingest."""
+    file, content_hash = await run_in_threadpool(_open_cv_with_hash, name)
+    file.close()
+    previews = get_preview_store()
+    if previews is None or not previews.has_thumbnail(content_hash):
+        raise HTTPException(status_code=404, detail="No thumbnail for this CV")
+    try:
+        thumbnail = open(previews.thumbnail_path(content_hash), "rb")
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="No thumbnail for this CV")
+    response, status = file_response(request, thumbnail, f'"{content_hash}-thumbnail"', "image/jpeg")
+    FILE_RESPONSES.labels("thumbnail", str(status)).inc()
+    return response
+
+
+@router.get("/cv/{name:path}/preview")
+async def cv_preview(request: Request, name: str):
+    """What a result list shows for a CV: size, text preview and links, without the file itself."""
+    file, content_hash = await run_in_threadpool(_open_cv_with_hash, name)
+    size = os.fstat(file.fileno()).st_size
+    file.close()
+    previews = get_preview_store()
+    has_thumbnail = previews is not None and previews.has_thumbnail(content_hash)
+    urls = cv_urls(request, name)
+    return {
+        "source": name,
+        "content_hash": content_hash,
+        "size": size,
+        "text": previews.text(content_hash) if previews is not None else None,
+        "url": urls["url"],
+        "thumbnail_url": urls.get("thumbnail_url") if has_thumbnail else None,
+    }
+
+
+# After the thumbnail and preview routes: "{name:path}" would also match their paths
+@router.api_route("/cv/{name:path}", methods=["GET", "HEAD"])
+async def cv_file(request: Request, name: str):
+    """The CV file, with byte ranges and an ETag from its content hash."""
+    file, content_hash = await run_in_threadpool(_open_cv_with_hash, name)
+    response, status = file_response(
+        request, file, f'"{content_hash}"', MEDIA_TYPES[Path(name).suffix.lower()], filename=Path(name).name
+    )
+    FILE_RESPONSES.labels("file", str(status)).inc()
+    return response
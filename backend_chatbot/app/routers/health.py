@@ -1,7 +1,16 @@
 from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from app.core.warmup import warmup
 
 router = APIRouter()
 
 @router.get("/health")
 async def health_check():
     return {"status": "ok"}
+
+# Readiness probe: 503 until the embedding model and the index are loaded
+@router.get("/health/ready")
+async def readiness_check():
+    status = warmup.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
@@ -0,0 +1,10 @@
+from fastapi import APIRouter, Response
+
+from app.core import metrics
+
+router = APIRouter()
+
+@router.get("/metrics")
+async def prometheus_metrics():
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
@@ -0,0 +1,135 @@
+import time
+from typing import Dict, List, Optional, Union
+
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel, Field
+from starlette.concurrency import run_in_threadpool
+
+from app.core.concurrency import BusyError, RequestLimiter
+from app.core.config import settings
+from app.core.metrics import SEARCH_QUERIES, SEARCH_STAGE
+from app.core.warmup import warmup
+from app.routers.chat import BUSY_MESSAGE, KNOWLEDGE_VECTOR_DATABASE, NOT_READY_MESSAGE
+from app.services.keyword_index import describe, parse_skill_filter
+from app.services.shards import shard_scope
+
+router = APIRouter()
+
+# Large batches would otherwise take every retrieval thread from the chat
+search_limiter = RequestLimiter(
+    max_concurrency=settings.SEARCH_MAX_CONCURRENCY,
+    max_queue=settings.SEARCH_MAX_QUEUE,
+    queue_timeout=settings.CHAT_QUEUE_TIMEOUT,
+)
+
+
+class BatchSearchRequest(BaseModel):
+    queries: List[str] = Field(..., min_length=1, description="Job descriptions or questions, one per query")
+    k: int = Field(5, ge=1, le=100, description="CVs returned per query")
+    fetch_k: Optional[int] = Field(None, ge=1, description="Chunks fetched per query before grouping (default 10 * k)")
+    filter: Optional[Dict[str, Union[str, List[str]]]] = Field(
+        None, description='Metadata the chunks must have, e.g. {"source": ["a.pdf", "b.pdf"]}'
+    )
+    include_text: bool = Field(False, description="Also return the text of each CV's best chunk")
+    keywords: Optional[str] = Field(
+        None, description='Skill filter the CVs must match, e.g. "python AND (django OR flask) AND NOT php"'
+    )
+    shards: Optional[List[str]] = Field(
+        None, description='Shards (companies, jobs, upload collections) to search, e.g. ["acme"]; default: the default '
+                          'shard; ["*"]: every shard, if INDEX_ALLOW_ALL_SHARDS is set'
+    )
+
+
+class SkillSearchRequest(BaseModel):
+    query: str = Field(..., min_length=1, description='Skill filter, e.g. "python AND (django OR flask) AND NOT php"')
+    k: int = Field(20, ge=1, le=1000, description="CVs returned, best BM25 score first")
+    shards: Optional[List[str]] = Field(None, description='Shards to search; default: the default shard; ["*"]: every shard')
+
+
+def _skill_filter(query: str):
+    expression = parse_skill_filter(query, known_skills_only=False)
+    if expression is None:
+        raise HTTPException(status_code=422, detail=f"Not a skill filter: {query!r}")
+    return expression
+
+
+def _shards(names: Optional[List[str]]) -> List[str]:
+    try:
+        return shard_scope(names, settings.INDEX_ALLOW_ALL_SHARDS)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _run_batch_search(request: BatchSearchRequest, shards: List[str]) -> dict:
+    # One version of each shard for the whole batch, even if a newer one goes live meanwhile
+    snapshot = KNOWLEDGE_VECTOR_DATABASE.snapshot(shards)
+    filter = request.filter
+    if request.keywords is not None:
+        # Keyword pre-filter: only the chunks of matching CVs are searched
+        with SEARCH_STAGE["keywords"].time():
+            expression = _skill_filter(request.keywords)
+            matching = snapshot.keywords.matching_sources(expression) if snapshot.keywords is not None else []
+        listed = (filter or {}).get("source")
+        if listed is not None:
+            listed = set(listed if isinstance(listed, list) else [listed])
+            matching = [source for source in matching if source in listed]
+        filter = dict(filter or {}, source=matching)
+    with SEARCH_STAGE["embed"].time():
+        vectors = KNOWLEDGE_VECTOR_DATABASE.embed_queries(request.queries)
+    with SEARCH_STAGE["search"].time():
+        hits = snapshot.search_sources(vectors, request.k, request.fetch_k, filter)
+    results = []
+    for query, sources in zip(request.queries, hits):
+        items = [hit.to_dict() for hit in sources]
+        if request.include_text:
+            for item in items:
+                item["text"] = snapshot.document((item["shard"], item["best_chunk"])).page_content
+        results.append({"query": query, "sources": items})
+    return {"version": snapshot.version, "shards": snapshot.versions, "results": results}
+
+
+# Retrieval only: embeds all queries in one call, searches them in one FAISS call, never calls the LLM
+@router.post("/search/batch")
+async def batch_search(request: BatchSearchRequest):
+    if len(request.queries) > settings.SEARCH_MAX_QUERIES:
+        raise HTTPException(status_code=413, detail=f"At most {settings.SEARCH_MAX_QUERIES} queries per request")
+    if request.keywords is not None:
+        _skill_filter(request.keywords)
+    shards = _shards(request.shards)
+    if not warmup.ready:
+        raise HTTPException(status_code=503, detail=NOT_READY_MESSAGE)
+    if KNOWLEDGE_VECTOR_DATABASE.is_empty(shards):
+        return {"version": 0, "shards": {}, "results": [{"query": query, "sources": []} for query in request.queries]}
+
+    started = time.perf_counter()
+    try:
+        async with search_limiter.slot():
+            response = await run_in_threadpool(_run_batch_search, request, shards)
+    except BusyError:
+        raise HTTPException(status_code=503, detail=BUSY_MESSAGE)
+    SEARCH_STAGE["total"].observe(time.perf_counter() - started)
+    SEARCH_QUERIES.inc(len(request.queries))
+    return response
+
+
+# Boolean skill filter over the keyword index: milliseconds, no embedding, no LLM
+@router.post("/search/skills")
+async def skill_search(request: SkillSearchRequest):
+    expression = _skill_filter(request.query)
+    shards = _shards(request.shards)
+    if not warmup.ready:
+        raise HTTPException(status_code=503, detail=NOT_READY_MESSAGE)
+    # Loading shards reads from disk: off the event loop
+    snapshot = await run_in_threadpool(KNOWLEDGE_VECTOR_DATABASE.snapshot, shards)
+    if snapshot.keywords is None:
+        return {"version": snapshot.version, "shards": snapshot.versions, "query": describe(expression), "total": 0,
+                "sources": []}
+    with SEARCH_STAGE["keywords"].time():
+        total, matches = await run_in_threadpool(snapshot.keywords.filter, expression, request.k)
+    return {
+        "version": snapshot.version,
+        "shards": snapshot.versions,
+        "query": describe(expression),
+        "total": total,
+        "sources": [{"source": source, "score": score} for source, score in matches],
+    }
@@ -1,65 +1,47 @@
-from dotenv import load_dotenv
-import os
-from groq import Groq
-from typing import Optional, List, Tuple
-from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
-from transformers import AutoTokenizer, AutoModelForCausalLM
-from langchain.docstore.document import Document as LangchainDocument
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from tqdm.notebook import tqdm
-import pandas as pd
-
-load_dotenv()
-
-client = Groq()
+"""Standalone RAG pipeline over a single CSV of resumes, for manual testing.
 
-# Đọc dữ liệu từ CSV
-df = pd.read_csv('app\services\CV.csv')
+Importing this module does no work; everything happens in `main()`:
 
-# Tạo RAW_BASE
-RAW_KNOWLEDGE_BASE = [
-    LangchainDocument(
-        page_content=f"Resume: {row['Resume']}",
-        metadata={"source": row['source']}
-    )
-    for _, row in tqdm(df.iterrows(), total=len(df))
-]
+    python -m app.services.RAG [question] [--csv app/services/CV.csv]
+"""
+import argparse
+import asyncio
+from pathlib import Path
+from typing import List, Optional, Tuple
 
-# Chunking và chuẩn bị dữ liệu
-def split_documents(chunk_size: int, knowledge_base: List[LangchainDocument]) -> List[LangchainDocument]:
-    text_splitter = RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
-        AutoTokenizer.from_pretrained("thenlper/gte-small"),
-        chunk_size=chunk_size,
-        chunk_overlap=int(chunk_size / 10),
-        add_start_index=False,
-        strip_whitespace=True,
-        separators=[". ", ", "]
-    )
+from dotenv import load_dotenv
+from langchain.docstore.document import Document as LangchainDocument
+from langchain_community.vectorstores import FAISS
 
-    docs_processed = []
-    for doc in knowledge_base:
-        docs_processed += text_splitter.split_documents([doc])
+from app.services.knowledge_index import split_documents
+from app.services.llm import LLMBackend, create_llm_backend
 
-    # Loại bỏ bản sao
-    unique_texts = {}
-    docs_processed_unique = []
-    for doc in docs_processed:
-        if doc.page_content not in unique_texts:
-            unique_texts[doc.page_content] = True
-            docs_processed_unique.append(doc)
+DEFAULT_CSV = Path("app/services/CV.csv")
 
-    return docs_processed_unique
+# Đọc dữ liệu từ CSV
+def load_knowledge_base(csv_path: Path) -> List[LangchainDocument]:
+    import pandas as pd
+
+    df = pd.read_csv(csv_path)
+    return [
+        LangchainDocument(
+            page_content=f"Resume: {row['Resume']}",
+            metadata={"source": row['source']}
+        )
+        for _, row in df.iterrows()
+    ]
 
 # Tạo vector database
-embedding_model = HuggingFaceEmbeddings(
-    model_name="thenlper/gte-small",
-    model_kwargs={"device": "cpu"},
-    encode_kwargs={"normalize_embeddings": True}
-)
+def build_vector_database(knowledge_base: List[LangchainDocument], chunk_size: int = 512) -> FAISS:
+    from langchain_huggingface import HuggingFaceEmbeddings
 
-docs_processed = split_documents(512, RAW_KNOWLEDGE_BASE)
-KNOWLEDGE_VECTOR_DATABASE = FAISS.from_documents(docs_processed, embedding_model, distance_strategy="cosine")
+    embedding_model = HuggingFaceEmbeddings(
+        model_name="thenlper/gte-small",
+        model_kwargs={"device": "cpu"},
+        encode_kwargs={"normalize_embeddings": True}
+    )
+    docs_processed = split_documents(chunk_size, knowledge_base)
+    return FAISS.from_documents(docs_processed, embedding_model, distance_strategy="cosine")
 
 # Mẫu prompt ChatGPT
 prompt_in_chat_format = [
@@ -79,8 +61,14 @@ Question: {question}"""
     },
 ]
 
-# Hàm trả lời sử dụng OpenAI API
-def answer_with_gorq_api(question: str, knowledge_index: FAISS, num_retrieved_docs: int = 5) -> Tuple[str, List[LangchainDocument]]:
+# Hàm trả lời sử dụng LLM đã cấu hình (LLM_BACKEND)
+def answer_with_llm(question: str, knowledge_index: FAISS, num_retrieved_docs: int = 5,
+                    llm: Optional[LLMBackend] = None) -> Tuple[str, List[LangchainDocument]]:
+    if llm is None:
+        from app.core.config import settings
+
+        llm = create_llm_backend(settings)
+        llm.load()
     relevant_docs = knowledge_index.similarity_search(query=question, k=num_retrieved_docs)
     relevant_content = [doc.page_content for doc in relevant_docs]
     relevant_metadatas = [doc.metadata for doc in relevant_docs]
@@ -90,26 +78,27 @@ def answer_with_gorq_api(question: str, knowledge_index: FAISS, num_retrieved_do
 
     final_prompt = prompt_in_chat_format[0]["content"].format(question=question, context=context)
 
-    # Gửi prompt tới OpenAI API
-    response = client.chat.completions.create( 
-        messages=[
-
-            {
-                "role": "user",
-                "content": final_prompt
-            }
-        ],
-        model="llama3-8b-8192",
-        stream=False,
-    )
-    # Lấy câu trả lời từ OpenAI API
-    answer = response.choices[0].message.content
+    # Gửi prompt tới LLM và lấy câu trả lời
+    answer = asyncio.run(llm.complete(final_prompt))
     return answer, relevant_metadatas
 
 # Testing
-question = "find the CV containing: Programming Languages: Python (pandas, numpy, scipy, scikit-learn, matplotlib), Sql, Java, JavaScript/JQuery. * Machine learning: Regression, SVM, NaÃ¯ve Bayes, KNN, Random Forest, Decision Trees, Boosting techniques, Cluster Analysis, Word Embedding, Sentiment Analysis"
+DEFAULT_QUESTION = "find the CV containing: Programming Languages: Python (pandas, numpy, scipy, scikit-learn, matplotlib), Sql, Java, JavaScript/JQuery. * Machine learning: Regression, SVM, NaÃ¯ve Bayes, KNN, Random Forest, Decision Trees, Boosting techniques, Cluster Analysis, Word Embedding, Sentiment Analysis"
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("question", nargs="?", default=DEFAULT_QUESTION)
+    parser.add_argument("--csv", type=Path, default=DEFAULT_CSV)
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    knowledge_index = build_vector_database(load_knowledge_base(args.csv))
+    answer, metadatas = answer_with_llm(question=args.question, knowledge_index=knowledge_index)
+
+    print(answer)
+    print(metadatas)
 
-answer, metadatas = answer_with_gorq_api(question=question, knowledge_index=KNOWLEDGE_VECTOR_DATABASE)
 
-print(answer)
-print(metadatas)
+if __name__ == "__main__":
+    main()
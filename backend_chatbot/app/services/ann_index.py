@@ -0,0 +1,237 @@
+import math
+import uuid
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+import faiss
+import numpy as np
+from langchain.docstore.document import Document as LangchainDocument
+from langchain_community.vectorstores import FAISS
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+
+@dataclass
+class AnnConfig:
+    """Index type and tuning knobs; see INDEX_* in app/core/config.py."""
+    index_type: str = "flat"
+    nlist: Optional[int] = None  # None: about 4 * sqrt(n) lists
+    nprobe: int = 16
+    pq_m: int = 48
+    pq_nbits: int = 8
+    hnsw_m: int = 32
+    ef_construction: int = 80
+    ef_search: int = 64
+    min_train: int = 4096
+
+    @classmethod
+    def from_settings(cls, settings) -> "AnnConfig":
+        return cls(
+            index_type=settings.INDEX_TYPE,
+            nlist=settings.INDEX_NLIST,
+            nprobe=settings.INDEX_NPROBE,
+            pq_m=settings.INDEX_PQ_M,
+            pq_nbits=settings.INDEX_PQ_NBITS,
+            hnsw_m=settings.INDEX_HNSW_M,
+            ef_construction=settings.INDEX_EF_CONSTRUCTION,
+            ef_search=settings.INDEX_EF_SEARCH,
+            min_train=settings.INDEX_TRAIN_MIN,
+        )
+
+    def describe(self) -> str:
+        if self.index_type in ("ivf_flat", "ivf_pq"):
+            extra = f" pq_m={self.pq_m} nbits={self.pq_nbits}" if self.index_type == "ivf_pq" else ""
+            return f"{self.index_type} nlist={self.nlist or 'auto'} nprobe={self.nprobe}{extra}"
+        if self.index_type == "hnsw":
+            return f"hnsw M={self.hnsw_m} efConstruction={self.ef_construction} efSearch={self.ef_search}"
+        return "flat"
+
+
+def _nlist(config: AnnConfig, n: int) -> int:
+    nlist = config.nlist or int(4 * math.sqrt(n))
+    # k-means wants ~39 training points per centroid
+    return max(1, min(nlist, n // 39))
+
+
+def _pq_m(config: AnnConfig, dim: int) -> int:
+    # The number of sub-quantizers has to divide the dimension
+    return max(m for m in range(1, min(config.pq_m, dim) + 1) if dim % m == 0)
+
+
+def build_index(config: AnnConfig, vectors: np.ndarray) -> faiss.Index:
+    """Create an empty index of `config.index_type`, trained on `vectors` if needed.
+
+    Every index type is searched with L2 distance; with normalized
+    embeddings this ranks exactly like cosine similarity.
+    """
+    n, dim = vectors.shape
+    if config.index_type == "flat":
+        return faiss.IndexFlatL2(dim)
+    if config.index_type == "hnsw":
+        hnsw = faiss.IndexHNSWFlat(dim, config.hnsw_m)
+        hnsw.hnsw.efConstruction = config.ef_construction
+        index = faiss.IndexIDMap2(hnsw)
+    elif config.index_type in ("ivf_flat", "ivf_pq"):
+        nlist = _nlist(config, n)
+        quantizer = faiss.IndexFlatL2(dim)
+        if config.index_type == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_L2)
+        else:
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, _pq_m(config, dim), config.pq_nbits)
+        index.train(np.ascontiguousarray(vectors, dtype=np.float32))
+    else:
+        raise ValueError(f"Unknown index type {config.index_type!r}, expected one of {INDEX_TYPES}")
+    set_search_params(index, config)
+    return index
+
+
+def index_type_of(index: faiss.Index) -> str:
+    index = faiss.downcast_index(index)
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        index = faiss.downcast_index(index.index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVF):
+        # A single inverted list is the on-disk form of a flat index (see to_mappable)
+        return "flat" if index.nlist == 1 else "ivf_flat"
+    return "flat"
+
+
+def to_mappable(index: faiss.Index) -> faiss.Index:
+    """Index to write to disk so that readers can memory-map it.
+
+    FAISS only memory-maps inverted lists, so a flat index is stored as an
+    IVF index with one list holding every vector at its own position.
+    Searching it with nprobe=1 is the same exhaustive scan.
+    """
+    index = faiss.downcast_index(index)
+    if not isinstance(index, faiss.IndexFlat):
+        return index
+    quantizer = faiss.IndexFlatL2(index.d)
+    quantizer.add(np.zeros((1, index.d), dtype=np.float32))
+    ivf = faiss.IndexIVFFlat(quantizer, index.d, 1, faiss.METRIC_L2)
+    ivf.is_trained = True
+    ivf.nprobe = 1
+    if index.ntotal:
+        ivf.add_with_ids(index.reconstruct_n(0, index.ntotal), np.arange(index.ntotal, dtype=np.int64))
+    return ivf
+
+
+def from_mappable(index: faiss.Index) -> faiss.Index:
+    """Undo `to_mappable`: a flat index stored as one-list IVF becomes flat again."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is None or index_type_of(index) != "flat":
+        return index
+    flat = faiss.IndexFlatL2(ivf.d)
+    invlists = ivf.invlists
+    size = invlists.list_size(0)
+    if size:
+        ids = faiss.rev_swig_ptr(invlists.get_ids(0), size).copy()
+        codes = faiss.rev_swig_ptr(invlists.get_codes(0), size * ivf.code_size).copy()
+        vectors = codes.view(np.float32).reshape(size, ivf.d)
+        flat.add(vectors[np.argsort(ids)])
+    return flat
+
+
+def set_search_params(index: faiss.Index, config: AnnConfig):
+    """Apply nprobe (IVF) or efSearch (HNSW) to a built or loaded index."""
+    kind = index_type_of(index)
+    if kind in ("ivf_flat", "ivf_pq"):
+        faiss.extract_index_ivf(index).nprobe = config.nprobe
+    elif kind == "hnsw":
+        faiss.downcast_index(faiss.downcast_index(index).index).hnsw.efSearch = config.ef_search
+
+
+def index_memory_bytes(index: faiss.Index) -> int:
+    """Size of the serialized index, a close proxy for its resident memory."""
+    return int(faiss.serialize_index(index).nbytes)
+
+
+class AnnFAISS(FAISS):
+    """LangChain FAISS store over an approximate index with stable int64 labels.
+
+    The stock store assumes positions 0..n-1 and renumbers them after a
+    delete, which only holds for flat indexes. Here every vector keeps the
+    label it was added with. IVF indexes remove deleted vectors; HNSW cannot,
+    so its deleted labels are only dropped from the docstore mapping and
+    skipped at search time until the index is rebuilt.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.next_label = max(self.index_to_docstore_id, default=-1) + 1
+
+    @property
+    def deleted(self) -> int:
+        return self.index.ntotal - len(self.index_to_docstore_id)
+
+    def _add_labeled(self, texts: List[str], embeddings: List[List[float]],
+                     metadatas: Optional[Iterable[dict]], ids: Optional[List[str]]) -> List[str]:
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in texts]
+        vectors = np.array(embeddings, dtype=np.float32)
+        if self._normalize_L2:
+            faiss.normalize_L2(vectors)
+        labels = np.arange(self.next_label, self.next_label + len(texts), dtype=np.int64)
+        self.index.add_with_ids(vectors, labels)
+        self.next_label += len(texts)
+        self.docstore.add({
+            id_: LangchainDocument(page_content=text, metadata=metadata)
+            for id_, text, metadata in zip(ids, texts, metadatas)
+        })
+        self.index_to_docstore_id.update({int(label): id_ for label, id_ in zip(labels, ids)})
+        return ids
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        return self._add_labeled(texts, self._embed_documents(texts), metadatas, ids)
+
+    def add_embeddings(self, text_embeddings: Iterable[Tuple[str, List[float]]],
+                       metadatas: Optional[List[dict]] = None, ids: Optional[List[str]] = None,
+                       **kwargs: Any) -> List[str]:
+        texts, embeddings = zip(*text_embeddings)
+        return self._add_labeled(list(texts), list(embeddings), metadatas, ids)
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if ids is None:
+            raise ValueError("No ids provided to delete.")
+        reversed_index = {id_: label for label, id_ in self.index_to_docstore_id.items()}
+        labels = [reversed_index[id_] for id_ in ids if id_ in reversed_index]
+        if index_type_of(self.index) != "hnsw":
+            self.index.remove_ids(np.array(labels, dtype=np.int64))
+        for label in labels:
+            del self.index_to_docstore_id[label]
+        self.docstore.delete([id_ for id_ in ids if id_ in reversed_index])
+        return True
+
+    def similarity_search_with_score_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        filter: Optional[Union[Callable, Dict[str, Any]]] = None,
+        fetch_k: int = 20,
+        **kwargs: Any,
+    ) -> List[Tuple[LangchainDocument, float]]:
+        vector = np.array([embedding], dtype=np.float32)
+        if self._normalize_L2:
+            faiss.normalize_L2(vector)
+        # Over-fetch by the number of deleted HNSW entries so k live results remain
+        fetch = min((k if filter is None else fetch_k) + self.deleted, self.index.ntotal)
+        if fetch <= 0:
+            return []
+        scores, labels = self.index.search(vector, fetch)
+        filter_func = self._create_filter_func(filter) if filter is not None else None
+        docs = []
+        for score, label in zip(scores[0], labels[0]):
+            _id = self.index_to_docstore_id.get(int(label))
+            if _id is None:
+                continue
+            doc = self.docstore.search(_id)
+            if filter_func is None or filter_func(doc.metadata):
+                docs.append((doc, float(score)))
+            if len(docs) == k:
+                break
+        return docs
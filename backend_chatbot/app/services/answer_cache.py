@@ -0,0 +1,163 @@
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+
+def normalize_question(question: str) -> str:
+    """Lower-case, collapse whitespace and drop trailing punctuation."""
+    return re.sub(r"\s+", " ", question).strip().rstrip("?!. ").lower()
+
+
+@dataclass
+class CachedAnswer:
+    answer: str
+    sources: List[dict]
+    index_version: int
+    scope: str = ""
+    created_at: float = field(default_factory=time.monotonic)
+    slot: int = -1
+
+
+class AnswerCache:
+    """LRU + TTL cache of chatbot answers, valid for one knowledge index version.
+
+    Lookups first try the normalized question text, then the nearest cached
+    query embedding with cosine similarity >= `similarity_threshold`. Query
+    embeddings are expected to be L2-normalized, so cosine is a dot product.
+
+    Answers are cached per `scope` (the shards a question was asked about),
+    each with its own index version: the answers of a scope are dropped as
+    soon as a newer version of it is seen, those of other scopes are kept.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600.0, similarity_threshold: float = 0.95):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.index_versions: Dict[str, int] = {}
+        self.hits_exact = 0
+        self.hits_semantic = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, CachedAnswer]" = OrderedDict()
+        # One row per cache slot; rows of free slots are never read
+        self._matrix: Optional[np.ndarray] = None
+        self._slot_keys: List[Optional[str]] = [None] * max_entries
+        self._free_slots = list(range(max_entries - 1, -1, -1))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        """Drop every answer, with the embedding rows and scope versions that go with them."""
+        self._entries.clear()
+        self.index_versions.clear()
+        self._matrix = None
+        self._slot_keys = [None] * self.max_entries
+        self._free_slots = list(range(self.max_entries - 1, -1, -1))
+
+    def _check_version(self, index_version: int, scope: str) -> bool:
+        """Follow a scope to a newer index version; answers for older versions are unusable."""
+        known = self.index_versions.get(scope)
+        if known is not None and index_version < known:
+            return False
+        if index_version != known:
+            if known is not None:
+                for key in [key for key, entry in self._entries.items() if entry.scope == scope]:
+                    self._evict(key)
+            self.index_versions[scope] = index_version
+        return True
+
+    def _expired(self, entry: CachedAnswer) -> bool:
+        return time.monotonic() - entry.created_at > self.ttl
+
+    def _evict(self, key: str):
+        entry = self._entries.pop(key)
+        if entry.slot >= 0:
+            self._slot_keys[entry.slot] = None
+            self._free_slots.append(entry.slot)
+
+    def get(self, question: str, index_version: int, query_embedding: Optional[Sequence[float]] = None,
+            scope: str = "") -> Optional[CachedAnswer]:
+        """Return a cached answer for `question` in `scope`, or None (counted as a miss).
+
+        Without `query_embedding` only the exact layer is consulted and a
+        miss is not counted, so the caller can retry with the embedding.
+        """
+        if not self._check_version(index_version, scope):
+            return None
+        key = f"{scope}\0{normalize_question(question)}"
+        entry = self._entries.get(key)
+        if entry is not None:
+            if self._expired(entry):
+                self._evict(key)
+            else:
+                self._entries.move_to_end(key)
+                self.hits_exact += 1
+                return entry
+        if query_embedding is None:
+            return None
+
+        entry = self._nearest(np.asarray(query_embedding, dtype=np.float32), scope)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits_semantic += 1
+        return entry
+
+    def _nearest(self, query: np.ndarray, scope: str) -> Optional[CachedAnswer]:
+        used = [slot for slot, key in enumerate(self._slot_keys)
+                if key is not None and self._entries[key].scope == scope]
+        if not used or self._matrix is None:
+            return None
+        scores = self._matrix[used] @ query
+        for best in np.argsort(-scores):
+            if scores[best] < self.similarity_threshold:
+                return None
+            key = self._slot_keys[used[best]]
+            entry = self._entries[key]
+            if self._expired(entry):
+                self._evict(key)
+                continue
+            self._entries.move_to_end(key)
+            return entry
+        return None
+
+    def put(self, question: str, index_version: int, answer: str, sources: List[dict],
+            query_embedding: Optional[Sequence[float]] = None, scope: str = ""):
+        # An answer computed against an older index version is never stored
+        if self.max_entries == 0 or not self._check_version(index_version, scope):
+            return
+        key = f"{scope}\0{normalize_question(question)}"
+        if key in self._entries:
+            self._evict(key)
+        while len(self._entries) >= self.max_entries:
+            self._evict(next(iter(self._entries)))
+
+        entry = CachedAnswer(answer=answer, sources=sources, index_version=index_version, scope=scope)
+        if query_embedding is not None:
+            vector = np.asarray(query_embedding, dtype=np.float32)
+            if self._matrix is None:
+                self._matrix = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+            entry.slot = self._free_slots.pop()
+            self._matrix[entry.slot] = vector
+            self._slot_keys[entry.slot] = key
+        self._entries[key] = entry
+        if len(self.index_versions) > self.max_entries:
+            # Forget the versions of scopes left without answers
+            live = {entry.scope for entry in self._entries.values()}
+            self.index_versions = {scope: version for scope, version in self.index_versions.items() if scope in live}
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits_exact + self.hits_semantic + self.misses
+        return {
+            "size": len(self._entries),
+            "scopes": len(self.index_versions),
+            "hits_exact": self.hits_exact,
+            "hits_semantic": self.hits_semantic,
+            "misses": self.misses,
+            "hit_rate": (self.hits_exact + self.hits_semantic) / lookups if lookups else 0.0,
+        }
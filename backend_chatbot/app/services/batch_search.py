@@ -0,0 +1,161 @@
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+from app.services.ann_index import index_type_of
+
+# Filter value: a single value to match exactly, or a list of accepted values
+MetadataFilter = Dict[str, Any]
+
+
+@dataclass
+class SourceHit:
+    """One CV in the results of a query, scored by its best matching chunk."""
+    source: str
+    score: float  # cosine similarity of the best chunk
+    matched_chunks: int  # chunks of this CV among those fetched for the query
+    best_chunk: str  # docstore id of the best chunk
+    shard: Optional[str] = None  # shard the CV was found in, when searched through a ShardedSnapshot
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def _accepts(value) -> Callable[[Any], bool]:
+    if isinstance(value, (list, tuple, set)):
+        accepted = set(value)
+        return lambda v: v in accepted
+    return lambda v: v == value
+
+
+def _source_labels(snapshot, sources: List[str]) -> np.ndarray:
+    label_of = snapshot.chunk_labels()
+    labels = {
+        label_of[cid]
+        for source in sources
+        for cid in (snapshot.source_chunk_ids or {}).get(source, ())
+        if cid in label_of
+    }
+    return np.fromiter(labels, dtype=np.int64, count=len(labels)) if labels else np.empty(0, dtype=np.int64)
+
+
+def _search_params(index: faiss.Index, selector, fetch: int):
+    kind = index_type_of(index)
+    if kind == "hnsw":
+        hnsw = faiss.downcast_index(faiss.downcast_index(index).index).hnsw
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=max(hnsw.efSearch, fetch))
+    try:
+        # IVF indexes, including the single-list on-disk form of a flat index
+        return faiss.SearchParametersIVF(sel=selector, nprobe=faiss.extract_index_ivf(index).nprobe)
+    except RuntimeError:
+        return faiss.SearchParameters(sel=selector)
+
+
+def search_chunks(snapshot, vector, k: int, sources: Optional[List[str]] = None) -> List[Tuple[str, float]]:
+    """Nearest `k` (chunk id, cosine similarity) to `vector`, only among the chunks of `sources` if given."""
+    store = snapshot.vector_store
+    if store is None:
+        return []
+    index = store.index
+    params = None
+    if sources is not None:
+        labels = _source_labels(snapshot, sources)
+        if not len(labels):
+            return []
+        params = _search_params(index, faiss.IDSelectorBatch(labels), k)
+    # HNSW keeps deleted vectors in the graph: over-fetch by their number
+    window = min(k + index.ntotal - len(store.index_to_docstore_id), index.ntotal)
+    query = np.ascontiguousarray([vector], dtype=np.float32)
+    distances, labels = index.search(query, window) if params is None else index.search(query, window, params=params)
+    hits = []
+    for distance, label in zip(distances[0], labels[0]):
+        cid = store.index_to_docstore_id.get(int(label)) if label >= 0 else None
+        if cid is not None and len(hits) < k:
+            hits.append((cid, 1.0 - float(distance) / 2))
+    return hits
+
+
+def search_sources(snapshot, vectors: np.ndarray, k: int = 5, fetch_k: Optional[int] = None,
+                   filter: Optional[MetadataFilter] = None) -> List[List[SourceHit]]:
+    """Top `k` CVs for each row of `vectors`, searched with one FAISS call for all queries.
+
+    Chunks are fetched per query (`fetch_k`, default 10 * k) and grouped by
+    the CVs that contain them; a CV scores as its best chunk. A list of
+    sources in `filter` restricts the search itself to their chunks; other
+    metadata keys are checked on the fetched chunks, and queries left with
+    fewer than `k` CVs are searched again with a wider window.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    results: List[List[SourceHit]] = [[] for _ in range(len(vectors))]
+    store = snapshot.vector_store
+    if store is None or not len(vectors):
+        return results
+    index = store.index
+    filter = dict(filter or {})
+
+    selector = None
+    sources = filter.get("source")
+    if sources is not None and snapshot.source_chunk_ids is not None:
+        labels = _source_labels(snapshot, sources if isinstance(sources, (list, tuple, set)) else [sources])
+        if not len(labels):
+            return results
+        selector = faiss.IDSelectorBatch(labels)
+        total = len(labels)
+    else:
+        total = index.ntotal
+    # HNSW keeps deleted vectors in the graph: over-fetch by their number
+    deleted = index.ntotal - len(store.index_to_docstore_id)
+
+    checks = {key: _accepts(value) for key, value in filter.items()}
+    metadata_keys = set(checks) - {"source"}
+    id_map = store.index_to_docstore_id
+    metadata_of: Dict[str, dict] = {}
+
+    def owners(cid: str) -> List[str]:
+        if snapshot.chunk_sources is not None:
+            return snapshot.chunk_sources.get(cid, [])
+        return [store.docstore.search(cid).metadata["source"]]
+
+    def accepted(cid: str, source: str) -> bool:
+        if "source" in checks and not checks["source"](source):
+            return False
+        if metadata_keys:
+            if cid not in metadata_of:
+                metadata_of[cid] = store.docstore.search(cid).metadata
+            metadata = metadata_of[cid]
+            return all(checks[key](metadata.get(key)) for key in metadata_keys)
+        return True
+
+    fetch = min(fetch_k or 10 * k, total)
+    pending = np.arange(len(vectors))
+    while len(pending):
+        window = min(fetch + deleted, index.ntotal)
+        if selector is None:
+            distances, labels = index.search(vectors[pending], window)
+        else:
+            distances, labels = index.search(vectors[pending], window, params=_search_params(index, selector, window))
+        retry = []
+        for row, query in enumerate(pending):
+            hits: Dict[str, SourceHit] = {}
+            # Nearest first, so the first chunk seen of a CV is its best
+            for distance, label in zip(distances[row], labels[row]):
+                cid = id_map.get(int(label)) if label >= 0 else None
+                if cid is None:
+                    continue
+                for source in owners(cid):
+                    if not accepted(cid, source):
+                        continue
+                    hit = hits.get(source)
+                    if hit is None:
+                        # Normalized vectors: squared L2 distance d = 2 - 2 cos
+                        hits[source] = SourceHit(source, round(1.0 - float(distance) / 2, 6), 1, cid)
+                    else:
+                        hit.matched_chunks += 1
+            results[query] = list(hits.values())[:k]
+            if len(results[query]) < k and window < min(total + deleted, index.ntotal):
+                retry.append(query)
+        pending = np.array(retry, dtype=np.int64)
+        fetch *= 4
+    return results
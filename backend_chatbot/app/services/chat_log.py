@@ -0,0 +1,182 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Deque, List
+
+from pymongo.errors import BulkWriteError
+
+from app.core.metrics import CHAT_LOG_BUFFERED, CHAT_LOG_RECORDS
+
+logger = logging.getLogger("app_logger")
+
+# Longest pause between two attempts while MongoDB is unreachable
+MAX_RETRY_DELAY = 30.0
+
+
+class ChatLog:
+    """Write-behind log of chat turns in a MongoDB collection.
+
+    `log()` only appends a record to an in-process buffer, so answering a
+    question never waits on the database. `writers` tasks drain the buffer
+    with `insert_many`, as soon as `batch_size` records are waiting or
+    after `flush_interval` seconds otherwise.
+
+    The buffer holds at most `max_buffer` records. When MongoDB falls
+    behind, `log()` drops new records (counted as dropped) rather than
+    slowing the chat down, while `put()` waits for room. A batch that
+    cannot be written goes back to the front of the buffer and is retried
+    with a growing delay; the `_id` set on the first attempt makes the
+    retry idempotent.
+    """
+
+    def __init__(self, batch_size: int = 500, flush_interval: float = 1.0, max_buffer: int = 20000, writers: int = 2):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max(max_buffer, batch_size)
+        self.writers = writers
+        self._collection = None
+        self._buffer: Deque[dict] = deque()
+        self._wakeup = asyncio.Event()
+        self._space = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self._closing = False
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self, collection):
+        """Start the writers on the running event loop; records logged before are ignored."""
+        self._collection = collection
+        self._closing = False
+        self._tasks = [
+            asyncio.create_task(self._write_loop(), name=f"chat-log-writer-{i}") for i in range(self.writers)
+        ]
+
+    def log(self, record: dict) -> bool:
+        """Queue one record without waiting; False if it was not queued. Call from the event loop."""
+        if self._collection is None or self._closing:
+            return False
+        if len(self._buffer) >= self.max_buffer:
+            self.dropped += 1
+            CHAT_LOG_RECORDS.labels("dropped").inc()
+            return False
+        self._append(record)
+        return True
+
+    async def put(self, record: dict) -> bool:
+        """Queue one record, waiting while the buffer is full: backpressure for producers that can wait.
+
+        False if it was not queued: the log is not started, or is closing.
+        """
+        while self._collection is not None and not self._closing and len(self._buffer) >= self.max_buffer:
+            self._space.clear()
+            await self._space.wait()
+        if self._collection is None or self._closing:
+            return False
+        self._append(record)
+        return True
+
+    def _append(self, record: dict):
+        self._buffer.append(record)
+        CHAT_LOG_BUFFERED.inc()
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    def _take(self) -> List[dict]:
+        batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+        if batch:
+            CHAT_LOG_BUFFERED.dec(len(batch))
+            self._space.set()
+        return batch
+
+    async def _write_loop(self):
+        failures = 0
+        while True:
+            self._wakeup.clear()
+            if len(self._buffer) < self.batch_size and not self._closing:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            batch = self._take()
+            if not batch:
+                if self._closing:
+                    return
+                continue
+            if await self._insert(batch):
+                failures = 0
+                continue
+            if self._closing:
+                return
+            failures += 1
+            await asyncio.sleep(min(self.flush_interval * 2 ** failures, MAX_RETRY_DELAY))
+
+    async def _insert(self, batch: List[dict]) -> bool:
+        """Write one batch; False if it should be retried."""
+        try:
+            await self._collection.insert_many(batch, ordered=False)
+        except asyncio.CancelledError:
+            # close() gave up on this insert: whether MongoDB got the batch is unknown
+            self._count("dropped", len(batch))
+            raise
+        except BulkWriteError as e:
+            # Rejected documents (e.g. already written by an attempt that timed out) are not retried
+            written = e.details.get("nInserted", 0)
+            self._count("written", written)
+            self._count("failed", len(batch) - written)
+            self.batches += 1
+            logger.warning(f"Chat log: {len(batch) - written} of {len(batch)} records rejected by MongoDB")
+            return True
+        except Exception as e:
+            room = max(self.max_buffer - len(self._buffer), 0)
+            kept = batch[:room]
+            self._buffer.extendleft(reversed(kept))
+            CHAT_LOG_BUFFERED.inc(len(kept))
+            self._count("failed", len(batch) - len(kept))
+            logger.warning(f"Chat log: could not write {len(batch)} records ({len(kept)} kept for a retry): {e}")
+            return False
+        self._count("written", len(batch))
+        self.batches += 1
+        return True
+
+    def _count(self, result: str, count: int):
+        if count:
+            setattr(self, result, getattr(self, result) + count)
+            CHAT_LOG_RECORDS.labels(result).inc(count)
+
+    async def close(self, timeout: float = 10.0):
+        """Write what is buffered, for at most `timeout` seconds, and stop the writers."""
+        self._closing = True
+        self._wakeup.set()
+        if self._tasks:
+            _, pending = await asyncio.wait(self._tasks, timeout=timeout)
+            for task in pending:
+                task.cancel()
+        self._tasks = []
+        if self._buffer:
+            logger.warning(f"Chat log: {len(self._buffer)} records not written at shutdown")
+            self._count("dropped", len(self._buffer))
+            CHAT_LOG_BUFFERED.dec(len(self._buffer))
+            self._buffer.clear()
+        # Producers waiting in put() for room give up
+        self._space.set()
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "collection": getattr(self._collection, "name", None),
+            "buffered": len(self._buffer),
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "batches": self.batches,
+            "batch_size": self.batch_size,
+            "flush_interval": self.flush_interval,
+            "max_buffer": self.max_buffer,
+            "writers": self.writers,
+        }
@@ -0,0 +1,148 @@
+import copy
+import multiprocessing
+import os
+import re
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Deque, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from langchain.docstore.document import Document as LangchainDocument
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_text_splitters.character import _split_text_with_regex
+
+SEPARATORS = [". ", ", "]
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(model_name: str):
+    """The tokenizer of `model_name`, loaded once per process."""
+    # transformers takes seconds to import; only processes that chunk pay for it
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(model_name)
+
+
+class BatchedTokenSplitter(RecursiveCharacterTextSplitter):
+    """Token-based RecursiveCharacterTextSplitter that counts tokens in batches.
+
+    `from_huggingface_tokenizer` encodes every piece separately while the
+    splitter recurses. `split_texts` instead cuts a whole batch of texts at
+    each separator level up front and counts all pieces with one call of
+    the fast tokenizer; the recursion then only looks the counts up. The
+    chunks are the same, since the counts are.
+    """
+
+    def __init__(self, tokenizer, **kwargs):
+        super().__init__(length_function=self._token_count, **kwargs)
+        self._tokenizer = tokenizer
+        # Counts of the batch being split, per thread
+        self._local = threading.local()
+
+    def _token_count(self, text: str) -> int:
+        counts = getattr(self._local, "counts", None)
+        if counts is None:
+            return len(self._tokenizer.encode(text))
+        count = counts.get(text)
+        if count is None:
+            count = counts[text] = len(self._tokenizer.encode(text))
+        return count
+
+    def _count(self, counts: Dict[str, int], texts: List[str]):
+        missing = list(dict.fromkeys(text for text in texts if text not in counts))
+        if missing:
+            encoded = self._tokenizer(missing, return_attention_mask=False, return_token_type_ids=False)
+            counts.update(zip(missing, map(len, encoded["input_ids"])))
+
+    def _measure(self, texts: Iterable[str]) -> Dict[str, int]:
+        # Mirrors the separator choice of RecursiveCharacterTextSplitter._split_text
+        counts: Dict[str, int] = {}
+        level = [(text, self._separators) for text in texts]
+        while level:
+            pieces: List[Tuple[str, List[str]]] = []
+            for text, separators in level:
+                separator, rest = separators[-1], []
+                for i, candidate in enumerate(separators):
+                    if re.search(re.escape(candidate), text):
+                        separator, rest = candidate, separators[i + 1:]
+                        break
+                for piece in _split_text_with_regex(text, re.escape(separator), self._keep_separator):
+                    pieces.append((piece, rest))
+            self._count(counts, [piece for piece, _ in pieces])
+            level = [(piece, rest) for piece, rest in pieces if rest and counts[piece] >= self._chunk_size]
+        return counts
+
+    def split_texts(self, texts: Sequence[str]) -> List[List[str]]:
+        """Chunks of each of `texts`."""
+        self._local.counts = self._measure(texts)
+        try:
+            return [self.split_text(text) for text in texts]
+        finally:
+            self._local.counts = None
+
+    def create_documents(self, texts: List[str], metadatas: Optional[List[dict]] = None) -> List[LangchainDocument]:
+        if self._add_start_index:
+            return super().create_documents(texts, metadatas)
+        metadatas = metadatas or [{}] * len(texts)
+        return [
+            LangchainDocument(page_content=chunk, metadata=copy.deepcopy(metadata))
+            for chunks, metadata in zip(self.split_texts(texts), metadatas)
+            for chunk in chunks
+        ]
+
+
+@lru_cache(maxsize=None)
+def get_text_splitter(chunk_size: int, model_name: str = "thenlper/gte-small") -> BatchedTokenSplitter:
+    """Build the token-based splitter once per (chunk_size, tokenizer)."""
+    return BatchedTokenSplitter(
+        get_tokenizer(model_name),
+        chunk_size=chunk_size,
+        chunk_overlap=int(chunk_size / 10),
+        add_start_index=False,
+        strip_whitespace=True,
+        separators=SEPARATORS
+    )
+
+
+def split_texts(chunk_size: int, model_name: str, texts: Sequence[str]) -> List[List[str]]:
+    return get_text_splitter(chunk_size, model_name).split_texts(texts)
+
+
+def _init_worker():
+    # One process per core already; the tokenizer's own thread pool would oversubscribe
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+
+def split_batches(chunk_size: int, model_name: str, batches: Iterable[Sequence[str]], workers: int = 1,
+                  pool_min: int = 2000) -> Iterator[List[List[str]]]:
+    """Chunks of each batch of texts, yielded batch by batch in order.
+
+    The first `pool_min` texts are split in this process. When the stream
+    goes on beyond that (a full reindex), the rest is spread over `workers`
+    spawned processes with at most two batches per worker in flight, so
+    the caller embeds one batch while the next ones are being split and
+    memory stays bounded by the window instead of the corpus.
+    """
+    batches = iter(batches)
+    done = 0
+    for batch in batches:
+        yield split_texts(chunk_size, model_name, batch)
+        done += len(batch)
+        if workers > 1 and done >= pool_min:
+            break
+    else:
+        return
+
+    # spawn: never fork a process that already holds model threads and locks
+    pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"), initializer=_init_worker)
+    try:
+        pending: Deque = deque()
+        for batch in batches:
+            pending.append(pool.submit(split_texts, chunk_size, model_name, list(batch)))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # Also reached when the caller stops early: drop the batches not started yet
+        pool.shutdown(cancel_futures=True)
@@ -0,0 +1,186 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from langchain.docstore.document import Document as LangchainDocument
+
+# Shortest run of text taken as the overlap between two chunks of one CV
+MIN_OVERLAP_CHARS = 16
+# Upper bound of the tokens of a separator between passages ("\n...\n")
+SEPARATOR_TOKENS = 3
+
+
+@dataclass
+class PackedContext:
+    """Context of one prompt: retrieved chunks grouped per CV within a token budget."""
+    text: str
+    sources: List[dict]  # metadata of each CV in the context, best first
+    tokens: int  # tokens of `text`
+    baseline_tokens: int  # tokens of the same chunks pasted unchanged, one "Document" each
+    chunks: int = 0  # chunks packed, out of `candidates`
+    candidates: int = 0
+    dropped: List[str] = field(default_factory=list)  # sources retrieved but left out for lack of budget
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.baseline_tokens - self.tokens
+
+    def stats(self) -> dict:
+        return {
+            "context_tokens": self.tokens,
+            "baseline_tokens": self.baseline_tokens,
+            "tokens_saved": self.tokens_saved,
+            "chunks": self.chunks,
+            "candidates": self.candidates,
+        }
+
+
+def overlap(left: str, right: str) -> int:
+    """Length of the longest suffix of `left` that starts `right` (0 below MIN_OVERLAP_CHARS)."""
+    if len(left) < MIN_OVERLAP_CHARS or len(right) < MIN_OVERLAP_CHARS:
+        return 0
+    head = right[:MIN_OVERLAP_CHARS]
+    start = max(0, len(left) - len(right))
+    while True:
+        position = left.find(head, start)
+        if position < 0:
+            return 0
+        length = len(left) - position
+        if right.startswith(left[position:]):
+            return length
+        start = position + 1
+
+
+def document_block(number: int, source: str, text: str) -> str:
+    return f"Document {number} ({source}):\n{text}"
+
+
+class ContextBuilder:
+    """Packs retrieved chunks into a prompt context of at most `max_tokens` tokens.
+
+    Chunks are grouped by `source`; chunks of one CV that overlap (the
+    splitter repeats ~10% of each chunk in the next) are merged into one
+    passage without the repeated text. Candidates are then taken greedily
+    by score density: relevance above the weakest candidate, per token the
+    chunk actually adds, so a neighbour of an already chosen chunk only
+    pays for its new text. Tokens are counted with the chunking tokenizer.
+    """
+
+    def __init__(self, tokenizer, max_tokens: int = 2048):
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+
+    def count(self, texts: Sequence[str]) -> List[int]:
+        if not texts:
+            return []
+        encoded = self.tokenizer(
+            list(texts), add_special_tokens=False, return_attention_mask=False, return_token_type_ids=False
+        )
+        return [len(ids) for ids in encoded["input_ids"]]
+
+    def build(self, scored: Sequence[Tuple[LangchainDocument, float]]) -> PackedContext:
+        """Context of `scored` (chunk, similarity) pairs, best first."""
+        docs = [doc for doc, _ in scored]
+
+        # Overlapping chunks of the same CV: chunk -> (chunk it continues, overlapping chars), and back
+        by_source: Dict[str, List[int]] = {}
+        for i, doc in enumerate(docs):
+            by_source.setdefault(doc.metadata["source"], []).append(i)
+        predecessor_of: Dict[int, Tuple[int, int]] = {}
+        successor_of: Dict[int, int] = {}
+        for members in by_source.values():
+            for a in members:
+                for b in members:
+                    if a != b and b not in predecessor_of and a not in successor_of:
+                        chars = overlap(docs[a].page_content, docs[b].page_content)
+                        if chars:
+                            predecessor_of[b] = (a, chars)
+                            successor_of[a] = b
+
+        # One tokenizer call: every chunk, its text without the overlap, the headers
+        tails = {b: docs[b].page_content[chars:] for b, (_, chars) in predecessor_of.items()}
+        headers = {source: document_block(99, source, "") for source in by_source}
+        counts = self.count([doc.page_content for doc in docs] + list(tails.values()) + list(headers.values()))
+        full = counts[:len(docs)]
+        tail_tokens = dict(zip(tails, counts[len(docs):len(docs) + len(tails)]))
+        header_tokens = dict(zip(headers, counts[len(docs) + len(tails):]))
+
+        scores = [score for _, score in scored]
+        floor = min(scores, default=0.0)
+        chosen: List[int] = []
+        chosen_set = set()
+        used = 0
+        remaining = set(range(len(docs)))
+        while remaining:
+            best, best_density, best_cost = None, -1.0, 0
+            for i in remaining:
+                cost = tail_tokens[i] if predecessor_of.get(i, (None,))[0] in chosen_set else full[i]
+                source = docs[i].metadata["source"]
+                if not any(docs[j].metadata["source"] == source for j in chosen):
+                    cost += header_tokens[source]
+                cost += SEPARATOR_TOKENS
+                density = (scores[i] - floor + 1e-6) / max(cost, 1)
+                if used + cost <= self.max_tokens and density > best_density:
+                    best, best_density, best_cost = i, density, cost
+            if best is None:
+                break
+            chosen.append(best)
+            chosen_set.add(best)
+            remaining.discard(best)
+            used += best_cost
+
+        # Render per CV, CVs by best chosen score; overlapping chunks as one passage in document order
+        order: List[str] = []
+        for i in sorted(chosen, key=lambda i: -scores[i]):
+            source = docs[i].metadata["source"]
+            if source not in order:
+                order.append(source)
+        blocks = []
+        for number, source in enumerate(order, 1):
+            members = [i for i in chosen if docs[i].metadata["source"] == source]
+            # Chain heads first: chunks whose predecessor was not chosen
+            members.sort(key=lambda i: (predecessor_of.get(i, (None,))[0] in chosen_set, -scores[i]))
+            passages, rendered = [], set()
+            for start in members:
+                if start in rendered:
+                    continue
+                text, current = docs[start].page_content, start
+                rendered.add(start)
+                while successor_of.get(current) in chosen_set and successor_of[current] not in rendered:
+                    current = successor_of[current]
+                    text += tails[current]
+                    rendered.add(current)
+                passages.append(text)
+            blocks.append(document_block(number, source, "\n...\n".join(passages)))
+        text = "\n".join(blocks)
+        # What the chosen chunks cost as separate "Document" entries, best first
+        baseline = "\n".join(
+            document_block(n, docs[i].metadata["source"], docs[i].page_content)
+            for n, i in enumerate(sorted(chosen, key=lambda i: -scores[i]), 1)
+        )
+        tokens, baseline_tokens = self.count([text, baseline]) if chosen else (0, 0)
+
+        metadata_of = {}
+        for i in chosen:
+            metadata_of.setdefault(docs[i].metadata["source"], docs[i].metadata)
+        dropped = [source for source in by_source if source not in metadata_of]
+        return PackedContext(
+            text=text,
+            sources=[metadata_of[source] for source in order],
+            tokens=tokens,
+            baseline_tokens=baseline_tokens,
+            chunks=len(chosen),
+            candidates=len(docs),
+            dropped=dropped,
+        )
+
+
+_context_builder: Optional[ContextBuilder] = None
+
+
+def get_context_builder(model_name: str, max_tokens: int) -> ContextBuilder:
+    """Process-wide context builder over the chunking tokenizer of `model_name`."""
+    global _context_builder
+    if _context_builder is None:
+        from app.services.chunking import get_tokenizer
+        _context_builder = ContextBuilder(get_tokenizer(model_name), max_tokens=max_tokens)
+    return _context_builder
@@ -0,0 +1,409 @@
+import bisect
+import csv
+import logging
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import xxhash
+
+from app.core.config import settings
+from app.services.shards import record_shard, shard_of
+
+logger = logging.getLogger("app_logger")
+
+SCHEMA = pa.schema([
+    ("source", pa.string()),
+    ("text", pa.string()),
+    ("content_hash", pa.string()),
+    ("ingested_at", pa.float64()),
+    ("deleted", pa.bool_()),
+    # Shard key of the CV (see app/services/shards.py); absent from segments written before shards
+    ("shard", pa.string()),
+])
+# Compacted segments are sorted by shard, in row groups small enough for
+# reading one shard to skip most of them (by the min/max statistics)
+ROW_GROUP_SIZE = 1024
+
+
+class CorpusStore:
+    """Append-only store of extracted CV text, kept as Parquet segments.
+
+    Every append writes one immutable segment; for each source the most
+    recent record wins, and a record with `deleted=True` is a tombstone.
+    Only the small (source, content_hash, deleted) columns are kept in
+    memory; the text is read memory-mapped, batch by batch, when iterating.
+    Segments are merged by `compact()` once there are too many of them,
+    sorted by shard, so the records of one shard can be read without the
+    others.
+
+    Compaction is size-tiered: a segment holding more records than all
+    newer segments together is left alone, the newer ones are merged. Each
+    record is thus rewritten a logarithmic number of times, not once per
+    compaction. A merged segment keeps the number of the newest segment it
+    replaces and names the oldest ("seg-<newest>-<oldest>.parquet"), so
+    segments left behind by an interrupted compaction are recognized.
+    """
+
+    def __init__(self, root: Path, compact_after: int = 32):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.compact_after = compact_after
+        self._lock = threading.RLock()
+        self._segments: List[Tuple[int, Path]] = []
+        # source -> (segment seq, row, content_hash, deleted, shard) of its latest record
+        self._latest: Dict[str, Tuple[int, int, str, bool, str]] = {}
+        # (shard, content_hash) -> source: the same file may be uploaded to several shards
+        self._source_by_hash: Dict[Tuple[str, str], str] = {}
+        # seq -> number of records, for planning merges
+        self._segment_rows: Dict[int, int] = {}
+        self._readers = 0
+        self._garbage: List[Path] = []
+        # One compaction at a time, in the background of the appends that call for it
+        self._compaction_lock = threading.Lock()
+        self._compaction: Optional[threading.Thread] = None
+        self._open()
+
+    @staticmethod
+    def _seq(path: Path) -> int:
+        return int(path.stem.split("-")[1])
+
+    @staticmethod
+    def _span(path: Path) -> Tuple[int, int]:
+        """(oldest, newest) segment numbers whose records `path` holds."""
+        parts = path.stem.split("-")
+        return (int(parts[2]) if len(parts) > 2 else int(parts[1])), int(parts[1])
+
+    def _open(self):
+        for tmp in self.root.glob("*.parquet.tmp"):
+            tmp.unlink()
+        paths = list(self.root.glob("seg-*.parquet"))
+        spans = {path: self._span(path) for path in paths}
+        for path in sorted(paths, key=lambda path: spans[path][1]):
+            first, seq = spans[path]
+            # Replaced by a merged segment, but not yet deleted when the process stopped
+            if any(other != path and other_first <= first and seq <= other_seq and (other_first, other_seq) != (first, seq)
+                   for other, (other_first, other_seq) in spans.items()):
+                path.unlink()
+                continue
+            try:
+                names = pq.read_schema(path, memory_map=True).names
+                columns = [name for name in ("source", "content_hash", "deleted", "shard") if name in names]
+                table = pq.read_table(path, columns=columns, memory_map=True)
+            except Exception as e:
+                logger.error(f"Skipping unreadable corpus segment {path}: {e}")
+                continue
+            self._segments.append((seq, path))
+            self._segment_rows[seq] = table.num_rows
+            self._index_rows(seq, table.to_pydict())
+
+    def _index_rows(self, seq: int, columns: dict):
+        shards = columns.get("shard") or [None] * len(columns["source"])
+        for row, (source, content_hash, deleted, shard) in enumerate(
+            zip(columns["source"], columns["content_hash"], columns["deleted"], shards)
+        ):
+            shard = shard or shard_of(source)
+            previous = self._latest.get(source)
+            if previous is not None and self._source_by_hash.get((previous[4], previous[2])) == source:
+                del self._source_by_hash[(previous[4], previous[2])]
+            self._latest[source] = (seq, row, content_hash, deleted, shard)
+            if not deleted:
+                self._source_by_hash[(shard, content_hash)] = source
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(1 for entry in self._latest.values() if not entry[3])
+
+    def is_empty(self) -> bool:
+        return not self._segments
+
+    def content_hash(self, source: str) -> Optional[str]:
+        """Hash of the live record of `source`, or None if it is not in the corpus."""
+        with self._lock:
+            entry = self._latest.get(source)
+            return entry[2] if entry is not None and not entry[3] else None
+
+    def source_for_hash(self, content_hash: str, shard: str) -> Optional[str]:
+        """Source of `shard` currently holding a document with this content hash."""
+        with self._lock:
+            return self._source_by_hash.get((shard, content_hash))
+
+    def shards(self) -> Set[str]:
+        """Shards with at least one live record."""
+        with self._lock:
+            return {entry[4] for entry in self._latest.values() if not entry[3]}
+
+    def _write_segment(self, seq: int, table: pa.Table) -> Path:
+        path = self.root / f"seg-{seq:08d}.parquet"
+        tmp = path.with_name(path.name + ".tmp")
+        pq.write_table(table, tmp, compression="zstd", row_group_size=ROW_GROUP_SIZE)
+        os.replace(tmp, path)
+        return path
+
+    def append(self, records: List[dict]) -> Optional[Path]:
+        """Write `records` (source, text, content_hash[, ingested_at, deleted, shard]) as one segment."""
+        if not records:
+            return None
+        now = time.time()
+        columns = {
+            "source": [r["source"] for r in records],
+            "text": [r.get("text", "") for r in records],
+            "content_hash": [r.get("content_hash", "") for r in records],
+            "ingested_at": [r.get("ingested_at", now) for r in records],
+            "deleted": [bool(r.get("deleted", False)) for r in records],
+            "shard": [record_shard(r) for r in records],
+        }
+        with self._lock:
+            seq = self._segments[-1][0] + 1 if self._segments else 1
+            path = self._write_segment(seq, pa.Table.from_pydict(columns, schema=SCHEMA))
+            self._segments.append((seq, path))
+            self._segment_rows[seq] = len(records)
+            self._index_rows(seq, columns)
+            if len(self._segments) > self.compact_after and self._compaction is None:
+                self._compaction = threading.Thread(target=self._compact_in_background, name="corpus-compaction",
+                                                    daemon=True)
+                self._compaction.start()
+        return path
+
+    def delete(self, sources: List[str]) -> Optional[Path]:
+        """Append tombstones for the live sources among `sources`."""
+        live = [source for source in sources if self.content_hash(source) is not None]
+        return self.append([{"source": source, "deleted": True} for source in live])
+
+    def iter_records(self, batch_size: int = 256, include_deleted: bool = False,
+                     shard: Optional[str] = None) -> Iterator[dict]:
+        """Stream the latest record of every source (of `shard` only, if given), segment by segment."""
+        with self._lock:
+            segments = list(self._segments)
+            latest = dict(self._latest)
+            self._readers += 1
+        try:
+            if shard is not None:
+                holding = {entry[0] for entry in latest.values() if entry[4] == shard}
+                segments = [(seq, path) for seq, path in segments if seq in holding]
+            for seq, path in segments:
+                parquet_file = pq.ParquetFile(path, memory_map=True)
+                row = 0
+                for group in range(parquet_file.num_row_groups):
+                    rows = parquet_file.metadata.row_group(group).num_rows
+                    if shard is not None and not _may_hold(parquet_file, group, shard):
+                        row += rows
+                        continue
+                    for batch in parquet_file.iter_batches(batch_size=batch_size, row_groups=[group]):
+                        columns = batch.to_pydict()
+                        if "shard" not in columns:
+                            columns["shard"] = [shard_of(source) for source in columns["source"]]
+                        for i, source in enumerate(columns["source"]):
+                            entry = latest.get(source)
+                            if entry is None or entry[0] != seq or entry[1] != row + i:
+                                continue
+                            if (entry[3] and not include_deleted) or (shard is not None and entry[4] != shard):
+                                continue
+                            yield {name: values[i] for name, values in columns.items()}
+                        row += batch.num_rows
+        finally:
+            with self._lock:
+                self._readers -= 1
+                self._collect_garbage()
+
+    def _collect_garbage(self):
+        # Old segments stay on disk while a reader may still be iterating over them
+        if self._readers:
+            return
+        for path in self._garbage:
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+        self._garbage = []
+
+    def _compact_in_background(self):
+        try:
+            while len(self._segments) > self.compact_after and self.compact():
+                pass
+        except Exception as e:
+            logger.error(f"Corpus compaction failed: {e}")
+        finally:
+            with self._lock:
+                self._compaction = None
+
+    def wait_for_compaction(self, timeout: Optional[float] = None):
+        """Wait until the background compaction, if any, is done."""
+        compaction = self._compaction
+        if compaction is not None:
+            compaction.join(timeout)
+
+    def _merge_plan(self) -> List[Tuple[int, Path]]:
+        # The newest segments, from the first one that holds no more records than all newer ones
+        sizes = [self._segment_rows.get(seq, 0) for seq, _ in self._segments]
+        newer = sum(sizes)
+        start = 0
+        for size in sizes:
+            newer -= size
+            if size <= newer:
+                break
+            start += 1
+        start = min(start, len(self._segments) - 2)
+        return self._segments[start:] if start >= 0 else []
+
+    def compact(self) -> bool:
+        """Merge the newest segments (size-tiered, see the class) into one; False if there was nothing to merge.
+
+        The merge is streamed row group by row group, without the lock:
+        appends and lookups go on meanwhile, and only the final swap of the
+        segment list waits for them. Tombstones are dropped when every
+        segment is merged, and kept otherwise, to hide older records.
+        """
+        with self._compaction_lock:
+            with self._lock:
+                tail = self._merge_plan()
+                if not tail:
+                    return False
+                latest = dict(self._latest)
+                complete = len(tail) == len(self._segments)
+                # Keeps the merged segments on disk until the swap
+                self._readers += 1
+            started = time.perf_counter()
+            first, seq = tail[0][0], tail[-1][0]
+            path = self.root / f"seg-{seq:08d}-{self._span(tail[0][1])[0]:08d}.parquet"
+            try:
+                moved = self._write_merged(tail, latest, complete, path)
+                with self._lock:
+                    merged = {number for number, _ in tail}
+                    self._segments = ([segment for segment in self._segments if segment[0] < first] + [(seq, path)]
+                                      + [segment for segment in self._segments if segment[0] > seq])
+                    for number in merged:
+                        self._segment_rows.pop(number, None)
+                    self._segment_rows[seq] = len(moved)
+                    for source, entry in latest.items():
+                        if entry[0] not in merged or self._latest.get(source) != entry:
+                            # Outside the merge, or replaced by an append meanwhile
+                            continue
+                        if source in moved:
+                            self._latest[source] = (seq, moved[source]) + entry[2:]
+                        else:
+                            # A tombstone dropped by a complete merge
+                            del self._latest[source]
+                    self._garbage.extend(segment_path for _, segment_path in tail)
+            finally:
+                with self._lock:
+                    self._readers -= 1
+                    self._collect_garbage()
+        logger.info(f"Compacted {len(tail)} corpus segments ({len(moved)} records) into {path.name} "
+                    f"in {time.perf_counter() - started:.2f}s")
+        return True
+
+    def _write_merged(self, tail: List[Tuple[int, Path]], latest: Dict[str, Tuple[int, int, str, bool, str]],
+                      complete: bool, path: Path) -> Dict[str, int]:
+        """Write the latest records held by the `tail` segments to `path`, shard by shard.
+
+        Only the row groups holding rows of the shard being written are
+        read, and at most ROW_GROUP_SIZE rows are buffered. Returns the new
+        row of every record written.
+        """
+        merged = {seq for seq, _ in tail}
+        # shard -> seq -> [(row, source)] of the records to keep
+        plan: Dict[str, Dict[int, List[Tuple[int, str]]]] = {}
+        for source, (seq, row, _, deleted, shard) in latest.items():
+            if seq in merged and not (deleted and complete):
+                plan.setdefault(shard, {}).setdefault(seq, []).append((row, source))
+        files = {seq: pq.ParquetFile(segment_path, memory_map=True) for seq, segment_path in tail}
+        offsets = {}
+        for seq, parquet_file in files.items():
+            sizes = [parquet_file.metadata.row_group(group).num_rows for group in range(parquet_file.num_row_groups)]
+            offsets[seq] = [sum(sizes[:group]) for group in range(len(sizes))]
+
+        moved: Dict[str, int] = {}
+        pending: List[pa.Table] = []
+        tmp = path.with_name(path.name + ".tmp")
+        try:
+            with pq.ParquetWriter(tmp, SCHEMA, compression="zstd") as writer:
+                def flush(final: bool = False):
+                    if not pending:
+                        return
+                    table = pa.concat_tables(pending)
+                    keep = len(table) if final else len(table) - len(table) % ROW_GROUP_SIZE
+                    if keep:
+                        writer.write_table(table.slice(0, keep), row_group_size=ROW_GROUP_SIZE)
+                    pending[:] = [table.slice(keep)] if keep < len(table) else []
+
+                for shard in sorted(plan):
+                    for seq in sorted(plan[shard]):
+                        by_group: Dict[int, List[Tuple[int, str]]] = {}
+                        for row, source in sorted(plan[shard][seq]):
+                            by_group.setdefault(bisect.bisect_right(offsets[seq], row) - 1, []).append((row, source))
+                        for group, rows in by_group.items():
+                            table = files[seq].read_row_group(group)
+                            taken = table.take([row - offsets[seq][group] for row, _ in rows])
+                            columns = [taken.column(name) if name in taken.column_names
+                                       else pa.array([shard] * len(taken), pa.string()) for name in SCHEMA.names]
+                            pending.append(pa.Table.from_arrays(columns, schema=SCHEMA))
+                            for _, source in rows:
+                                moved[source] = len(moved)
+                            if sum(map(len, pending)) >= ROW_GROUP_SIZE:
+                                flush()
+                flush(final=True)
+            os.replace(tmp, path)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+        return moved
+
+    def import_csv_folder(self, csv_folder: Path, upload_folder: Optional[Path] = None) -> int:
+        """One-time migration of the legacy one-CSV-per-resume folder."""
+        csv.field_size_limit(min(sys.maxsize, 2 ** 31 - 1))
+        records = []
+        for csv_path in sorted(Path(csv_folder).glob("*.csv")):
+            with open(csv_path, newline="", encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    source, text = row["source"], row["Resume"]
+                    original = Path(upload_folder) / source if upload_folder else None
+                    # Same hash as the ingestion queue when the original upload is still there
+                    if original is not None and original.is_file():
+                        digest = xxhash.xxh3_128()
+                        digest.update(original.read_bytes())
+                        content_hash = digest.hexdigest()
+                    else:
+                        content_hash = "text:" + xxhash.xxh3_128_hexdigest(text.encode("utf-8"))
+                    records.append({
+                        "source": source,
+                        "text": text,
+                        "content_hash": content_hash,
+                        "ingested_at": csv_path.stat().st_mtime,
+                    })
+        self.append(records)
+        if records:
+            logger.info(f"Imported {len(records)} CVs from {csv_folder} into the corpus store")
+        return len(records)
+
+
+def _may_hold(parquet_file: pq.ParquetFile, group: int, shard: str) -> bool:
+    """False if the statistics of a row group rule out records of `shard`."""
+    names = parquet_file.schema_arrow.names
+    if "shard" not in names:
+        return True
+    statistics = parquet_file.metadata.row_group(group).column(names.index("shard")).statistics
+    if statistics is None or not statistics.has_min_max or statistics.null_count:
+        return True
+    return statistics.min <= shard <= statistics.max
+
+
+_corpus_store: Optional[CorpusStore] = None
+_corpus_store_lock = threading.Lock()
+
+
+def get_corpus_store() -> CorpusStore:
+    """Process-wide corpus store; imports the legacy CSV folder the first time."""
+    global _corpus_store
+    with _corpus_store_lock:
+        if _corpus_store is None:
+            store = CorpusStore(Path(settings.CORPUS_DIR), compact_after=settings.CORPUS_COMPACT_SEGMENTS)
+            if store.is_empty() and Path(settings.CSV_FOLDER).is_dir():
+                store.import_csv_folder(Path(settings.CSV_FOLDER), Path(settings.UPLOAD_FOLDER))
+            _corpus_store = store
+    return _corpus_store
@@ -0,0 +1,206 @@
+import inspect
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from queue import Empty, SimpleQueue
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from app.core.metrics import QUERY_BATCH_SIZE
+
+logger = logging.getLogger("app_logger")
+
+EMBEDDING_BACKENDS = ("torch", "onnx", "onnx_int8")
+
+
+def onnx_model_path(model_name: str, onnx_dir: Path, quantize: bool = False) -> Path:
+    return Path(onnx_dir) / model_name.replace("/", "__") / ("model.int8.onnx" if quantize else "model.onnx")
+
+
+def export_onnx(model_name: str, onnx_dir: Path, quantize: bool = False) -> Path:
+    """Export `model_name` to ONNX, with int8 weights if `quantize`, unless already done.
+
+    Needs torch only for the export itself; later starts just read the file.
+    """
+    target = onnx_model_path(model_name, onnx_dir, quantize)
+    if target.exists():
+        return target
+    target.parent.mkdir(parents=True, exist_ok=True)
+    # Every worker may export at the same time: stage under a private name, then rename
+    suffix = f".{os.getpid()}.tmp"
+
+    fp32 = onnx_model_path(model_name, onnx_dir)
+    if not fp32.exists():
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        started = time.perf_counter()
+        model = AutoModel.from_pretrained(model_name).eval()
+        encoded = AutoTokenizer.from_pretrained(model_name)(["warm up"], return_tensors="pt")
+        # Graph inputs are named in the order of forward()'s parameters
+        names = [name for name in inspect.signature(model.forward).parameters if name in encoded]
+        axes = {0: "batch", 1: "sequence"}
+        staged = fp32.with_suffix(suffix)
+        with torch.no_grad():
+            torch.onnx.export(
+                model, (), str(staged), kwargs={name: encoded[name] for name in names},
+                input_names=names, output_names=["last_hidden_state"],
+                dynamic_axes={name: axes for name in [*names, "last_hidden_state"]},
+                opset_version=17, dynamo=False,
+            )
+        os.replace(staged, fp32)
+        logger.info(f"Exported {model_name} to {fp32} in {time.perf_counter() - started:.1f}s")
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        staged = target.with_suffix(suffix)
+        quantize_dynamic(str(fp32), str(staged), weight_type=QuantType.QInt8)
+        os.replace(staged, target)
+        logger.info(f"Quantized {fp32} to int8 weights in {target}")
+    return target
+
+
+class OnnxEmbeddings(Embeddings):
+    """Sentence embeddings of an ONNX export of the model, run by onnxruntime.
+
+    Mean pooling over the attention mask and L2 normalization, as
+    sentence-transformers does for gte-small. Texts are sorted by length
+    before batching, so little of each batch is padding.
+    """
+
+    def __init__(self, model_name: str, onnx_dir: Path, quantize: bool = False, threads: Optional[int] = None,
+                 batch_size: int = 32, max_length: int = 512):
+        import onnxruntime
+        from transformers import AutoTokenizer
+
+        self.model_path = export_onnx(model_name, onnx_dir, quantize)
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(str(self.model_path), options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.output_name = self.session.get_outputs()[0].name
+        # Not the chunker's tokenizer: a fast tokenizer must not be called with
+        # other padding settings from two threads at once
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self._tokenizer_lock = threading.Lock()
+        self.batch_size = batch_size
+        self.max_length = max_length
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        vectors: List[Optional[np.ndarray]] = [None] * len(texts)
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            with self._tokenizer_lock:
+                encoded = self.tokenizer(
+                    [texts[i] for i in batch], padding=True, truncation=True, max_length=self.max_length,
+                    return_tensors="np",
+                )
+            feeds = {name: value.astype(np.int64) for name, value in encoded.items() if name in self.input_names}
+            hidden = self.session.run([self.output_name], feeds)[0]
+            mask = encoded["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            for i, vector in zip(batch, pooled):
+                vectors[i] = vector
+        return np.array(vectors, dtype=np.float32)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(list(texts)).tolist() if texts else []
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([text])[0].tolist()
+
+
+def create_embeddings(backend: str, model_name: str, onnx_dir: Path, threads: Optional[int] = None) -> Embeddings:
+    """The embedding model on the configured backend (EMBEDDING_BACKEND)."""
+    if backend == "torch":
+        # Imports torch and sentence-transformers, which alone take seconds
+        from langchain_huggingface import HuggingFaceEmbeddings
+        return HuggingFaceEmbeddings(
+            model_name=model_name,
+            model_kwargs={"device": "cpu"},
+            encode_kwargs={"normalize_embeddings": True}
+        )
+    if backend in ("onnx", "onnx_int8"):
+        return OnnxEmbeddings(model_name, onnx_dir, quantize=backend == "onnx_int8", threads=threads)
+    raise ValueError(f"Unknown embedding backend {backend!r}, expected one of {EMBEDDING_BACKENDS}")
+
+
+class QueryBatcher(Embeddings):
+    """Embeds queries of concurrent requests together, in one forward pass.
+
+    The first query to arrive opens a batch, which is embedded `max_wait`
+    seconds later or as soon as `max_batch` queries are waiting. Queries
+    that arrive while a batch is running form the next one. Documents go
+    straight to the wrapped model; queries use its `embed_documents` too,
+    since the supported models embed both alike.
+    """
+
+    def __init__(self, embeddings: Embeddings, max_batch: int = 32, max_wait: float = 0.002):
+        self.embeddings = embeddings
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.batches = 0
+        self.queries = 0
+        self._queue: SimpleQueue = SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="query-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, text: str) -> "Future[List[float]]":
+        """Queue `text`; the future holds its embedding. Usable from the event loop via asyncio.wrap_future."""
+        future: Future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.submit(text).result()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self, first) -> list:
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            try:
+                # Take whatever is already queued, then wait out the rest of max_wait
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = self._collect(first)
+            texts = list(dict.fromkeys(text for text, _ in batch))
+            try:
+                vectors = dict(zip(texts, self.embeddings.embed_documents(texts)))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.queries += len(batch)
+            QUERY_BATCH_SIZE.observe(len(batch))
+            for text, future in batch:
+                future.set_result(vectors[text])
@@ -0,0 +1,149 @@
+import gzip
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Optional, Sequence
+
+logger = logging.getLogger("app_logger")
+
+# Bump when the extractors change, so cached texts of the old ones are not reused
+EXTRACTOR_VERSION = "v2"
+
+# Imported once by the fork server instead of in every extraction child
+_PRELOAD = ["app.services.ingestion", "psutil", "pypdfium2", "pdfminer.high_level", "docx", "PIL.Image"]
+
+
+class ExtractionError(RuntimeError):
+    pass
+
+
+class ExtractionTimeout(ExtractionError):
+    pass
+
+
+_context = None
+
+
+def _get_context():
+    """forkserver where the platform has it, else None (extraction runs in the calling thread)."""
+    global _context
+    if _context is None:
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            # Children are forked from a small server process that never holds
+            # the app's threads or locks, so forking them is cheap and safe
+            context = multiprocessing.get_context("forkserver")
+            # Children re-import the entry script (uvicorn, a benchmark) unless the server already has
+            main = getattr(sys.modules["__main__"], "__spec__", None)
+            names = [main.name] if main and not main.name.endswith("__main__") else []
+            context.set_forkserver_preload(["__main__", *names, *_PRELOAD])
+            _context = context
+        else:
+            logger.warning("No forkserver on this platform: CV extraction runs without time and memory limits")
+            _context = False
+    return _context or None
+
+
+def _limit_memory(memory_mb: int):
+    import resource
+    import psutil
+
+    # Address space already mapped by the interpreter and the preloaded libraries, plus the budget
+    limit = psutil.Process().memory_info().vms + memory_mb * 2 ** 20
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _run_child(conn, func: Callable, args: Sequence, memory_mb: Optional[int]):
+    # Own process group: a timeout also kills the page workers this child forks
+    os.setpgrp()
+    try:
+        if memory_mb:
+            _limit_memory(memory_mb)
+        conn.send((True, func(*args)))
+    except MemoryError:
+        conn.send((False, ExtractionError(f"exceeded the memory limit of {memory_mb} MB")))
+    except BaseException as e:
+        conn.send((False, e if isinstance(e, Exception) else ExtractionError(repr(e))))
+    finally:
+        conn.close()
+
+
+def _kill(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        process.kill()
+    process.join()
+
+
+def run_limited(func: Callable, args: Sequence, timeout: Optional[float] = None,
+                memory_mb: Optional[int] = None) -> Any:
+    """`func(*args)` in a child process killed after `timeout` seconds.
+
+    The child may map at most `memory_mb` more than it starts with, so a
+    malformed file fails its own extraction with ExtractionError instead of
+    hanging, swapping or crashing the server. Without a forkserver
+    (Windows), `func` runs in the calling thread with no limits.
+    """
+    context = _get_context()
+    if context is None:
+        return func(*args)
+
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_run_child, args=(sender, func, tuple(args), memory_mb), name="extract")
+    process.start()
+    sender.close()
+    try:
+        if not receiver.poll(timeout):
+            _kill(process)
+            raise ExtractionTimeout(f"took longer than {timeout:g}s")
+        try:
+            ok, value = receiver.recv()
+        except EOFError:
+            # Killed by the kernel or a crash in native code
+            process.join()
+            raise ExtractionError(f"extraction process died with exit code {process.exitcode}") from None
+        process.join()
+    finally:
+        receiver.close()
+    if not ok:
+        raise value
+    return value
+
+
+class ExtractionCache:
+    """Cleaned CV texts by file content hash, so the same bytes are never extracted twice.
+
+    Also covers files removed and uploaded again, corpus rebuilds and
+    retries after a failed corpus write.
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root) / EXTRACTOR_VERSION
+
+    def _path(self, content_hash: str) -> Path:
+        return self.root / content_hash[:2] / f"{content_hash}.txt.gz"
+
+    def get(self, content_hash: str) -> Optional[str]:
+        try:
+            with gzip.open(self._path(content_hash), "rt", encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, UnicodeDecodeError) as e:
+            logger.warning(f"Ignoring unreadable extraction cache entry {content_hash}: {e}")
+            return None
+
+    def put(self, content_hash: str, text: str):
+        path = self._path(content_hash)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f"{path.name}.{os.getpid()}.{time.monotonic_ns()}.tmp")
+            with gzip.open(tmp, "wt", encoding="utf-8", compresslevel=3) as f:
+                f.write(text)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"Could not cache the extracted text of {content_hash}: {e}")
@@ -0,0 +1,171 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from email.utils import formatdate
+from typing import BinaryIO, Optional, Tuple
+from urllib.parse import quote
+
+import anyio
+import xxhash
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+# Bytes read per event loop round trip when the server cannot send files itself
+CHUNK_SIZE = 256 * 1024
+
+_RANGE = re.compile(r"bytes=(\d*)-(\d*)")
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+class ContentHashes:
+    """xxh3-128 of served files, as computed at upload and ingest, cached by inode, size and mtime.
+
+    The hash is the ETag: it is the same for every worker and survives
+    restarts, and a file replaced under the same name changes it.
+    """
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self._hashes: "OrderedDict[tuple, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, file: BinaryIO) -> str:
+        """Hash of an open file; hashes it (blocking) unless this exact file was seen before."""
+        stat = os.fstat(file.fileno())
+        key = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            content_hash = self._hashes.get(key)
+            if content_hash is not None:
+                self._hashes.move_to_end(key)
+                return content_hash
+        digest = xxhash.xxh3_128()
+        file.seek(0)
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+        content_hash = digest.hexdigest()
+        with self._lock:
+            self._hashes[key] = content_hash
+            while len(self._hashes) > self.max_entries:
+                self._hashes.popitem(last=False)
+        return content_hash
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """[start, end) of a single byte range, or None to send the whole file.
+
+    Several ranges and malformed headers are ignored, as RFC 9110 allows;
+    a range starting past the end raises RangeNotSatisfiable.
+    """
+    match = _RANGE.fullmatch(header.strip()) if header else None
+    if match is None or match.group(1) == match.group(2) == "":
+        return None
+    first, last = match.groups()
+    if first == "":
+        # Suffix range: the last N bytes
+        length = int(last)
+        # Nothing to send: an empty suffix, or any suffix of an empty file
+        if length == 0 or size == 0:
+            raise RangeNotSatisfiable()
+        return max(size - length, 0), size
+    start = int(first)
+    end = min(int(last) + 1, size) if last else size
+    if start >= size:
+        raise RangeNotSatisfiable()
+    if end <= start:
+        return None
+    return start, end
+
+
+class SendfileResponse(Response):
+    """Streams [offset, offset + count) of an open file, then closes it.
+
+    When the server supports the ASGI zero-copy extension, the kernel sends
+    the bytes from the page cache (sendfile); otherwise they are read in
+    CHUNK_SIZE blocks off the event loop, so a large file never sits in
+    memory and never blocks other requests.
+    """
+
+    def __init__(self, file: BinaryIO, offset: int, count: int, status_code: int = 200,
+                 headers: Optional[dict] = None, media_type: Optional[str] = None, send_body: bool = True):
+        self.file = file
+        self.offset = offset
+        self.count = count
+        self.send_body = send_body
+        headers = {**(headers or {}), "content-length": str(count)}
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            if not self.send_body or self.count == 0:
+                await send({"type": "http.response.body", "body": b""})
+            elif "http.response.zerocopy" in scope.get("extensions", {}):
+                await send({"type": "http.response.zerocopy", "file": self.file,
+                            "offset": self.offset, "count": self.count})
+            else:
+                await self._send_chunks(send)
+        finally:
+            self.file.close()
+        if self.background is not None:
+            await self.background()
+
+    async def _send_chunks(self, send: Send):
+        await anyio.to_thread.run_sync(self.file.seek, self.offset)
+        remaining = self.count
+        while remaining:
+            chunk = await anyio.to_thread.run_sync(self.file.read, min(CHUNK_SIZE, remaining))
+            # A file truncated meanwhile ends the body early
+            remaining = remaining - len(chunk) if chunk else 0
+            await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+
+
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    # Weak comparison, as RFC 9110 requires for If-None-Match
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+def file_response(request: Request, file: BinaryIO, etag: str, media_type: str,
+                  filename: Optional[str] = None) -> Tuple[Response, int]:
+    """Response for an open file with a strong `etag`, and its status code.
+
+    Answers conditional requests (If-None-Match with 304) and single byte
+    ranges (206, or 416), honouring If-Range; takes ownership of `file`.
+    """
+    stat = os.fstat(file.fileno())
+    headers = {
+        "etag": etag,
+        "last-modified": formatdate(stat.st_mtime, usegmt=True),
+        "accept-ranges": "bytes",
+        # Revalidate on every use: the URL names the CV, not its content, and a 304 costs one stat
+        "cache-control": "no-cache",
+    }
+    if filename is not None:
+        quoted = quote(filename)
+        headers["content-disposition"] = (
+            f'inline; filename="{filename}"' if quoted == filename else f"inline; filename*=utf-8''{quoted}"
+        )
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        file.close()
+        return Response(status_code=304, headers=headers), 304
+
+    size = stat.st_size
+    send_body = request.method != "HEAD"
+    if_range = request.headers.get("if-range")
+    try:
+        span = parse_range(request.headers.get("range"), size) if if_range in (None, etag) else None
+    except RangeNotSatisfiable:
+        file.close()
+        return Response(status_code=416, headers={**headers, "content-range": f"bytes */{size}"}), 416
+    if span is None:
+        return SendfileResponse(file, 0, size, 200, headers, media_type, send_body), 200
+    start, end = span
+    headers["content-range"] = f"bytes {start}-{end - 1}/{size}"
+    return SendfileResponse(file, start, end - start, 206, headers, media_type, send_body), 206
@@ -0,0 +1,47 @@
+from typing import Dict, Hashable, Iterable, List, Sequence, Tuple
+
+from langchain.docstore.document import Document as LangchainDocument
+
+# Reciprocal rank fusion constant: damps the weight of the very first ranks
+RRF_K = 60
+
+
+def fuse(rankings: Iterable[Sequence[Hashable]], k: int = RRF_K) -> Dict[Hashable, float]:
+    """Reciprocal rank fusion: each key scores the sum of 1 / (k + rank) over the rankings it is in."""
+    scores: Dict[Hashable, float] = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, 1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    return scores
+
+
+def hybrid_chunks(snapshot, question: str, vector, k: int, keyword_candidates: int = 50) -> List[Tuple[LangchainDocument, float]]:
+    """Top `k` (chunk, fused score) for a question, from vector and keyword search, best first.
+
+    Three rankings are fused: the nearest chunks, the nearest chunks among
+    the `keyword_candidates` best CVs by BM25 (a keyword pre-filter, so CVs
+    naming the asked skills are not crowded out), and those chunks by the
+    BM25 rank of their CV. Without a keyword match this is the plain
+    vector search, scored by cosine similarity.
+
+    `snapshot` is one index version (chunks keyed by id) or a
+    ShardedSnapshot (keyed by shard and id), whose searches fan out to
+    its shards and merge their results.
+    """
+    nearest = snapshot.search_chunks(vector, k)
+    matches = snapshot.keywords.search(question, keyword_candidates) if snapshot.keywords is not None else []
+    if not matches:
+        return [(snapshot.document(key), score) for key, score in nearest]
+
+    keyword_rank = {source: rank for rank, (source, _) in enumerate(matches)}
+    prefiltered = snapshot.search_chunks(vector, k, sources=list(keyword_rank))
+    candidates = list(dict.fromkeys(key for key, _ in nearest + prefiltered))
+
+    def best_rank(key) -> int:
+        owners = snapshot.chunk_owners(key)
+        return min((keyword_rank[source] for source in owners if source in keyword_rank), default=len(keyword_rank))
+
+    by_keywords = sorted((key for key in candidates if best_rank(key) < len(keyword_rank)), key=best_rank)
+    scores = fuse([[key for key, _ in nearest], [key for key, _ in prefiltered], by_keywords])
+    ranked = sorted(candidates, key=lambda key: -scores[key])[:k]
+    return [(snapshot.document(key), round(scores[key], 6)) for key in ranked]
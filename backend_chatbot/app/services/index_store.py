@@ -0,0 +1,166 @@
+import hashlib
+import json
+import logging
+import mmap
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+
+import faiss
+from langchain.docstore.document import Document as LangchainDocument
+from langchain_community.docstore.base import Docstore
+
+logger = logging.getLogger("app_logger")
+
+# On-disk layout:
+#   <root>/CURRENT          name of the live version directory
+#   <root>/v00000042/       index.faiss, docstore.bin, docstore.json, state.json, manifest.json
+# Both index.faiss and docstore.bin can be memory-mapped, so worker processes
+# serving the same version share one copy in the page cache.
+MANIFEST_FILE = "manifest.json"
+CURRENT_FILE = "CURRENT"
+INDEX_FILES = ("index.faiss", "docstore.bin", "docstore.json", "state.json")
+INDEX_FORMAT_VERSION = 2
+
+
+def file_checksum(path: Path) -> str:
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def current_version_dir(root: Path) -> Optional[Path]:
+    """Directory of the last published index, or None if there is none."""
+    pointer = Path(root) / CURRENT_FILE
+    try:
+        name = pointer.read_text().strip()
+    except FileNotFoundError:
+        return None
+    version_dir = Path(root) / name
+    return version_dir if version_dir.is_dir() else None
+
+
+def latest_version(root: Path) -> int:
+    """Highest version number present on disk, published or not."""
+    numbers = [int(p.name[1:]) for p in Path(root).glob("v*") if p.is_dir() and p.name[1:].isdigit()]
+    return max(numbers, default=0)
+
+
+def staging_dir(root: Path) -> Path:
+    Path(root).mkdir(parents=True, exist_ok=True)
+    return Path(tempfile.mkdtemp(prefix=".staging-", dir=root))
+
+
+def publish(root: Path, staged: Path, version: int, manifest: dict, keep: int = 2) -> Path:
+    """Move a fully written staging directory into place and point CURRENT at it."""
+    root = Path(root)
+    manifest = dict(manifest, format=INDEX_FORMAT_VERSION, version=version, checksums={
+        name: file_checksum(staged / name) for name in INDEX_FILES
+    })
+    (staged / MANIFEST_FILE).write_text(json.dumps(manifest, indent=2))
+
+    target = root / f"v{version:08d}"
+    if target.exists():
+        shutil.rmtree(target)
+    os.replace(staged, target)
+    set_current(root, target.name)
+    prune(root, keep)
+    return target
+
+
+def set_current(root: Path, name: str):
+    """Point CURRENT at the version directory `name`."""
+    # Swapping the pointer file is atomic, so readers see either the old or the new version
+    pointer_tmp = Path(root) / f".{CURRENT_FILE}.tmp"
+    pointer_tmp.write_text(name)
+    os.replace(pointer_tmp, Path(root) / CURRENT_FILE)
+
+
+def current_version_name(root: Path) -> Optional[str]:
+    """Cheap check for a newly published version: just the pointer file."""
+    try:
+        return (Path(root) / CURRENT_FILE).read_text().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def prune(root: Path, keep: int = 2):
+    """Delete all but the `keep` newest versions (never the live one)."""
+    live = current_version_dir(root)
+    versions = sorted(p for p in Path(root).glob("v*") if p.is_dir())
+    for old in versions[:-keep] if keep else versions:
+        if old != live:
+            shutil.rmtree(old, ignore_errors=True)
+    for stale in Path(root).glob(".staging-*"):
+        shutil.rmtree(stale, ignore_errors=True)
+
+
+def read_manifest(version_dir: Path, verify: bool = True) -> dict:
+    """Read the manifest and verify the checksum of every file it covers."""
+    manifest = json.loads((Path(version_dir) / MANIFEST_FILE).read_text())
+    if manifest.get("format") != INDEX_FORMAT_VERSION:
+        raise ValueError(f"unsupported index format {manifest.get('format')}")
+    for name, checksum in manifest["checksums"].items() if verify else ():
+        if file_checksum(Path(version_dir) / name) != checksum:
+            raise ValueError(f"checksum mismatch for {name}")
+    return manifest
+
+
+def read_faiss_index(path: Path, mmap: bool = True):
+    """Load a FAISS index, memory-mapping it when the index type allows it."""
+    if mmap:
+        try:
+            return faiss.read_index(str(path), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError as e:
+            logger.warning(f"Could not memory-map {path}, reading it into RAM: {e}")
+    return faiss.read_index(str(path))
+
+
+def write_docstore(directory: Path, documents: Dict[str, LangchainDocument], index_to_docstore_id: Dict[int, str]):
+    """Write chunk documents to docstore.bin and their offsets to docstore.json."""
+    offsets = {}
+    position = 0
+    with open(Path(directory) / "docstore.bin", "wb") as f:
+        for doc_id, doc in documents.items():
+            record = json.dumps({"page_content": doc.page_content, "metadata": doc.metadata}).encode("utf-8")
+            f.write(record)
+            offsets[doc_id] = (position, len(record))
+            position += len(record)
+    (Path(directory) / "docstore.json").write_text(json.dumps({
+        "offsets": offsets,
+        "index_to_docstore_id": {str(label): doc_id for label, doc_id in index_to_docstore_id.items()},
+    }))
+
+
+class MappedDocstore(Docstore):
+    """Read-only docstore over a memory-mapped docstore.bin."""
+
+    def __init__(self, path: Path, offsets: Dict[str, Tuple[int, int]]):
+        self.offsets = offsets
+        with open(path, "rb") as f:
+            # mmap refuses empty files
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def search(self, search: str) -> Union[str, LangchainDocument]:
+        location = self.offsets.get(search)
+        if location is None:
+            return f"ID {search} not found."
+        start, length = location
+        return LangchainDocument(**json.loads(self._data[start:start + length]))
+
+    def to_dict(self) -> Dict[str, LangchainDocument]:
+        return {doc_id: self.search(doc_id) for doc_id in self.offsets}
+
+
+def read_docstore(directory: Path) -> Tuple[MappedDocstore, Dict[int, str]]:
+    meta = json.loads((Path(directory) / "docstore.json").read_text())
+    offsets = {doc_id: tuple(location) for doc_id, location in meta["offsets"].items()}
+    index_to_docstore_id = {int(label): doc_id for label, doc_id in meta["index_to_docstore_id"].items()}
+    return MappedDocstore(Path(directory) / "docstore.bin", offsets), index_to_docstore_id
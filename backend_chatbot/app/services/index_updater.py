@@ -0,0 +1,170 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional
+
+from app.core.metrics import INDEX_BUILDS, INDEX_PENDING_CHANGES, INGEST_STAGE
+from app.services.knowledge_index import load_corpus
+from app.services.sharded_index import ShardedIndex
+from app.services.shards import record_shard
+
+logger = logging.getLogger("app_logger")
+
+
+class IndexUpdater:
+    """Applies corpus changes to the sharded knowledge index on a background thread.
+
+    Changes are collected until no new one arrives for `debounce` seconds
+    (but never longer than `max_delay` after the first), then applied in one
+    build, off the query path. Only the shards with changes are built, each
+    in its own working index; each goes live through `ShardedIndex.publish`,
+    a single swap of that shard's served snapshot. A shard that fails to
+    build keeps serving its previous version and does not hold up the others.
+
+    `corpus_records(shard)` streams the records of one shard and
+    `corpus_shards()` lists the shards with records, for full syncs.
+    """
+
+    def __init__(self, sharded_index: ShardedIndex, corpus_records: Callable[[str], Iterable[dict]],
+                 corpus_shards: Callable[[], Iterable[str]], mode: str = "incremental",
+                 debounce: float = 2.0, max_delay: float = 30.0):
+        self.sharded_index = sharded_index
+        self.corpus_records = corpus_records
+        self.corpus_shards = corpus_shards
+        self.mode = mode
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.builds = 0
+        self.building = False
+        self.last_build_seconds: Optional[float] = None
+        self.last_build_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.last_build_shards = 0
+        # Latest record per source; a burst of changes to one CV is built once
+        self._pending: "OrderedDict[str, dict]" = OrderedDict()
+        self._full_sync = False
+        self._first_change = 0.0
+        self._last_change = 0.0
+        self._stopped = False
+        self._changed = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="index-updater", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        with self._changed:
+            self._stopped = True
+            self._changed.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _mark_changed(self):
+        now = time.monotonic()
+        if not self._pending and not self._full_sync:
+            self._first_change = now
+        self._last_change = now
+        self._changed.notify()
+
+    def submit(self, records: List[dict]):
+        """Queue new, replaced or deleted corpus records; returns immediately."""
+        with self._changed:
+            for record in records:
+                self._pending.pop(record["source"], None)
+                self._pending[record["source"]] = record
+            self._mark_changed()
+            INDEX_PENDING_CHANGES.set(len(self._pending))
+
+    def request_sync(self):
+        """Queue a full comparison of the index against the whole corpus."""
+        with self._changed:
+            self._mark_changed()
+            self._full_sync = True
+
+    def _next_batch(self):
+        with self._changed:
+            while not self._stopped and not (self._pending or self._full_sync):
+                self._changed.wait()
+            # Debounce: wait for a quiet period, bounded by max_delay
+            while not self._stopped:
+                now = time.monotonic()
+                wait = min(self._last_change + self.debounce, self._first_change + self.max_delay) - now
+                if wait <= 0:
+                    break
+                self._changed.wait(wait)
+            if self._stopped:
+                return None
+            records, full_sync = list(self._pending.values()), self._full_sync
+            self._pending.clear()
+            self._full_sync = False
+            INDEX_PENDING_CHANGES.set(0)
+            return records, full_sync
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            self._build(*batch)
+
+    def _build(self, records: List[dict], full_sync: bool):
+        started = time.perf_counter()
+        self.building = True
+        by_shard: Dict[str, List[dict]] = {}
+        for record in records:
+            by_shard.setdefault(record_shard(record), []).append(record)
+        shards = set(by_shard)
+        errors = []
+        try:
+            if full_sync:
+                # Shards left without CVs are only in the index: emptied by their sync
+                shards |= set(self.corpus_shards()) | set(self.sharded_index.shards())
+            for shard in sorted(shards):
+                try:
+                    self._build_shard(shard, by_shard.get(shard, []), full_sync)
+                except Exception as e:
+                    errors.append(f"{shard}: {e}")
+                    logger.error(f"Index build of shard {shard} failed: {e}")
+        except Exception as e:
+            errors.append(str(e))
+            logger.error(f"Index build failed: {e}")
+        finally:
+            self.last_error = "; ".join(errors) or None
+            self.last_build_shards = len(shards)
+            self.building = False
+            self.builds += 1
+            self.last_build_seconds = time.perf_counter() - started
+            self.last_build_at = time.time()
+            INGEST_STAGE["index_build"].observe(self.last_build_seconds)
+            INDEX_BUILDS.labels("ok" if self.last_error is None else "error").inc()
+        logger.info(
+            f"Index build of {'the whole corpus' if full_sync else f'{len(records)} CVs'} in {len(shards)} shards "
+            f"took {self.last_build_seconds:.2f}s"
+        )
+
+    def _build_shard(self, shard: str, records: List[dict], full_sync: bool):
+        with self.sharded_index.building(shard) as knowledge_index:
+            if self.mode == "full":
+                knowledge_index.rebuild(load_corpus(self.corpus_records(shard)))
+            elif full_sync or knowledge_index.snapshot().name is None:
+                # A shard without a published version is built from all its CVs
+                knowledge_index.sync_corpus(self.corpus_records(shard))
+            else:
+                knowledge_index.apply_records(records)
+            self.sharded_index.publish(shard, knowledge_index)
+
+    def stats(self) -> dict:
+        with self._changed:
+            pending = len(self._pending) + (1 if self._full_sync else 0)
+        return {
+            "building": self.building,
+            "pending_changes": pending,
+            "builds": self.builds,
+            "last_build_shards": self.last_build_shards,
+            "last_build_seconds": self.last_build_seconds,
+            "last_build_at": self.last_build_at,
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,430 @@
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import xxhash
+
+from app.core.config import settings
+from app.core.metrics import EXTRACTIONS, INGEST_QUEUE_DEPTH, INGEST_STAGE, INGESTED_FILES
+from app.services.corpus_store import CorpusStore, get_corpus_store
+from app.services.extraction import ExtractionCache, ExtractionTimeout, run_limited
+from app.services.pdf_processing import clean_text, extract_doc, extract_pdf, render_thumbnail
+from app.services.previews import PreviewStore, get_preview_store
+from app.services.shards import DEFAULT_SHARD, is_shard_name, shard_of, shard_source
+
+logger = logging.getLogger("app_logger")
+
+SUPPORTED_EXTENSIONS = {".pdf", ".doc", ".docx"}
+
+
+def file_content_hash(path: Path) -> str:
+    digest = xxhash.xxh3_128()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _ingest_file(input_file: str, page_workers: int = 1, parallel_pages: int = 32,
+                 thumbnail_path: Optional[str] = None, thumbnail_width: int = 240) -> Tuple[str, float, str]:
+    """Runs in an extraction process: the cleaned text of one CV.
+
+    Also returns the extraction time and the tier that produced the text,
+    since metrics recorded in that process would never reach the server's
+    registry. With `thumbnail_path`, page 1 of a PDF is rendered there too,
+    while the file is hot in the page cache.
+    """
+    started = time.perf_counter()
+    if not os.path.exists(input_file):
+        raise FileNotFoundError(input_file)
+    extension = os.path.splitext(input_file)[-1].lower()
+    if extension == ".pdf":
+        text, method = extract_pdf(input_file, page_workers, parallel_pages)
+    elif extension in (".doc", ".docx"):
+        text, method = extract_doc(input_file)
+    else:
+        raise ValueError(f"unsupported file format {extension!r}")
+    if not text or not text.strip():
+        raise RuntimeError("no text could be extracted")
+    if thumbnail_path is not None:
+        try:
+            render_thumbnail(input_file, thumbnail_path, thumbnail_width)
+        except Exception:
+            pass  # A CV without a thumbnail is still ingested; the preview endpoint falls back to text
+    return clean_text(text), time.perf_counter() - started, method
+
+
+def _pending_key(source: str, content_hash: str) -> str:
+    # The same file may be pending in two shards at once
+    return f"{shard_of(source)}:{content_hash}"
+
+
+@dataclass
+class IngestionJob:
+    id: str
+    path: str
+    content_hash: str
+    source: str
+    status: str = "queued"  # queued | running | done | skipped | failed
+    detail: Optional[str] = None
+    output: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+class IngestionQueue:
+    """Extracts uploaded CVs into the corpus store.
+
+    Each file is extracted in its own child process (`run_limited`), killed
+    after `timeout` seconds or when it maps more than `memory_mb`, so one
+    malformed file fails alone; `max_workers` threads wait on the children.
+    Extracted texts are cached by content hash (`cache`). A page-1
+    thumbnail and a text preview of every CV go to `previews`.
+
+    Every file is identified by a hash of its bytes. A file whose hash is
+    already in the corpus (under any name of the same shard) is skipped,
+    and a file that is already queued is not queued twice. Such a duplicate
+    is remembered: when the file it duplicates is removed, it is queued in
+    its place. Extracted texts
+    are written to the corpus by a single writer thread, several CVs per
+    segment, and then handed to the registered listeners (e.g. the
+    knowledge index).
+
+    A file in a folder of `root` (the upload folder) belongs to the shard
+    of that name and is recorded as "<shard>/<file name>"; any other file
+    belongs to the default shard under its own name.
+    """
+
+    def __init__(self, corpus: CorpusStore, max_workers: Optional[int] = None, batch_size: int = 64,
+                 max_jobs: int = 10000, cache: Optional[ExtractionCache] = None, timeout: Optional[float] = 60.0,
+                 memory_mb: Optional[int] = 1024, page_workers: int = 1, parallel_pages: int = 32,
+                 previews: Optional[PreviewStore] = None, thumbnail_width: int = 240, root: Optional[Path] = None):
+        self.corpus = corpus
+        self.root = Path(root).resolve() if root is not None else None
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.max_jobs = max_jobs
+        self.cache = cache
+        self.timeout = timeout
+        self.memory_mb = memory_mb
+        self.page_workers = page_workers
+        self.parallel_pages = parallel_pages
+        self.previews = previews
+        self.thumbnail_width = thumbnail_width
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._jobs: "OrderedDict[str, IngestionJob]" = OrderedDict()
+        self._futures: Dict[str, Future] = {}
+        self._pending_hashes: Dict[str, str] = {}
+        # Source of a skipped duplicate -> (content hash, path), queued when the file it duplicates is removed
+        self._duplicates: Dict[str, Tuple[str, Path]] = {}
+        self._results: "queue.Queue[Optional[Tuple[IngestionJob, str]]]" = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        self._listeners: List[Callable[[List[dict]], None]] = []
+        self._lock = threading.Lock()
+
+    def add_listener(self, callback: Callable[[List[dict]], None]):
+        """Call `callback(records)` after each batch of records is written to the corpus."""
+        self._listeners.append(callback)
+
+    def source_of(self, path: Path) -> Optional[str]:
+        """Corpus source of the file at `path`; None for files nested deeper in `root` than a shard folder."""
+        path = Path(path)
+        if self.root is None:
+            return path.name
+        parent = path.parent.resolve()
+        if parent == self.root:
+            return path.name
+        # The default shard is the top of `root`, never a folder
+        if parent.parent == self.root and is_shard_name(parent.name) and parent.name != DEFAULT_SHARD:
+            return shard_source(parent.name, path.name)
+        return None
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="extract")
+        return self._executor
+
+    def _needs_thumbnail(self, path: str, content_hash: str) -> bool:
+        return (self.previews is not None and path.lower().endswith(".pdf")
+                and not self.previews.has_thumbnail(content_hash))
+
+    def _extract(self, path: str, content_hash: str) -> Tuple[str, float, str]:
+        thumbnail = None
+        if self._needs_thumbnail(path, content_hash):
+            thumbnail = str(self.previews.thumbnail_path(content_hash))
+        return run_limited(
+            _ingest_file, (path, self.page_workers, self.parallel_pages, thumbnail, self.thumbnail_width),
+            timeout=self.timeout, memory_mb=self.memory_mb,
+        )
+
+    def _render_previews(self, path: str, content_hash: str):
+        if not self.previews.has_text(content_hash) and self.cache is not None:
+            text = self.cache.get(content_hash)
+            if text is not None:
+                self.previews.put_text(content_hash, text)
+        if self._needs_thumbnail(path, content_hash):
+            try:
+                run_limited(
+                    render_thumbnail, (path, str(self.previews.thumbnail_path(content_hash)), self.thumbnail_width),
+                    timeout=self.timeout, memory_mb=self.memory_mb,
+                )
+            except Exception as e:
+                logger.warning(f"Could not render the thumbnail of {path}: {e}")
+
+    def _backfill_previews(self, path: Path, content_hash: str):
+        """Previews of a CV that is not extracted: a cache hit, or a file ingested before previews existed."""
+        if self.previews is None:
+            return
+        if self._needs_thumbnail(str(path), content_hash) or not self.previews.has_text(content_hash):
+            self._get_executor().submit(self._render_previews, str(path), content_hash)
+
+    def _start_writer(self):
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._write_results, name="corpus-writer", daemon=True)
+            self._writer.start()
+
+    def _remember(self, job: IngestionJob):
+        self._jobs[job.id] = job
+        while len(self._jobs) > self.max_jobs:
+            self._jobs.popitem(last=False)
+
+    def submit(self, path: Path, content_hash: Optional[str] = None) -> IngestionJob:
+        """Queue one file for extraction and return its job."""
+        path = Path(path)
+        source = self.source_of(path)
+        if source is None:
+            raise ValueError(f"{path} is not in the upload folder or one of its shard folders")
+        content_hash = content_hash or file_content_hash(path)
+        pending_key = _pending_key(source, content_hash)
+        with self._lock:
+            # A file submitted again is no longer the duplicate it may have been
+            self._duplicates.pop(source, None)
+            pending = self._jobs.get(self._pending_hashes.get(pending_key, ""))
+            if pending is not None:
+                if pending.source != source:
+                    self._duplicates[source] = (content_hash, path)
+                return pending
+
+            job = IngestionJob(id=uuid.uuid4().hex, path=str(path), content_hash=content_hash, source=source)
+            self._remember(job)
+            if self.corpus.content_hash(source) == content_hash:
+                ingested_as = source
+            else:
+                ingested_as = self.corpus.source_for_hash(content_hash, shard_of(source))
+            if ingested_as is not None:
+                job.status = "skipped"
+                job.finished_at = time.time()
+                job.output = ingested_as
+                job.detail = "unchanged" if ingested_as == source else f"duplicate of {ingested_as}"
+                if ingested_as != source:
+                    self._duplicates[source] = (content_hash, path)
+                INGESTED_FILES.labels("skipped").inc()
+                self._backfill_previews(path, content_hash)
+                return job
+
+            self._pending_hashes[pending_key] = job.id
+            INGEST_QUEUE_DEPTH.set(len(self._pending_hashes))
+            self._start_writer()
+            cached = self.cache.get(content_hash) if self.cache is not None else None
+            if cached is not None:
+                job.status = "running"
+                EXTRACTIONS.labels("cache").inc()
+                self._results.put((job, cached))
+                self._backfill_previews(path, content_hash)
+                return job
+            future = self._get_executor().submit(self._extract, str(path), content_hash)
+            self._futures[job.id] = future
+        future.add_done_callback(lambda f, job=job: self._finish(job, f))
+        return job
+
+    def submit_folder(self, folder: Path) -> List[IngestionJob]:
+        """Queue the CVs of `folder`, and of its shard folders when it is `root`."""
+        jobs = []
+        paths = []
+        for path in sorted(Path(folder).iterdir()):
+            if path.is_dir() and self.root is not None and is_shard_name(path.name):
+                paths.extend(sorted(path.iterdir()))
+            else:
+                paths.append(path)
+        for path in paths:
+            if path.is_file() and path.suffix.lower() in SUPPORTED_EXTENSIONS and self.source_of(path) is not None:
+                try:
+                    jobs.append(self.submit(path))
+                except OSError as e:
+                    logger.error(f"Could not queue {path}: {e}")
+        return jobs
+
+    def remove(self, path: Path) -> bool:
+        """Record that the CV at `path` was deleted; returns False if it was not in the corpus.
+
+        A duplicate of the deleted CV, skipped when it was submitted, is
+        queued in its place.
+        """
+        source = self.source_of(path)
+        if source is None:
+            return False
+        with self._lock:
+            self._duplicates.pop(source, None)
+        content_hash = self.corpus.content_hash(source)
+        if self.corpus.delete([source]) is None:
+            return False
+        self._notify([{"source": source, "deleted": True}])
+        self._promote_duplicate(shard_of(source), content_hash)
+        return True
+
+    def _promote_duplicate(self, shard: str, content_hash: str):
+        with self._lock:
+            duplicates = sorted(source for source, (duplicate_hash, _) in self._duplicates.items()
+                                if duplicate_hash == content_hash and shard_of(source) == shard)
+        for source in duplicates:
+            with self._lock:
+                _, path = self._duplicates.pop(source, (None, None))
+            if path is None or not path.is_file():
+                continue
+            try:
+                # The others stay duplicates, of this one from now on
+                job = self.submit(path)
+            except (OSError, ValueError) as e:
+                logger.error(f"Could not queue {path}: {e}")
+                continue
+            logger.info(f"Queued {source} in place of the deleted CV it duplicated ({job.status})")
+            return
+
+    def _finish(self, job: IngestionJob, future: Future):
+        with self._lock:
+            self._futures.pop(job.id, None)
+            if future.cancelled() or future.exception() is not None:
+                self._pending_hashes.pop(_pending_key(job.source, job.content_hash), None)
+                INGEST_QUEUE_DEPTH.set(len(self._pending_hashes))
+                job.status = "failed"
+                job.finished_at = time.time()
+                if future.cancelled():
+                    job.detail = "cancelled"
+                else:
+                    error = future.exception()
+                    job.detail = f"extraction {error}" if isinstance(error, ExtractionTimeout) else str(error)
+                    EXTRACTIONS.labels("timeout" if isinstance(error, ExtractionTimeout) else "error").inc()
+                INGESTED_FILES.labels("failed").inc()
+                logger.error(f"Ingestion of {job.path} failed: {job.detail}")
+                return
+        text, extract_seconds, method = future.result()
+        INGEST_STAGE["extract"].observe(extract_seconds)
+        EXTRACTIONS.labels(method).inc()
+        if self.cache is not None:
+            self.cache.put(job.content_hash, text)
+        # The hash stays pending until the text is in the corpus
+        self._results.put((job, text))
+
+    def _write_results(self):
+        while True:
+            item = self._results.get()
+            if item is None:
+                return
+            batch = [item]
+            # Whatever finished meanwhile goes into the same segment
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._results.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._results.put(None)
+                    break
+                batch.append(item)
+            self._write_batch(batch)
+
+    def _write_batch(self, batch: List[Tuple[IngestionJob, str]]):
+        records = [
+            {"source": job.source, "shard": shard_of(job.source), "text": text, "content_hash": job.content_hash}
+            for job, text in batch
+        ]
+        try:
+            with INGEST_STAGE["corpus_write"].time():
+                self.corpus.append(records)
+            error = None
+        except Exception as e:
+            error = str(e)
+            logger.error(f"Could not write {len(records)} CVs to the corpus: {e}")
+        with self._lock:
+            for job, _ in batch:
+                self._pending_hashes.pop(_pending_key(job.source, job.content_hash), None)
+                job.finished_at = time.time()
+                if error is None:
+                    job.status = "done"
+                    job.output = job.source
+                else:
+                    job.status = "failed"
+                    job.detail = error
+            INGEST_QUEUE_DEPTH.set(len(self._pending_hashes))
+        INGESTED_FILES.labels("done" if error is None else "failed").inc(len(batch))
+        if error is None:
+            if self.previews is not None:
+                for record in records:
+                    self.previews.put_text(record["content_hash"], record["text"])
+            self._notify(records)
+
+    def _notify(self, records: List[dict]):
+        for callback in self._listeners:
+            try:
+                callback(records)
+            except Exception as e:
+                logger.error(f"Ingestion listener failed: {e}")
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            future = self._futures.get(job_id)
+            if job is not None and job.status == "queued" and future is not None and future.running():
+                job.status = "running"
+            return job
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            counts: Dict[str, int] = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            counts["pending"] = len(self._pending_hashes)
+            counts["workers"] = self.max_workers
+            counts["corpus_documents"] = len(self.corpus)
+            return counts
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        if self._writer is not None:
+            self._results.put(None)
+            self._writer.join(timeout=10)
+
+
+_ingestion_queue: Optional[IngestionQueue] = None
+
+
+def get_ingestion_queue() -> IngestionQueue:
+    """Process-wide ingestion queue, created on first use."""
+    global _ingestion_queue
+    if _ingestion_queue is None:
+        _ingestion_queue = IngestionQueue(
+            corpus=get_corpus_store(),
+            max_workers=settings.INGEST_WORKERS,
+            batch_size=settings.INGEST_BATCH_SIZE,
+            cache=ExtractionCache(Path(settings.EXTRACT_CACHE_DIR)) if settings.EXTRACT_CACHE_DIR else None,
+            timeout=settings.EXTRACT_TIMEOUT,
+            memory_mb=settings.EXTRACT_MAX_MEMORY_MB,
+            page_workers=settings.EXTRACT_PAGE_WORKERS,
+            parallel_pages=settings.EXTRACT_PARALLEL_PAGES,
+            previews=get_preview_store(),
+            thumbnail_width=settings.THUMBNAIL_WIDTH,
+            root=Path(settings.UPLOAD_FOLDER),
+        )
+    return _ingestion_queue
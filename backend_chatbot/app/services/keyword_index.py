@@ -0,0 +1,435 @@
+import logging
+import math
+import re
+import unicodedata
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+logger = logging.getLogger("app_logger")
+
+# Okapi BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Posting lists are rewritten without removed CVs once these are a quarter of the documents
+COMPACT_RATIO = 0.25
+COMPACT_MIN = 64
+
+# Words, keeping the punctuation of skills such as c++, c#, node.js or asp.net
+_WORD = re.compile(r"[a-z0-9][a-z0-9+#]*(?:\.[a-z0-9+#]+)*")
+_DOTNET = re.compile(r"(?<![a-z0-9])\.net\b")
+
+# Spellings of a skill -> its canonical term
+SKILL_ALIASES = {
+    "js": "javascript", "ecmascript": "javascript", "ts": "typescript", "py": "python", "python3": "python",
+    "golang": "go", "cpp": "c++", "cplusplus": "c++", "csharp": "c#", "dotnet": ".net", "vb.net": ".net",
+    "nodejs": "node.js", "node": "node.js", "reactjs": "react", "react.js": "react", "vuejs": "vue", "vue.js": "vue",
+    "angularjs": "angular", "nextjs": "next.js", "expressjs": "express", "jquery": "jquery",
+    "postgres": "postgresql", "psql": "postgresql", "mssql": "sql server", "mongo": "mongodb",
+    "elastic": "elasticsearch", "k8s": "kubernetes", "gcp": "google cloud", "amazon web services": "aws",
+    "tf": "tensorflow", "sklearn": "scikit-learn", "scikit": "scikit-learn", "pyspark": "spark",
+    "apache spark": "spark", "ml": "machine learning", "dl": "deep learning", "ai": "artificial intelligence",
+    "nlp": "natural language processing", "llm": "large language models", "llms": "large language models",
+    "decision trees": "decision tree", "random forests": "random forest", "neural networks": "neural network",
+    "word embeddings": "word embedding", "ci": "ci/cd", "cicd": "ci/cd", "powerbi": "power bi",
+}
+# Skills written as several words, indexed as one term as well as word by word
+SKILL_PHRASES = frozenset({
+    "machine learning", "deep learning", "artificial intelligence", "natural language processing",
+    "computer vision", "data science", "data analysis", "data engineering", "data mining", "big data",
+    "large language models", "neural network", "neural networks", "random forest", "random forests",
+    "decision tree", "decision trees", "sentiment analysis", "cluster analysis", "word embedding",
+    "word embeddings", "time series", "reinforcement learning", "transfer learning", "feature engineering",
+    "sql server", "google cloud", "amazon web services", "apache spark", "power bi", "spring boot",
+    "react native", "ruby on rails", "unit testing", "project management", "rest api", "design patterns",
+    "object oriented", "version control", "agile scrum",
+})
+# Single-word skills: with the phrases and aliases, what a question may name to be a skill filter
+SKILLS = frozenset({
+    "python", "java", "javascript", "typescript", "c", "c++", "c#", ".net", "go", "rust", "ruby", "php", "perl",
+    "scala", "kotlin", "swift", "r", "matlab", "julia", "dart", "sql", "nosql", "html", "css", "sass", "bash",
+    "shell", "powershell", "react", "vue", "angular", "svelte", "jquery", "node.js", "next.js", "express",
+    "django", "flask", "fastapi", "spring", "laravel", "rails", "asp.net", "graphql", "rest", "grpc",
+    "mysql", "postgresql", "sqlite", "oracle", "mongodb", "redis", "cassandra", "elasticsearch", "kafka",
+    "rabbitmq", "spark", "hadoop", "hive", "airflow", "dbt", "snowflake", "bigquery", "databricks", "tableau",
+    "excel", "pandas", "numpy", "scipy", "matplotlib", "seaborn", "scikit-learn", "tensorflow", "keras",
+    "pytorch", "xgboost", "lightgbm", "opencv", "nltk", "spacy", "huggingface", "transformers", "langchain",
+    "aws", "azure", "docker", "kubernetes", "terraform", "ansible", "jenkins", "git", "github", "gitlab",
+    "linux", "unix", "ci/cd", "devops", "mlops", "microservices", "agile", "scrum", "jira", "figma",
+    "photoshop", "android", "ios", "flutter", "unity", "selenium", "cypress", "jest", "pytest", "junit",
+    "regression", "classification", "clustering", "svm", "knn", "boosting", "statistics", "etl", "nlp",
+    "firebase", "hibernate", "maven", "gradle", "webpack", "tailwind", "bootstrap", "wordpress", "sap",
+    "salesforce", "blockchain", "solidity", "embedded", "arduino", "verilog", "autocad", "seo", "marketing",
+    "accounting", "english", "japanese", "french", "german", "chinese", "korean", "vietnamese",
+}) | SKILL_PHRASES | frozenset(SKILL_ALIASES.values())
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were will with "
+    "i my me we our you your he she they them their".split()
+)
+# Words around a skill list in a question ("who knows python and java?"): a question made
+# only of these, skills and boolean operators is a skill filter
+FILLER_WORDS = frozenset(
+    "a all an any candidate candidates cv cvs find experience experienced give has have in know knows "
+    "list me people profile profiles resume resumes show skill skills the those who with which".split()
+)
+
+
+def _words(text: str) -> List[str]:
+    # Folded to lowercase ASCII, so accents do not split a term in two
+    text = unicodedata.normalize("NFKD", text.lower()).encode("ascii", "ignore").decode("ascii")
+    return [SKILL_ALIASES.get(word, word) for word in _WORD.findall(_DOTNET.sub(" dotnet", text))]
+
+
+def _phrases(words: Sequence[str]) -> List[str]:
+    found = []
+    for n in (2, 3):
+        for i in range(len(words) - n + 1):
+            phrase = " ".join(words[i:i + n])
+            if phrase in SKILL_PHRASES:
+                found.append(SKILL_ALIASES.get(phrase, phrase))
+    return found
+
+
+def terms(text: str) -> List[str]:
+    """Index terms of `text`: its words without stopwords, plus the multi-word skills it names."""
+    words = _words(text)
+    return [word for word in words if word not in STOPWORDS] + _phrases(words)
+
+
+# Varint (LEB128) coding: 7 bits per byte, high bit set on all but the last byte of a value
+
+def _append_varint(buffer: bytearray, value: int):
+    while value >= 0x80:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def encode_varints(values: np.ndarray) -> bytes:
+    values = np.asarray(values, dtype=np.uint64)
+    sizes = np.ones(len(values), dtype=np.int64)
+    for k in range(1, 10):
+        sizes += values >= np.uint64(1 << (7 * k))
+    out = np.empty(int(sizes.sum()), dtype=np.uint8)
+    starts = np.cumsum(sizes) - sizes
+    for k in range(int(sizes.max(initial=0))):
+        has = sizes > k
+        byte = (values[has] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        out[starts[has] + k] = byte.astype(np.uint8) | np.where(sizes[has] > k + 1, 0x80, 0).astype(np.uint8)
+    return out.tobytes()
+
+
+def decode_varints(buffer) -> np.ndarray:
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    if not len(data):
+        return np.empty(0, dtype=np.int64)
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    # Position of each byte within its value, hence its shift
+    shifts = np.arange(len(data)) - np.repeat(starts, ends - starts + 1)
+    parts = (data & 0x7F).astype(np.int64) << (7 * shifts)
+    return np.add.reduceat(parts, starts)
+
+
+# Boolean skill filters: ("term", [terms]) | ("and", [nodes]) | ("or", [nodes]) | ("not", node)
+Expression = Tuple[str, Union[List[str], list, tuple]]
+
+_OPERATOR = re.compile(r"(\(|\)|,|&|\||\band\b|\bor\b|\bnot\b)", re.IGNORECASE)
+
+
+def parse_skill_filter(text: str, known_skills_only: bool = True) -> Optional[Expression]:
+    """Boolean expression of a skill filter such as "python and (django or flask), not php".
+
+    Commas and juxtaposition mean AND. With `known_skills_only`, every word
+    must be a known skill (SKILLS) or a filler word, as in "who knows python
+    and java?"; otherwise None is returned, and also for text with no
+    positive term or unbalanced parentheses.
+    """
+    tokens = [token.strip() for token in _OPERATOR.split(text.strip().rstrip("?.!")) if token.strip()]
+    tokens = [token.lower() if _OPERATOR.fullmatch(token) else token for token in tokens]
+    position = 0
+
+    class NotAFilter(Exception):
+        pass
+
+    def peek():
+        return tokens[position] if position < len(tokens) else None
+
+    def advance():
+        nonlocal position
+        position += 1
+
+    def parse_or():
+        nodes = [parse_and()]
+        while peek() in ("or", "|"):
+            advance()
+            nodes.append(parse_and())
+        nodes = [node for node in nodes if node is not None]
+        return None if not nodes else nodes[0] if len(nodes) == 1 else ("or", nodes)
+
+    def parse_and():
+        nodes = [parse_not()]
+        while peek() not in (None, ")", "or", "|"):
+            if peek() in ("and", "&", ","):
+                advance()
+                continue
+            nodes.append(parse_not())
+        nodes = [node for node in nodes if node is not None]
+        return None if not nodes else nodes[0] if len(nodes) == 1 else ("and", nodes)
+
+    def parse_not():
+        if peek() == "not":
+            advance()
+            node = parse_not()
+            return None if node is None else ("not", node)
+        return parse_atom()
+
+    def parse_atom():
+        token = peek()
+        advance()
+        if token == "(":
+            node = parse_or()
+            if peek() != ")":
+                raise NotAFilter()
+            advance()
+            return node
+        if token is None or _OPERATOR.fullmatch(token):
+            raise NotAFilter()
+        words = [word for word in _words(token) if not (known_skills_only and word in FILLER_WORDS)]
+        phrases = _phrases(words)
+        in_phrase = {word for phrase in phrases for word in phrase.split()}
+        atom = phrases + [word for word in words if word not in in_phrase and word not in STOPWORDS]
+        if known_skills_only and any(term not in SKILLS for term in atom):
+            raise NotAFilter()
+        return ("term", atom) if atom else None
+
+    try:
+        expression = parse_or()
+    except NotAFilter:
+        return None
+    if expression is None or position != len(tokens) or not positive_terms(expression):
+        return None
+    return expression
+
+
+def positive_terms(expression: Expression) -> List[str]:
+    """Terms a matching CV must or may contain, for ranking the matches."""
+    kind, operand = expression
+    if kind == "term":
+        return list(operand)
+    if kind == "not":
+        return []
+    return [term for node in operand for term in positive_terms(node)]
+
+
+def describe(expression: Expression) -> str:
+    kind, operand = expression
+    if kind == "term":
+        return " ".join(operand)
+    if kind == "not":
+        return f"NOT {describe(operand)}"
+    return "(" + f" {kind.upper()} ".join(describe(node) for node in operand) + ")"
+
+
+class KeywordIndex:
+    """BM25 inverted index over whole CVs, updated one source at a time.
+
+    The posting list of a term is a bytearray of varint (doc id gap, term
+    frequency) pairs. Doc ids only grow, so indexing a CV appends to the
+    lists of its terms. A removed or replaced CV is only marked deleted;
+    the lists are rewritten without deleted CVs once these are
+    COMPACT_RATIO of the documents. Until then, as in Lucene, document
+    frequencies still count them.
+    """
+
+    FILE = "keywords.npz"
+
+    def __init__(self):
+        self._postings: Dict[str, bytearray] = {}
+        self._last: Dict[str, int] = {}  # last doc id of each list, the base of the next gap
+        self._df: Dict[str, int] = {}
+        self._sources: List[Optional[str]] = []  # doc id -> source, None once deleted
+        self._lengths = array("I")  # terms per doc
+        self._doc_of: Dict[str, int] = {}
+        self._total_length = 0
+        self._live: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self._doc_of)
+
+    def __contains__(self, source: str) -> bool:
+        return source in self._doc_of
+
+    def add(self, source: str, text: str):
+        """Index `text` as the content of `source`, replacing its previous content."""
+        self.remove(source)
+        counts = Counter(terms(text))
+        doc = len(self._sources)
+        length = sum(counts.values())
+        self._sources.append(source)
+        self._lengths.append(length)
+        self._doc_of[source] = doc
+        self._total_length += length
+        for term, frequency in counts.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = bytearray()
+            _append_varint(postings, doc - self._last.get(term, 0))
+            _append_varint(postings, frequency)
+            self._last[term] = doc
+            self._df[term] = self._df.get(term, 0) + 1
+        self._live = None
+
+    def remove(self, source: str):
+        doc = self._doc_of.pop(source, None)
+        if doc is None:
+            return
+        self._sources[doc] = None
+        self._total_length -= self._lengths[doc]
+        self._live = None
+        deleted = len(self._sources) - len(self._doc_of)
+        if deleted >= COMPACT_MIN and deleted > COMPACT_RATIO * len(self._sources):
+            self.compact()
+
+    def _live_docs(self) -> np.ndarray:
+        if self._live is None:
+            self._live = np.fromiter((source is not None for source in self._sources), dtype=bool,
+                                     count=len(self._sources))
+        return self._live
+
+    def _decode(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        pairs = decode_varints(self._postings[term]).reshape(-1, 2)
+        return np.cumsum(pairs[:, 0]), pairs[:, 1]
+
+    def compact(self):
+        """Rewrite the posting lists without deleted CVs, renumbering the others."""
+        live = self._live_docs()
+        new_ids = np.cumsum(live) - 1
+        for term in list(self._postings):
+            docs, frequencies = self._decode(term)
+            kept = live[docs]
+            if not kept.any():
+                del self._postings[term], self._last[term], self._df[term]
+                continue
+            docs, frequencies = new_ids[docs[kept]], frequencies[kept]
+            gaps = np.diff(docs, prepend=0)
+            self._postings[term] = bytearray(encode_varints(np.column_stack([gaps, frequencies]).ravel()))
+            self._last[term] = int(docs[-1])
+            self._df[term] = len(docs)
+        self._sources = [source for source in self._sources if source is not None]
+        self._lengths = array("I", (length for length, alive in zip(self._lengths, live) if alive))
+        self._doc_of = {source: doc for doc, source in enumerate(self._sources)}
+        self._live = None
+
+    def _scores(self, query_terms: Sequence[str]) -> np.ndarray:
+        scores = np.zeros(len(self._sources))
+        live = len(self._doc_of)
+        if not live:
+            return scores
+        lengths = np.frombuffer(self._lengths, dtype=np.uint32) if len(self._lengths) else np.empty(0, np.uint32)
+        average = self._total_length / live or 1.0
+        for term in set(query_terms):
+            if term not in self._postings:
+                continue
+            docs, frequencies = self._decode(term)
+            df = min(self._df[term], live)
+            idf = math.log(1 + (live - df + 0.5) / (df + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[docs] / average)
+            scores[docs] += idf * frequencies * (BM25_K1 + 1) / (frequencies + norm)
+        scores[~self._live_docs()] = 0.0
+        return scores
+
+    def _top(self, scores: np.ndarray, docs: np.ndarray, k: int) -> List[Tuple[str, float]]:
+        if len(docs) > k:
+            docs = docs[np.argpartition(-scores[docs], k - 1)[:k]]
+        docs = docs[np.argsort(-scores[docs], kind="stable")]
+        return [(self._sources[doc], round(float(scores[doc]), 4)) for doc in docs]
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[str, float]]:
+        """Top `k` (source, BM25 score) for the terms of `query`, best first."""
+        scores = self._scores(terms(query))
+        return self._top(scores, np.flatnonzero(scores > 0), k)
+
+    def _match(self, expression: Expression) -> np.ndarray:
+        kind, operand = expression
+        if kind == "term":
+            docs = None
+            for term in operand:
+                found = self._decode(term)[0] if term in self._postings else np.empty(0, dtype=np.int64)
+                docs = found if docs is None else np.intersect1d(docs, found, assume_unique=True)
+            return docs[self._live_docs()[docs]]
+        if kind == "not":
+            return np.setdiff1d(np.flatnonzero(self._live_docs()), self._match(operand), assume_unique=True)
+        matches = [self._match(node) for node in operand]
+        docs = matches[0]
+        for other in matches[1:]:
+            if kind == "and":
+                docs = np.intersect1d(docs, other, assume_unique=True)
+            else:
+                docs = np.union1d(docs, other)
+        return docs
+
+    def filter(self, expression: Expression, k: int = 20) -> Tuple[int, List[Tuple[str, float]]]:
+        """(number of matching CVs, top `k` of them by BM25 of the expression's positive terms)."""
+        docs = self._match(expression)
+        if not len(docs):
+            return 0, []
+        return len(docs), self._top(self._scores(positive_terms(expression)), docs, k)
+
+    def matching_sources(self, expression: Expression) -> List[str]:
+        return [self._sources[doc] for doc in self._match(expression)]
+
+    def stats(self) -> dict:
+        postings = sum(self._df.values())
+        return {
+            "documents": len(self._doc_of),
+            "deleted": len(self._sources) - len(self._doc_of),
+            "terms": len(self._postings),
+            "postings": postings,
+            "posting_bytes": sum(map(len, self._postings.values())),
+            # The same lists as pairs of 32-bit ints
+            "uncompressed_bytes": postings * 8,
+        }
+
+    def save(self, directory: Path):
+        names = list(self._postings)
+        sizes = np.fromiter((len(self._postings[name]) for name in names), dtype=np.int64, count=len(names))
+        np.savez(
+            Path(directory) / self.FILE,
+            terms=np.frombuffer("\n".join(names).encode("utf-8"), dtype=np.uint8),
+            offsets=np.concatenate(([0], np.cumsum(sizes))),
+            postings=np.frombuffer(b"".join(self._postings[name] for name in names), dtype=np.uint8),
+            last=np.fromiter((self._last[name] for name in names), dtype=np.int64, count=len(names)),
+            df=np.fromiter((self._df[name] for name in names), dtype=np.int64, count=len(names)),
+            sources=np.frombuffer("\n".join(source or "" for source in self._sources).encode("utf-8"), dtype=np.uint8),
+            live=self._live_docs(),
+            lengths=np.frombuffer(self._lengths, dtype=np.uint32) if len(self._lengths) else np.empty(0, np.uint32),
+        )
+
+    @classmethod
+    def load(cls, directory: Path) -> Optional["KeywordIndex"]:
+        """Index saved with an index version; None if it has none or it is unreadable."""
+        path = Path(directory) / cls.FILE
+        if not path.exists():
+            return None
+        index = cls()
+        try:
+            with np.load(path) as arrays:
+                names = arrays["terms"].tobytes().decode("utf-8").split("\n") if len(arrays["offsets"]) > 1 else []
+                offsets, blob = arrays["offsets"], arrays["postings"].tobytes()
+                index._postings = {name: bytearray(blob[offsets[i]:offsets[i + 1]]) for i, name in enumerate(names)}
+                index._last = dict(zip(names, arrays["last"].tolist()))
+                index._df = dict(zip(names, arrays["df"].tolist()))
+                live = arrays["live"]
+                sources = arrays["sources"].tobytes().decode("utf-8").split("\n") if len(live) else []
+                index._sources = [source if alive else None for source, alive in zip(sources, live.tolist())]
+                index._lengths = array("I", arrays["lengths"].astype(np.uint32).tobytes())
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable keyword index in {path}: {e}")
+            return None
+        index._doc_of = {source: doc for doc, source in enumerate(index._sources) if source is not None}
+        index._total_length = sum(length for length, source in zip(index._lengths, index._sources) if source is not None)
+        return index
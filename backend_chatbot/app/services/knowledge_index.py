@@ -0,0 +1,837 @@
+import hashlib
+import itertools
+import json
+import logging
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Deque, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from langchain.docstore.document import Document as LangchainDocument
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+
+import faiss
+import numpy as np
+from app.core.metrics import (
+    CHUNKS_EMBEDDED, CHUNKS_SPLIT, INDEX_BYTES, INDEX_CHUNKS, INDEX_VERSION, INGEST_STAGE, NEAR_DUPLICATES
+)
+from app.services import batch_search, index_store
+from app.services.ann_index import (
+    AnnConfig, AnnFAISS, build_index, index_type_of, from_mappable, set_search_params, to_mappable
+)
+from app.services.chunking import get_text_splitter, split_batches, split_texts
+from app.services.keyword_index import KeywordIndex
+from app.services.near_duplicates import MinHashLSH, NearDuplicateDetector, minhash, similarity
+from app.services.shards import record_shard, shard_of
+
+logger = logging.getLogger("app_logger")
+
+
+def record_to_document(record: dict) -> LangchainDocument:
+    """Document of one corpus record (one CV), with the shard key recorded at ingest."""
+    return LangchainDocument(
+        page_content=f"Resume: {record['text']}",
+        metadata={"source": record["source"], "shard": record_shard(record)}
+    )
+
+
+def load_corpus(records: Iterable[dict]) -> Iterator[LangchainDocument]:
+    """Documents of every live record streamed from the corpus store."""
+    for record in records:
+        if not record.get("deleted"):
+            yield record_to_document(record)
+
+
+# Function to split documents into chunks
+def split_documents(chunk_size: int, knowledge_base: List[LangchainDocument],
+                    model_name: str = "thenlper/gte-small") -> List[LangchainDocument]:
+    text_splitter = get_text_splitter(chunk_size, model_name)
+
+    with INGEST_STAGE["chunk"].time():
+        # One batched tokenizer pass over the whole knowledge base
+        docs_processed = text_splitter.split_documents(knowledge_base)
+    CHUNKS_SPLIT.inc(len(docs_processed))
+
+    # Remove duplicates
+    unique_texts = {}
+    docs_processed_unique = []
+    for doc in docs_processed:
+        if doc.page_content not in unique_texts:
+            unique_texts[doc.page_content] = True
+            docs_processed_unique.append(doc)
+
+    return docs_processed_unique
+
+
+def chunk_id(text: str) -> str:
+    """Docstore id of a chunk; identical chunk texts share one vector."""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def _fingerprint(documents: List[LangchainDocument]) -> str:
+    digest = hashlib.sha1()
+    for doc in documents:
+        digest.update(doc.page_content.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class _Change(NamedTuple):
+    """A source to (re)index, or to remove when `documents` is None."""
+    source: str
+    documents: Optional[List[LangchainDocument]]
+    fingerprint: Optional[str]
+    signature: Optional[np.ndarray] = None  # MinHash of the whole CV, when CV-level dedup is on
+    canonical: Optional[str] = None  # indexed CV this one nearly duplicates: share its chunks
+
+    def texts(self) -> List[str]:
+        """Texts to split: none for removals and near-duplicate CVs."""
+        if self.documents is None or self.canonical is not None:
+            return []
+        return [doc.page_content for doc in self.documents]
+
+
+class IndexSnapshot:
+    """One published index version, as served to queries.
+
+    Snapshots are never modified. A query keeps the snapshot it started
+    with, so it finishes on that version even if a newer one goes live.
+    """
+
+    def __init__(self, vector_store: Optional[FAISS] = None, version: int = 0, name: Optional[str] = None,
+                 state: Optional[dict] = None, keywords: Optional[KeywordIndex] = None):
+        self.vector_store = vector_store
+        self.version = version
+        self.name = name
+        # BM25 index of the CV texts of this version; None for versions saved without one
+        self.keywords = keywords
+        # Source maps saved with the version (state.json): which CVs share each chunk
+        self.chunk_sources: Optional[Dict[str, List[str]]] = (state or {}).get("chunk_sources")
+        self.source_chunk_ids: Optional[Dict[str, List[str]]] = (state or {}).get("source_chunk_ids")
+        self._chunk_labels: Optional[Dict[str, int]] = None
+
+    def __len__(self) -> int:
+        return 0 if self.vector_store is None else len(self.vector_store.index_to_docstore_id)
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4) -> List[LangchainDocument]:
+        if self.vector_store is None:
+            return []
+        return self.vector_store.similarity_search_by_vector(embedding, k=k)
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4) -> List[Tuple[LangchainDocument, float]]:
+        """Nearest chunks with their cosine similarity, best first."""
+        if self.vector_store is None:
+            return []
+        # Normalized vectors: squared L2 distance d = 2 - 2 cos
+        return [(doc, 1.0 - float(distance) / 2)
+                for doc, distance in self.vector_store.similarity_search_with_score_by_vector(embedding, k=k)]
+
+    def chunk_labels(self) -> Dict[str, int]:
+        """FAISS label of every chunk id, built on first use."""
+        if self._chunk_labels is None:
+            mapping = {} if self.vector_store is None else self.vector_store.index_to_docstore_id
+            self._chunk_labels = {cid: int(label) for label, cid in mapping.items()}
+        return self._chunk_labels
+
+    # Retrieval primitives shared with ShardedSnapshot (app/services/sharded_index.py), keyed by chunk id here
+
+    def search_chunks(self, vector, k: int, sources: Optional[List[str]] = None) -> List[Tuple[str, float]]:
+        return batch_search.search_chunks(self, vector, k, sources)
+
+    def search_sources(self, vectors: np.ndarray, k: int = 5, fetch_k: Optional[int] = None,
+                       filter: Optional[dict] = None) -> List[List[batch_search.SourceHit]]:
+        return batch_search.search_sources(self, vectors, k, fetch_k, filter)
+
+    def document(self, cid: str) -> LangchainDocument:
+        return self.vector_store.docstore.search(cid)
+
+    def chunk_owners(self, cid: str) -> List[str]:
+        """Sources sharing the chunk `cid`."""
+        if self.chunk_sources is not None:
+            return self.chunk_sources.get(cid, [])
+        return [self.document(cid).metadata["source"]]
+
+
+class KnowledgeIndex:
+    """FAISS vector database that is updated one source (CV) at a time.
+
+    Chunks are stored under a content-derived id and reference-counted by
+    source, so adding, replacing or removing a CV only embeds or deletes the
+    chunks of that CV instead of rebuilding the whole corpus.
+
+    Changes go to a private working index; queries are served from the
+    last published version (`snapshot()`), which `publish()` replaces with
+    a single reference swap.
+
+    Sources are chunked and embedded `batch_size` at a time: one tokenizer
+    call and one embedding call per batch. Full passes over the corpus
+    split on `chunk_workers` processes while earlier batches are embedded.
+
+    The text of every CV also goes into a keyword index (BM25 over skill-
+    normalized terms), published with each version.
+
+    With `document_similarity` set, a CV whose text is that similar
+    (MinHash estimate of the Jaccard similarity of word 5-grams) to an
+    indexed CV is neither split nor embedded: it references the chunks of
+    that canonical CV. With `chunk_similarity` set, a new chunk that near-
+    duplicates a stored one references it instead of adding a vector.
+    """
+
+    def __init__(self, embedding_model, chunk_size: int = 512, model_name: str = "thenlper/gte-small",
+                 ann: Optional[AnnConfig] = None, batch_size: int = 64, chunk_workers: int = 1,
+                 chunk_pool_min: int = 2000, embedding_backend: str = "torch",
+                 document_similarity: float = 0.0, chunk_similarity: float = 0.0, report_metrics: bool = True):
+        self.embedding_model = embedding_model
+        self.chunk_size = chunk_size
+        self.model_name = model_name
+        # Vectors of another backend (e.g. int8) are close but not identical: never mixed in one index
+        self.embedding_backend = embedding_backend
+        self.ann = ann or AnnConfig()
+        self.batch_size = batch_size
+        self.chunk_workers = chunk_workers
+        self.chunk_pool_min = chunk_pool_min
+        # Number of chunks the current approximate index was trained on (0: flat)
+        self.trained_size = 0
+        self.vector_store: Optional[FAISS] = None
+        self.source_chunk_ids: Dict[str, List[str]] = {}
+        self.chunk_sources: Dict[str, Set[str]] = {}
+        self.source_fingerprints: Dict[str, str] = {}
+        # Near-duplicate CV -> the CV whose chunks it shares
+        self.source_aliases: Dict[str, str] = {}
+        self.similarity_thresholds = (document_similarity, chunk_similarity)
+        self.near_duplicates = NearDuplicateDetector(*self.similarity_thresholds)
+        self._signatures_from: Optional[Path] = None
+        self.keywords = KeywordIndex()
+        self._keywords_from: Optional[Path] = None
+        self._near_duplicate_counts = {"documents": 0, "chunks": 0, "vectors_saved": 0}
+        self._embed_seconds = 0.0
+        self._embedded_chunks = 0
+        self._bytes_per_chunk = 0.0
+        # Bumped on every change of the indexed content
+        self.version = 0
+        self._saved_version: Optional[int] = None
+        self._read_only = False
+        # Version directory the working index was loaded from, if any
+        self.loaded_from: Optional[Path] = None
+        self.mmap = True
+        self._served = IndexSnapshot()
+        self._refresh_failed: Optional[str] = None
+        # Off for the shards of a ShardedIndex, which exports totals over its shards
+        self.report_metrics = report_metrics
+        self._lock = threading.RLock()
+
+    def snapshot(self) -> IndexSnapshot:
+        """The version currently served to queries."""
+        return self._served
+
+    def is_empty(self) -> bool:
+        return len(self._served) == 0
+
+    @property
+    def unsaved(self) -> bool:
+        """The working index holds changes that no published version has."""
+        return self.version != self._saved_version
+
+    def __len__(self) -> int:
+        return len(self._served)
+
+    @property
+    def index_type(self) -> str:
+        return "flat" if self.vector_store is None else index_type_of(self.vector_store.index)
+
+    def similarity_search(self, query: str, k: int = 4) -> List[LangchainDocument]:
+        return self._served.similarity_search_by_vector(self.embed_query(query), k=k)
+
+    def embed_query(self, query: str) -> List[float]:
+        return self.embedding_model.embed_query(query)
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4) -> List[LangchainDocument]:
+        return self._served.similarity_search_by_vector(embedding, k=k)
+
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        """Embeddings of many queries in one batched call, as a float32 matrix.
+
+        Bypasses the chunk embedding cache, which queries would only fill
+        up; the supported models embed queries and documents alike.
+        """
+        model = getattr(self.embedding_model, "underlying_embeddings", self.embedding_model)
+        return np.array(model.embed_documents(list(queries)), dtype=np.float32)
+
+    def rebuild(self, knowledge_base: Iterable[LangchainDocument]):
+        """Drop everything and index `knowledge_base` from scratch.
+
+        The documents of one source must come one after the other, as
+        `load_corpus` yields them; the stream is never held in memory.
+        """
+        with self._lock:
+            self.vector_store = None
+            self.source_chunk_ids.clear()
+            self.chunk_sources.clear()
+            self.source_fingerprints.clear()
+            self.source_aliases.clear()
+            self.near_duplicates = NearDuplicateDetector(*self.similarity_thresholds)
+            self._signatures_from = None
+            self.keywords = KeywordIndex()
+            self._keywords_from = None
+            self.trained_size = 0
+            self.version += 1
+            grouped = itertools.groupby(knowledge_base, key=lambda doc: doc.metadata["source"])
+            self._index_stream(((source, list(documents)) for source, documents in grouped), pooled=True)
+            self.train_if_needed()
+
+    def upsert_source(self, source: str, documents: List[LangchainDocument]) -> int:
+        """Index the documents of `source`, replacing its previous chunks.
+
+        Returns the number of chunks that had to be embedded.
+        """
+        with self._lock:
+            return self._index_stream([(source, documents)])
+
+    def _detector(self) -> NearDuplicateDetector:
+        # Only the builder needs the signatures: read them with the first change, not at load
+        if self._signatures_from is not None:
+            self.near_duplicates.load(self._signatures_from)
+            self._signatures_from = None
+        return self.near_duplicates
+
+    def _keyword_index(self) -> KeywordIndex:
+        # Read with the first change, like the signatures; a version saved without one starts empty
+        if self._keywords_from is not None:
+            self.keywords = KeywordIndex.load(self._keywords_from) or KeywordIndex()
+            self._keywords_from = None
+        return self.keywords
+
+    def _change(self, source: str, documents: Optional[List[LangchainDocument]], fingerprint: Optional[str],
+                pending: Optional[MinHashLSH]) -> _Change:
+        lsh = self._detector().documents
+        if documents is None or lsh is None:
+            return _Change(source, documents, fingerprint)
+        signature = minhash("\n".join(doc.page_content for doc in documents))
+        # Indexed CVs and those earlier in the batch, never the CV's own previous
+        # version: a re-upload under the same name replaces it
+        matches = [lsh.query(signature, exclude=(source,)), pending.query(signature, exclude=(source,))]
+        match = max(filter(None, matches), key=lambda m: m[1], default=None)
+        if match is None:
+            pending.add(source, signature)
+        return _Change(source, documents, fingerprint, signature, match[0] if match else None)
+
+    def _batches(self, changes: Iterable[Tuple[str, Optional[List[LangchainDocument]]]]):
+        # Groups of up to batch_size changed sources; documents None removes the source.
+        # The last change of a source in a group wins.
+        batch: Dict[str, _Change] = {}
+        lsh = self._detector().documents
+        keywords = self._keyword_index()
+        pending = MinHashLSH(lsh.threshold) if lsh is not None else None
+        for source, documents in changes:
+            fingerprint = None if documents is None else _fingerprint(documents)
+            # Unchanged, unless missing from the keyword index (versions saved before it existed)
+            if (source not in batch and fingerprint is not None and self.source_fingerprints.get(source) == fingerprint
+                    and source in keywords):
+                continue
+            batch.pop(source, None)
+            if pending is not None:
+                pending.remove(source)
+            batch[source] = self._change(source, documents, fingerprint, pending)
+            if len(batch) >= self.batch_size:
+                yield list(batch.values())
+                batch = {}
+                pending = MinHashLSH(lsh.threshold) if lsh is not None else None
+        if batch:
+            yield list(batch.values())
+
+    def _index_stream(self, changes: Iterable[Tuple[str, Optional[List[LangchainDocument]]]],
+                      pooled: bool = False) -> int:
+        """Apply (source, documents or None to remove) changes in batches.
+
+        Texts of a batch are split in one tokenizer pass (on the process
+        pool for full passes) and its new chunks embedded in one call, so
+        only the batches in flight are ever held in memory.
+        """
+        in_flight: Deque[list] = deque()
+
+        def texts(batches):
+            for batch in batches:
+                in_flight.append(batch)
+                yield [text for change in batch for text in change.texts()]
+
+        split = split_batches(
+            self.chunk_size, self.model_name, texts(self._batches(changes)),
+            workers=self.chunk_workers if pooled else 1, pool_min=self.chunk_pool_min,
+        )
+        embedded = 0
+        try:
+            while True:
+                started = time.perf_counter()
+                chunk_texts = next(split, None)
+                if chunk_texts is None:
+                    break
+                INGEST_STAGE["chunk"].observe(time.perf_counter() - started)
+                CHUNKS_SPLIT.inc(sum(map(len, chunk_texts)))
+                batch = in_flight.popleft()
+                try:
+                    embedded += self._apply_batch(batch, chunk_texts)
+                except Exception as e:
+                    # Retry one source at a time, so one bad CV does not hold back the others
+                    logger.warning(f"Indexing a batch of {len(batch)} sources failed ({e}), retrying one by one")
+                    chunks_of = iter(chunk_texts)
+                    for change in batch:
+                        own = [next(chunks_of) for _ in change.texts()]
+                        try:
+                            embedded += self._apply_batch([change], own)
+                        except Exception as e:
+                            logger.error(f"Could not index {change.source}: {e}")
+        finally:
+            split.close()
+        return embedded
+
+    def _canonical_chunks(self, change: _Change, batch: Dict[str, _Change],
+                          new_chunks: Dict[str, dict]) -> Optional[List[str]]:
+        # Chunk ids of the CV `change` nearly duplicates, None if it was replaced
+        # or removed since the change was queued
+        lsh = self.near_duplicates.documents
+        canonical = batch.get(change.canonical)
+        if canonical is not None and canonical.documents is not None and canonical.canonical is None:
+            # Indexed in this batch
+            signature, chunk_ids = canonical.signature, new_chunks.get(change.canonical)
+        else:
+            signature = lsh.signatures.get(change.canonical) if lsh is not None else None
+            chunk_ids = self.source_chunk_ids.get(change.canonical)
+        if signature is None or chunk_ids is None or similarity(change.signature, signature) < lsh.threshold:
+            return None
+        return list(chunk_ids)
+
+    def _apply_batch(self, batch: List[_Change], chunk_texts: List[List[str]]) -> int:
+        """Index one batch; `chunk_texts` holds the chunks of each of the batch's `texts()` in order."""
+        detector = self._detector()
+        chunks_of = iter(chunk_texts)
+        new_chunks: Dict[str, Dict[str, Optional[LangchainDocument]]] = {}
+        aliases: Dict[str, str] = {}
+        to_embed: Dict[str, LangchainDocument] = {}
+        near_duplicate_chunks = 0
+        by_source = {change.source: change for change in batch}
+        try:
+            # Near-duplicate CVs last: their canonical CV may be in this batch
+            for change in sorted(batch, key=lambda change: change.canonical is not None):
+                if change.documents is None:
+                    continue
+                if change.canonical is not None:
+                    chunk_ids = self._canonical_chunks(change, by_source, new_chunks)
+                    if chunk_ids is not None:
+                        aliases[change.source] = change.canonical
+                        new_chunks[change.source] = dict.fromkeys(chunk_ids)
+                        continue
+                    split = split_texts(self.chunk_size, self.model_name, [doc.page_content for doc in change.documents])
+                else:
+                    split = [next(chunks_of) for _ in change.documents]
+                chunks = new_chunks[change.source] = {}
+                for doc, texts in zip(change.documents, split):
+                    for text in texts:
+                        cid = chunk_id(text)
+                        if cid in chunks:
+                            continue
+                        if cid in self.chunk_sources or cid in to_embed:
+                            chunks[cid] = None
+                            continue
+                        if detector.chunks is not None:
+                            signature = minhash(text)
+                            # Never the CV's own previous chunks: an edit inside one (a phone
+                            # number, a skill) must replace the old text, not be dropped
+                            match = detector.chunks.query(signature, exclude=self.source_chunk_ids.get(change.source, ()))
+                            if match is not None:
+                                chunks.setdefault(match[0], None)
+                                near_duplicate_chunks += 1
+                                continue
+                            detector.chunks.add(cid, signature)
+                        # Only chunks that no other source already contributed need embedding
+                        chunks[cid] = to_embed[cid] = LangchainDocument(page_content=text, metadata=dict(doc.metadata))
+
+            self._ensure_writable()
+            if to_embed:
+                with INGEST_STAGE["embed"].time():
+                    started = time.perf_counter()
+                    documents = list(to_embed.values())
+                    texts = [doc.page_content for doc in documents]
+                    vectors = self.embedding_model.embed_documents(texts)
+                    metadatas = [doc.metadata for doc in documents]
+                    if self.vector_store is None:
+                        self.vector_store = FAISS.from_embeddings(
+                            list(zip(texts, vectors)), self.embedding_model, metadatas=metadatas,
+                            ids=list(to_embed), distance_strategy="cosine"
+                        )
+                    else:
+                        self.vector_store.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas, ids=list(to_embed))
+                    self._embed_seconds += time.perf_counter() - started
+                    self._embedded_chunks += len(to_embed)
+                CHUNKS_EMBEDDED.inc(len(to_embed))
+        except Exception:
+            # Not stored: must not be found as canonical chunks
+            if detector.chunks is not None:
+                for cid in to_embed:
+                    detector.chunks.remove(cid)
+            raise
+
+        # Take the new references before releasing old ones, so chunks moving
+        # between sources of the batch are kept
+        keywords = self._keyword_index()
+        for source, chunks in new_chunks.items():
+            for cid in chunks:
+                self.chunk_sources.setdefault(cid, set()).add(source)
+        for change in batch:
+            source = change.source
+            if change.documents is None:
+                self.remove_source(source)
+                continue
+            new_ids = list(new_chunks[source])
+            self._release(source, set(self.source_chunk_ids.get(source, [])) - set(new_ids))
+            self.source_chunk_ids[source] = new_ids
+            self.source_fingerprints[source] = change.fingerprint
+            self.source_aliases.pop(source, None)
+            # Near-duplicates too: they share chunks, not keyword matches
+            keywords.add(source, "\n".join(doc.page_content for doc in change.documents))
+            if source in aliases:
+                self.source_aliases[source] = aliases[source]
+                if detector.documents is not None:
+                    detector.documents.remove(source)
+                self._count_near_duplicates("document", 1, len(new_ids))
+                logger.info(f"Indexed {source} as a near-duplicate of {aliases[source]}: {len(new_ids)} chunks shared")
+            else:
+                if detector.documents is not None:
+                    detector.documents.add(source, change.signature)
+                logger.info(f"Indexed {source}: {len(new_ids)} chunks")
+            self.version += 1
+        for source, canonical in aliases.items():
+            if canonical not in self.source_chunk_ids:
+                self.source_aliases.pop(source, None)
+        if near_duplicate_chunks:
+            self._count_near_duplicates("chunk", near_duplicate_chunks, near_duplicate_chunks)
+        return len(to_embed)
+
+    def _count_near_duplicates(self, level: str, count: int, vectors_saved: int):
+        NEAR_DUPLICATES.labels(level).inc(count)
+        self._near_duplicate_counts[f"{level}s"] += count
+        self._near_duplicate_counts["vectors_saved"] += vectors_saved
+
+    def near_duplicate_stats(self) -> dict:
+        """Near-duplicates indexed by this process and what not storing them saved.
+
+        Sizes and times are estimates: each vector not stored is priced at
+        the average on-disk bytes per chunk of the served version and the
+        average embedding time per chunk measured in this process.
+        """
+        counts = self._near_duplicate_counts
+        seconds_per_chunk = self._embed_seconds / self._embedded_chunks if self._embedded_chunks else 0.0
+        return {
+            "document_threshold": self.similarity_thresholds[0],
+            "chunk_threshold": self.similarity_thresholds[1],
+            "aliased_sources": len(self.source_aliases),
+            "documents": counts["documents"],
+            "chunks": counts["chunks"],
+            "vectors_saved": counts["vectors_saved"],
+            "index_bytes_saved": round(counts["vectors_saved"] * self._bytes_per_chunk),
+            "embed_seconds_saved": round(counts["vectors_saved"] * seconds_per_chunk, 3),
+        }
+
+    def remove_source(self, source: str) -> int:
+        """Remove every chunk owned only by `source`. Returns the number deleted."""
+        with self._lock:
+            if source not in self.source_chunk_ids:
+                return 0
+            self._ensure_writable()
+            ids = set(self.source_chunk_ids.pop(source))
+            self.source_fingerprints.pop(source, None)
+            self.source_aliases.pop(source, None)
+            # Its near-duplicates keep the shared chunks, as ordinary CVs from now on;
+            # _release makes the chunks cite one of them
+            for alias in [alias for alias, canonical in self.source_aliases.items() if canonical == source]:
+                del self.source_aliases[alias]
+            if self._detector().documents is not None:
+                self.near_duplicates.documents.remove(source)
+            self._keyword_index().remove(source)
+            removed = self._release(source, ids)
+            self.version += 1
+        if ids:
+            logger.info(f"Removed {source}: {removed} chunks deleted")
+        return removed
+
+    def _release(self, source: str, ids: Set[str]) -> int:
+        orphaned = []
+        for cid in ids:
+            owners = self.chunk_sources.get(cid)
+            if owners is None:
+                continue
+            owners.discard(source)
+            if not owners:
+                del self.chunk_sources[cid]
+                orphaned.append(cid)
+            else:
+                self._reassign(cid, source, owners)
+        if orphaned and self.vector_store is not None:
+            self.vector_store.delete(orphaned)
+        if orphaned and self._detector().chunks is not None:
+            for cid in orphaned:
+                self.near_duplicates.chunks.remove(cid)
+        return len(orphaned)
+
+    def _reassign(self, cid: str, source: str, owners: Set[str]):
+        # A shared chunk is stored with the metadata of the CV that added it first:
+        # once that CV lets go of it, name one of the remaining owners instead, or
+        # the chat would cite a CV that no longer has the chunk (or no longer exists)
+        if self.vector_store is None:
+            return
+        docstore = self.vector_store.docstore
+        doc = docstore.search(cid)
+        if not isinstance(doc, LangchainDocument) or doc.metadata.get("source") != source:
+            return
+        # Rather a CV indexed from its own text than a near-duplicate of another
+        owner = min(owners, key=lambda owner: (owner in self.source_aliases, owner))
+        metadata = {**doc.metadata, "source": owner}
+        if "shard" in metadata:
+            metadata["shard"] = shard_of(owner)
+        # A new Document: the old one may still be referenced by a served snapshot
+        docstore.delete([cid])
+        docstore.add({cid: LangchainDocument(page_content=doc.page_content, metadata=metadata)})
+
+    def apply_records(self, records: Iterable[dict]) -> int:
+        """Apply corpus records (new, replaced or deleted CVs) to the index."""
+        with self._lock:
+            embedded = self._apply_records(records)
+            self.train_if_needed()
+        return embedded
+
+    def _apply_records(self, records: Iterable[dict], pooled: bool = False) -> int:
+        changes = (
+            (record["source"], None if record.get("deleted") else [record_to_document(record)])
+            for record in records
+        )
+        return self._index_stream(changes, pooled=pooled)
+
+    def sync_corpus(self, records: Iterable[dict]) -> int:
+        """Bring the index in line with a full scan of the corpus store.
+
+        Sources indexed earlier but absent from `records` are removed.
+        """
+        seen: Set[str] = set()
+
+        def live(stream):
+            for record in stream:
+                if not record.get("deleted"):
+                    seen.add(record["source"])
+                yield record
+
+        with self._lock:
+            embedded = self._apply_records(live(records), pooled=True)
+            for source in set(self.source_chunk_ids) - seen:
+                self.remove_source(source)
+            self.train_if_needed()
+        return embedded
+
+    def _needs_training(self) -> bool:
+        if self.ann.index_type == "flat" or self.vector_store is None:
+            return False
+        size = len(self.chunk_sources)
+        if self.index_type == "flat":
+            return size >= self.ann.min_train
+        if self.index_type != self.ann.index_type or size >= 4 * self.trained_size:
+            # Other type configured, or the corpus outgrew the trained lists
+            return True
+        deleted = getattr(self.vector_store, "deleted", 0)
+        return deleted > 0.2 * self.vector_store.index.ntotal
+
+    def train_if_needed(self) -> bool:
+        """Move the vectors into the configured approximate index when it is due.
+
+        Small corpora stay on the exact flat index; once there are
+        `min_train` chunks the index is trained on all of them. It is
+        retrained when the corpus has grown 4x since, or when more than a
+        fifth of an HNSW graph consists of deleted entries.
+        """
+        with self._lock:
+            if not self._needs_training():
+                return False
+            started = time.perf_counter()
+            self._ensure_writable()
+            store = self.vector_store
+            ids = list(store.index_to_docstore_id.values())
+            if self.index_type == "flat":
+                vectors = store.index.reconstruct_n(0, store.index.ntotal)
+            else:
+                # Approximate indexes may not keep exact vectors; the embedding cache has them
+                texts = [store.docstore.search(cid).page_content for cid in ids]
+                vectors = np.array(self.embedding_model.embed_documents(texts), dtype=np.float32)
+            index = build_index(self.ann, vectors)
+            labels = np.arange(len(ids), dtype=np.int64)
+            index.add_with_ids(vectors, labels)
+            self.vector_store = AnnFAISS(
+                self.embedding_model, index, store.docstore,
+                {int(label): cid for label, cid in zip(labels, ids)}, distance_strategy="cosine"
+            )
+            self.trained_size = len(ids)
+            self._read_only = False
+            self.version += 1
+        INGEST_STAGE["train"].observe(time.perf_counter() - started)
+        logger.info(f"Trained {self.ann.describe()} index on {len(ids)} chunks in {time.perf_counter() - started:.2f}s")
+        return True
+
+    def _ensure_writable(self):
+        # A loaded index is shared with the served snapshot (and possibly mapped):
+        # read a private in-memory copy before the first change
+        if self._read_only and self.vector_store is not None:
+            index = from_mappable(index_store.read_faiss_index(self.loaded_from / "index.faiss", mmap=False))
+            docstore, index_to_docstore_id = index_store.read_docstore(self.loaded_from)
+            store_class = FAISS if index_type_of(index) == "flat" else AnnFAISS
+            self.vector_store = store_class(
+                self.embedding_model, index, InMemoryDocstore(docstore.to_dict()), index_to_docstore_id,
+                distance_strategy="cosine",
+            )
+            set_search_params(index, self.ann)
+        self._read_only = False
+
+    def save(self, index_dir: Path) -> bool:
+        """Publish the index, docstore and source maps as a new on-disk version.
+
+        Does nothing when the content has not changed since the last save/load.
+        """
+        with self._lock:
+            if self.vector_store is None or self.version == self._saved_version:
+                return False
+            started = time.perf_counter()
+            # Never reuse a version number, even after discarding a corrupted index
+            self.version = max(self.version, index_store.latest_version(index_dir) + 1)
+            staged = index_store.staging_dir(index_dir)
+            store = self.vector_store
+            faiss.write_index(to_mappable(store.index), str(staged / "index.faiss"))
+            index_store.write_docstore(
+                staged,
+                {cid: store.docstore.search(cid) for cid in store.index_to_docstore_id.values()},
+                store.index_to_docstore_id,
+            )
+            state = {
+                "source_chunk_ids": self.source_chunk_ids,
+                "chunk_sources": {cid: sorted(owners) for cid, owners in self.chunk_sources.items()},
+                "source_fingerprints": self.source_fingerprints,
+                "source_aliases": self.source_aliases,
+                "trained_size": self.trained_size,
+            }
+            (staged / "state.json").write_text(json.dumps(state))
+            self._detector().save(staged)
+            self._keyword_index().save(staged)
+            target = index_store.publish(index_dir, staged, self.version, {
+                "embedding_model": self.model_name,
+                "embedding_backend": self.embedding_backend,
+                "chunk_size": self.chunk_size,
+                "index_type": self.index_type,
+                "ntotal": self.vector_store.index.ntotal,
+                "created_at": time.time(),
+            })
+            self._saved_version = self.version
+        logger.info(f"Saved knowledge index to {target} in {time.perf_counter() - started:.2f}s")
+        return True
+
+    def publish(self, index_dir: Path) -> bool:
+        """Save the working index as a new version and serve it from now on."""
+        started = time.perf_counter()
+        with self._lock:
+            if not self.save(index_dir):
+                return False
+            version_dir = index_store.current_version_dir(index_dir)
+        opened = self._open_version(version_dir, self.mmap, verify=False)
+        if opened is None:
+            return False
+        self._serve(opened[0], opened[2]["version"], version_dir, opened[1])
+        INGEST_STAGE["publish"].observe(time.perf_counter() - started)
+        return True
+
+    def _serve(self, store: FAISS, version: int, version_dir: Path, state: Optional[dict] = None):
+        """Make `store` the version answering queries: a single reference swap."""
+        self._served = IndexSnapshot(store, version, version_dir.name, state, KeywordIndex.load(version_dir))
+        size = sum((version_dir / name).stat().st_size for name in index_store.INDEX_FILES)
+        if self.report_metrics:
+            INDEX_VERSION.set(version)
+            INDEX_CHUNKS.set(len(self._served))
+            INDEX_BYTES.set(size)
+        self._bytes_per_chunk = size / len(self._served) if len(self._served) else 0.0
+
+    def _open_version(self, version_dir: Path, mmap: bool, verify: bool = True):
+        """Read (vector store, state, manifest) of a version directory, or None if unusable."""
+        try:
+            manifest = index_store.read_manifest(version_dir, verify=verify)
+            if (manifest["embedding_model"] != self.model_name or manifest["chunk_size"] != self.chunk_size
+                    or manifest.get("embedding_backend", "torch") != self.embedding_backend):
+                logger.warning(f"Index in {version_dir} was built with other settings")
+                return None
+            index = index_store.read_faiss_index(version_dir / "index.faiss", mmap=mmap)
+            docstore, index_to_docstore_id = index_store.read_docstore(version_dir)
+            if not mmap:
+                docstore = InMemoryDocstore(docstore.to_dict())
+            state = json.loads((version_dir / "state.json").read_text())
+            index_type = index_type_of(index)
+            if index_type not in ("flat", self.ann.index_type):
+                logger.warning(f"Index in {version_dir} is {index_type}, not {self.ann.index_type}")
+                return None
+            # HNSW keeps deleted vectors, so it may hold more entries than the docstore
+            sized = index.ntotal >= len(index_to_docstore_id) if index_type == "hnsw" else index.ntotal == len(index_to_docstore_id)
+            if not sized or set(index_to_docstore_id.values()) != set(state["chunk_sources"]):
+                raise ValueError("index, docstore and source map disagree")
+        except Exception as e:
+            logger.warning(f"Discarding unreadable index in {version_dir}: {e}")
+            return None
+
+        store_class = FAISS if index_type == "flat" else AnnFAISS
+        store = store_class(self.embedding_model, index, docstore, index_to_docstore_id, distance_strategy="cosine")
+        set_search_params(index, self.ann)
+        return store, state, manifest
+
+    def load(self, index_dir: Path, mmap: bool = True, verify: bool = True) -> bool:
+        """Restore and serve the last published version from `index_dir`.
+
+        Returns False when there is nothing to load or the stored index is
+        corrupted or was built with other settings; the caller then rebuilds.
+        `verify=False` skips the checksums, for a version verified before.
+        """
+        self.mmap = mmap
+        version_dir = index_store.current_version_dir(index_dir)
+        if version_dir is None:
+            return False
+        opened = self._open_version(version_dir, mmap, verify=verify)
+        if opened is None:
+            return False
+        store, state, manifest = opened
+
+        with self._lock:
+            # The working index starts out as the served one and is copied on the first change
+            self.vector_store = store
+            self.trained_size = state.get("trained_size", 0)
+            self.source_chunk_ids = state["source_chunk_ids"]
+            self.chunk_sources = {cid: set(owners) for cid, owners in state["chunk_sources"].items()}
+            self.source_fingerprints = state["source_fingerprints"]
+            self.source_aliases = state.get("source_aliases", {})
+            self.near_duplicates = NearDuplicateDetector(*self.similarity_thresholds)
+            self._signatures_from = version_dir
+            self.keywords = KeywordIndex()
+            self._keywords_from = version_dir
+            self.version = manifest["version"]
+            self._saved_version = self.version
+            self._read_only = True
+            self.loaded_from = version_dir
+            self._serve(store, self.version, version_dir, state)
+        logger.info(f"Loaded knowledge index {version_dir.name} ({store.index.ntotal} chunks)")
+        return True
+
+    def refresh(self, index_dir: Path, mmap: bool = True) -> bool:
+        """Switch to the version published in `index_dir` if it is not the one loaded.
+
+        Used by worker processes that only serve queries; the check is a
+        single read of the CURRENT pointer file.
+        """
+        name = index_store.current_version_name(index_dir)
+        if name is None or name in (self._served.name, self._refresh_failed):
+            return False
+        opened = self._open_version(Path(index_dir) / name, mmap)
+        if opened is None:
+            self._refresh_failed = name
+            return False
+        self._serve(opened[0], opened[2]["version"], Path(index_dir) / name, opened[1])
+        logger.info(f"Switched to knowledge index {name}")
+        return True
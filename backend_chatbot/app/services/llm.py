@@ -0,0 +1,420 @@
+import asyncio
+import codecs
+import logging
+import threading
+from abc import ABC, abstractmethod
+from collections import deque
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Deque, List, Optional
+
+import numpy as np
+
+from app.core.metrics import LLM_BATCH_SEQUENCES, LLM_TOKENS
+
+logger = logging.getLogger("app_logger")
+
+
+class LLMBackend(ABC):
+    """Generates the answers from the final prompts.
+
+    Subclasses implement `stream` (a backend without it cannot be
+    created); closing the stream early stops the generation. `load` is a
+    warm-up step, run before the first question.
+    """
+
+    name = "base"
+
+    def load(self):
+        pass
+
+    def close(self):
+        pass
+
+    @abstractmethod
+    def stream(self, prompt: str) -> AsyncIterator[str]:
+        """Text deltas of the answer to `prompt`, as they are generated."""
+
+    async def complete(self, prompt: str) -> str:
+        return "".join([delta async for delta in self.stream(prompt)])
+
+    def stats(self) -> dict:
+        return {"backend": self.name}
+
+
+class GroqBackend(LLMBackend):
+    """Chat completions of Groq's hosted API (key in GROQ_API_KEY)."""
+
+    name = "groq"
+
+    def __init__(self, model: str):
+        self.model = model
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            from groq import AsyncGroq
+            self._client = AsyncGroq()
+        return self._client
+
+    def load(self):
+        # Fails here, on a missing API key, rather than on the first question
+        self.client
+
+    def _create(self, prompt: str, stream: bool):
+        return self.client.chat.completions.create(
+            messages=[{"role": "user", "content": prompt}],
+            model=self.model,
+            stream=stream,
+        )
+
+    async def complete(self, prompt: str) -> str:
+        response = await self._create(prompt, stream=False)
+        return response.choices[0].message.content
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        response = await self._create(prompt, stream=True)
+        try:
+            async for chunk in response:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    yield delta
+        finally:
+            # Stop generation upstream if the client went away mid-answer
+            await response.close()
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "model": self.model}
+
+
+@dataclass
+class _Sequence:
+    """One prompt in the local engine, from the queue to its last token."""
+    prompt: str
+    loop: asyncio.AbstractEventLoop
+    output: asyncio.Queue  # text deltas, then None, or an exception
+    tokens: List[int] = field(default_factory=list)
+    seq_id: int = -1
+    n_past: int = 0  # tokens of this sequence in the KV cache
+    reserved: int = 0  # KV cells kept for its prompt and answer
+    last_token: int = -1
+    generated: int = 0
+    started: bool = False  # first text delta sent
+    cancelled: bool = False
+    decoder: codecs.IncrementalDecoder = field(default_factory=lambda: codecs.getincrementaldecoder("utf-8")("replace"))
+
+    @property
+    def prefilling(self) -> bool:
+        return self.n_past < len(self.tokens)
+
+
+class LlamaCppBackend(LLMBackend):
+    """GGUF model run on this machine's CPU by llama.cpp (MODEL_PATH).
+
+    One engine thread owns the llama context and serves every session.
+    Prompts wait in a queue; up to `parallel` of them are decoded together,
+    each with its own KV cache sequence. Every step is one llama_decode
+    call with the next token of each answer being generated, plus prompt
+    tokens of newly admitted ones up to the batch size, so a long prompt
+    never stalls the answers already streaming and a slot freed by a
+    finished answer is refilled at the next step.
+
+    `prefix` (the prompt text before the context, the same for every
+    question) is evaluated once at load into sequence 0; each prompt
+    copies the KV cells of the tokens it shares with it instead of
+    evaluating them again.
+    """
+
+    name = "llama_cpp"
+
+    def __init__(self, parallel: int = 4, max_tokens: int = 512, temperature: float = 0.0, top_p: float = 0.95,
+                 prefix: str = "", seed: int = 0):
+        self.parallel = parallel
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.prefix = prefix
+        self._rng = np.random.default_rng(seed)
+        self._waiting: Deque[_Sequence] = deque()
+        self._active: List[_Sequence] = []
+        self._wake = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self._prefix_tokens: List[int] = []
+        self._counts = {"requests": 0, "prompt_tokens": 0, "reused_tokens": 0, "generated_tokens": 0,
+                        "decode_steps": 0, "batched_sequences": 0}
+        # Children bound once, so the engine loop does not look labels up
+        self._token_counter = {kind: LLM_TOKENS.labels(kind) for kind in ("prompt", "cached", "generated")}
+
+    def load(self):
+        if self._thread is not None:
+            return
+        from llama_cpp import llama_token_is_eog
+        from llama_cpp._internals import LlamaBatch
+        from app.core.model import load_model
+
+        # Sequence 0 holds the shared prefix, 1..parallel the answers
+        self._model, self._ctx = load_model(n_seq_max=self.parallel + 1)
+        self._is_eog = llama_token_is_eog
+        self.n_ctx = self._ctx.n_ctx()
+        self.n_batch = self._ctx.params.n_batch
+        self.parallel = min(self.parallel, self.n_batch)
+        self._n_vocab = self._model.n_vocab()
+        self._batch = LlamaBatch(n_tokens=self.n_batch, embd=0, n_seq_max=1, verbose=False)
+        self._free_ids = list(range(self.parallel, 0, -1))
+        self._formatter = self._chat_formatter()
+
+        if self.prefix:
+            # Rendered with the chat template, up to where the rest of the prompt goes
+            marker = "\x00"
+            text = self._format(self.prefix + marker)
+            self._prefix_tokens = self._tokenize(text[:text.index(marker)])
+            for start in range(0, len(self._prefix_tokens), self.n_batch):
+                chunk = self._prefix_tokens[start:start + self.n_batch]
+                self._fill([(token, start + i, 0, False) for i, token in enumerate(chunk)])
+                self._ctx.decode(self._batch)
+        self._reserved = len(self._prefix_tokens)
+
+        self._thread = threading.Thread(target=self._run, name="llm-engine", daemon=True)
+        self._thread.start()
+        logger.info(f"Local LLM ready: {self.parallel} parallel answers, {self.n_ctx} KV cells, "
+                    f"{len(self._prefix_tokens)} prefix tokens cached")
+
+    def close(self):
+        if self._thread is None:
+            return
+        with self._wake:
+            self._stopping = True
+            self._wake.notify()
+        self._thread.join()
+        self._thread = None
+
+    def _chat_formatter(self):
+        template = self._model.metadata().get("tokenizer.chat_template")
+        if not template:
+            return None
+        from llama_cpp.llama_chat_format import Jinja2ChatFormatter
+        bos, eos = self._model.token_bos(), self._model.token_eos()
+        return Jinja2ChatFormatter(
+            template=template,
+            bos_token=self._model.token_get_text(bos) if bos != -1 else "",
+            eos_token=self._model.token_get_text(eos) if eos != -1 else "",
+        )
+
+    def _format(self, content: str) -> str:
+        if self._formatter is None:
+            return content
+        return self._formatter(messages=[{"role": "user", "content": content}]).prompt
+
+    def _tokenize(self, text: str) -> List[int]:
+        # A chat template writes the special tokens itself, BOS included
+        add_bos = self._formatter is None and self._model.add_bos_token()
+        return self._model.tokenize(text.encode("utf-8"), add_bos=add_bos, special=self._formatter is not None)
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        if self._thread is None:
+            raise RuntimeError("The local LLM is not loaded")
+        sequence = _Sequence(prompt, asyncio.get_running_loop(), asyncio.Queue())
+        with self._wake:
+            self._waiting.append(sequence)
+            self._wake.notify()
+        try:
+            while True:
+                item = await sequence.output.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Frees the slot at the engine's next step if the answer was not finished
+            sequence.cancelled = True
+
+    def stats(self) -> dict:
+        steps = self._counts["decode_steps"]
+        return {
+            "backend": self.name,
+            "parallel": self.parallel,
+            "active": len(self._active),
+            "waiting": len(self._waiting),
+            "prefix_tokens": len(self._prefix_tokens),
+            **self._counts,
+            "mean_batch_sequences": round(self._counts["batched_sequences"] / steps, 2) if steps else 0.0,
+        }
+
+    # Engine thread
+
+    def _run(self):
+        while True:
+            with self._wake:
+                while not self._stopping and not self._waiting and not self._active:
+                    self._wake.wait()
+                if self._stopping:
+                    break
+                self._admit()
+            if self._active:
+                self._step()
+        for sequence in self._active + list(self._waiting):
+            self._emit(sequence, RuntimeError("The local LLM was shut down"))
+
+    def _admit(self):
+        """Moves queued prompts into free sequences while their KV cells fit."""
+        while self._waiting and self._free_ids:
+            sequence = self._waiting[0]
+            if sequence.cancelled:
+                self._waiting.popleft()
+                continue
+            if not sequence.tokens:
+                sequence.tokens = self._tokenize(self._format(sequence.prompt))
+            reused = 0
+            for a, b in zip(sequence.tokens, self._prefix_tokens):
+                if a != b:
+                    break
+                reused += 1
+            # At least one token is evaluated, for the logits of the first answer token
+            reused = min(reused, len(sequence.tokens) - 1)
+            needed = len(sequence.tokens) - reused + self.max_tokens
+            if self._reserved + needed > self.n_ctx:
+                if self._active:
+                    return  # wait for running answers to free their cells
+                self._waiting.popleft()
+                self._emit(sequence, ValueError(
+                    f"Prompt of {len(sequence.tokens)} tokens does not fit in N_CTX={self.n_ctx} "
+                    f"with {self.max_tokens} answer tokens"
+                ))
+                continue
+            self._waiting.popleft()
+            sequence.seq_id = self._free_ids.pop()
+            sequence.reserved = needed
+            self._reserved += needed
+            if reused:
+                self._ctx.kv_cache_seq_cp(0, sequence.seq_id, 0, reused)
+            sequence.n_past = reused
+            self._active.append(sequence)
+            self._counts["requests"] += 1
+            self._counts["reused_tokens"] += reused
+            self._token_counter["cached"].inc(reused)
+
+    def _step(self):
+        """One llama_decode call: a token of every answer, then prompt tokens up to the batch size."""
+        for sequence in [s for s in self._active if s.cancelled]:
+            self._finish(sequence)
+        generating = [s for s in self._active if not s.prefilling]
+        entries = [(s.last_token, s.n_past, s.seq_id, True) for s in generating]
+        fed = {s.seq_id: 1 for s in generating}
+        budget = self.n_batch - len(entries)
+        prompt_tokens = 0
+        for sequence in self._active:
+            if budget <= 0:
+                break
+            if not sequence.prefilling:
+                continue
+            chunk = sequence.tokens[sequence.n_past:sequence.n_past + budget]
+            last = len(sequence.tokens) - 1
+            entries.extend(
+                (token, sequence.n_past + i, sequence.seq_id, sequence.n_past + i == last)
+                for i, token in enumerate(chunk)
+            )
+            fed[sequence.seq_id] = len(chunk)
+            budget -= len(chunk)
+            prompt_tokens += len(chunk)
+        if not entries:
+            return
+
+        self._fill(entries)
+        try:
+            self._ctx.decode(self._batch)
+        except Exception as e:
+            for sequence in [s for s in self._active if s.seq_id in fed]:
+                self._emit(sequence, e)
+                self._finish(sequence)
+            return
+
+        self._counts["decode_steps"] += 1
+        self._counts["batched_sequences"] += len(fed)
+        self._counts["prompt_tokens"] += prompt_tokens
+        self._token_counter["prompt"].inc(prompt_tokens)
+        LLM_BATCH_SEQUENCES.observe(len(fed))
+
+        # Index in the batch of each sequence's last token, the only ones with logits
+        logits_at = {seq_id: i for i, (_, _, seq_id, logits) in enumerate(entries) if logits}
+        for sequence in list(self._active):
+            if sequence.seq_id not in fed:
+                continue
+            sequence.n_past += fed[sequence.seq_id]
+            if sequence.seq_id in logits_at:
+                self._next_token(sequence, logits_at[sequence.seq_id])
+
+    def _next_token(self, sequence: _Sequence, index: int):
+        logits = np.ctypeslib.as_array(self._ctx.get_logits_ith(index), shape=(self._n_vocab,))
+        token = self._sample(logits)
+        if self._is_eog(self._model.model, token):
+            self._finish(sequence, done=True)
+            return
+        sequence.last_token = token
+        sequence.generated += 1
+        self._counts["generated_tokens"] += 1
+        self._token_counter["generated"].inc()
+        # Pieces may end inside a multi-byte character: the decoder keeps it for the next one
+        text = sequence.decoder.decode(self._model.token_to_piece(token).rstrip(b"\x00"))
+        if not sequence.started:
+            text = text.lstrip()
+        if text:
+            sequence.started = True
+            self._emit(sequence, text)
+        if sequence.generated >= self.max_tokens:
+            self._finish(sequence, done=True)
+
+    def _sample(self, logits: np.ndarray) -> int:
+        if self.temperature <= 0:
+            return int(np.argmax(logits))
+        scaled = logits.astype(np.float64) / self.temperature
+        probabilities = np.exp(scaled - scaled.max())
+        probabilities /= probabilities.sum()
+        order = np.argsort(-probabilities)
+        # Smallest set of most likely tokens whose probabilities add up to top_p
+        keep = int(np.searchsorted(np.cumsum(probabilities[order]), self.top_p)) + 1
+        kept = order[:keep]
+        return int(self._rng.choice(kept, p=probabilities[kept] / probabilities[kept].sum()))
+
+    def _fill(self, entries):
+        batch = self._batch.batch
+        for i, (token, position, seq_id, logits) in enumerate(entries):
+            batch.token[i] = token
+            batch.pos[i] = position
+            batch.n_seq_id[i] = 1
+            batch.seq_id[i][0] = seq_id
+            batch.logits[i] = logits
+        batch.n_tokens = len(entries)
+
+    def _finish(self, sequence: _Sequence, done: bool = False):
+        self._active.remove(sequence)
+        self._ctx.kv_cache_seq_rm(sequence.seq_id, -1, -1)
+        self._free_ids.append(sequence.seq_id)
+        self._reserved -= sequence.reserved
+        if done:
+            tail = sequence.decoder.decode(b"", final=True)
+            if tail:
+                self._emit(sequence, tail)
+            self._emit(sequence, None)
+
+    def _emit(self, sequence: _Sequence, item):
+        try:
+            sequence.loop.call_soon_threadsafe(sequence.output.put_nowait, item)
+        except RuntimeError:
+            # The caller's event loop is closed: nobody reads this answer any more
+            sequence.cancelled = True
+
+
+def create_llm_backend(settings, prefix: str = "") -> LLMBackend:
+    """Backend chosen by LLM_BACKEND; `prefix` is the start shared by every prompt."""
+    if settings.LLM_BACKEND == "llama_cpp":
+        return LlamaCppBackend(
+            parallel=settings.N_PARALLEL,
+            max_tokens=settings.LLM_MAX_TOKENS,
+            temperature=settings.LLM_TEMPERATURE,
+            top_p=settings.LLM_TOP_P,
+            prefix=prefix,
+        )
+    return GroqBackend(settings.LLM_MODEL)
+
@@ -0,0 +1,157 @@
+import logging
+import re
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+import xxhash
+
+logger = logging.getLogger("app_logger")
+
+# MinHash signature length; the estimated Jaccard similarity has a standard error of about 0.03
+NUM_PERM = 128
+# Texts are compared as sets of overlapping word 5-grams
+SHINGLE_WORDS = 5
+# Multiply-shift permutations h(x) = (a * x + b) mod 2^64 >> 32 with odd a: no modulo, so cheap
+# in numpy. Fixed seed, so signatures saved with an index stay comparable across runs
+_rng = np.random.default_rng(20240501)
+_A = _rng.integers(0, 2 ** 63, NUM_PERM, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+_B = _rng.integers(0, 2 ** 63, NUM_PERM, dtype=np.uint64)
+_SHIFT = np.uint64(32)
+_WORD = re.compile(r"\w+")
+
+
+def shingle_hashes(text: str) -> np.ndarray:
+    """32-bit xxhash of every word 5-gram of `text`, lowercased, without repeats."""
+    words = _WORD.findall(text.lower())
+    count = max(1, len(words) - SHINGLE_WORDS + 1)
+    hashes = {xxhash.xxh32_intdigest(" ".join(words[i:i + SHINGLE_WORDS])) for i in range(count)}
+    return np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+
+
+def minhash(text: str) -> np.ndarray:
+    """MinHash signature of `text` (NUM_PERM uint32 values)."""
+    permuted = (shingle_hashes(text)[:, None] * _A + _B) >> _SHIFT
+    return permuted.min(axis=0).astype(np.uint32)
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """Jaccard similarity estimated from two signatures."""
+    return float(np.count_nonzero(a == b)) / len(a)
+
+
+def band_rows(threshold: float, num_perm: int = NUM_PERM) -> int:
+    """Rows per LSH band: the most selective split that still finds 99% of pairs at `threshold`."""
+    best = 1
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        if 1 - (1 - threshold ** rows) ** bands >= 0.99:
+            best = rows
+    return best
+
+
+class MinHashLSH:
+    """Keys by MinHash signature, looked up by estimated Jaccard similarity.
+
+    Signatures are split into bands; keys sharing a band with the query
+    are candidates, and the best candidate at or above `threshold` wins.
+    """
+
+    def __init__(self, threshold: float, num_perm: int = NUM_PERM):
+        self.threshold = threshold
+        self.rows = band_rows(threshold, num_perm)
+        self.bands = num_perm // self.rows
+        self.signatures: Dict[str, np.ndarray] = {}
+        self._buckets: List[Dict[bytes, Set[str]]] = [{} for _ in range(self.bands)]
+
+    def __len__(self) -> int:
+        return len(self.signatures)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.signatures
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def add(self, key: str, signature: np.ndarray):
+        self.remove(key)
+        self.signatures[key] = signature
+        for bucket, band in zip(self._buckets, self._band_keys(signature)):
+            bucket.setdefault(band, set()).add(key)
+
+    def remove(self, key: str):
+        signature = self.signatures.pop(key, None)
+        if signature is None:
+            return
+        for bucket, band in zip(self._buckets, self._band_keys(signature)):
+            keys = bucket.get(band)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del bucket[band]
+
+    def query(self, signature: np.ndarray, exclude: Iterable[str] = ()) -> Optional[Tuple[str, float]]:
+        """(key, similarity) of the most similar key at or above the threshold, or None."""
+        candidates: Set[str] = set()
+        for bucket, band in zip(self._buckets, self._band_keys(signature)):
+            candidates.update(bucket.get(band, ()))
+        candidates.difference_update(exclude)
+        best = None
+        for key in candidates:
+            score = similarity(signature, self.signatures[key])
+            if score >= self.threshold and (best is None or score > best[1]):
+                best = (key, score)
+        return best
+
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        keys = list(self.signatures)
+        signatures = np.stack([self.signatures[key] for key in keys]) if keys else np.empty((0, NUM_PERM), np.uint32)
+        return np.array(keys, dtype=str), signatures
+
+    def load_arrays(self, keys: np.ndarray, signatures: np.ndarray):
+        for key, signature in zip(keys.tolist(), signatures):
+            self.add(key, signature)
+
+
+class NearDuplicateDetector:
+    """Near-duplicate CVs and chunks, so copies point at one canonical entry.
+
+    `documents` holds the sources indexed with their own chunks, keyed by
+    the signature of their whole text; `chunks` holds the chunk ids whose
+    vectors are stored. A threshold of 0 disables that level.
+    """
+
+    FILE = "near_duplicates.npz"
+
+    def __init__(self, document_threshold: float = 0.0, chunk_threshold: float = 0.0):
+        self.thresholds = (document_threshold, chunk_threshold)
+        self.documents = MinHashLSH(document_threshold) if document_threshold else None
+        self.chunks = MinHashLSH(chunk_threshold) if chunk_threshold else None
+
+    @property
+    def enabled(self) -> bool:
+        return self.documents is not None or self.chunks is not None
+
+    def save(self, directory: Path):
+        arrays = {}
+        for name, lsh in (("documents", self.documents), ("chunks", self.chunks)):
+            if lsh is not None:
+                arrays[f"{name}_keys"], arrays[f"{name}_signatures"] = lsh.arrays()
+        if arrays:
+            np.savez(Path(directory) / self.FILE, **arrays)
+
+    def load(self, directory: Path):
+        """Signatures saved with an index version; a missing or unreadable file leaves them empty."""
+        path = Path(directory) / self.FILE
+        if not self.enabled or not path.exists():
+            return
+        try:
+            with np.load(path) as arrays:
+                for name, lsh in (("documents", self.documents), ("chunks", self.chunks)):
+                    if lsh is not None and f"{name}_keys" in arrays:
+                        lsh.load_arrays(arrays[f"{name}_keys"], arrays[f"{name}_signatures"])
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable near-duplicate signatures in {path}: {e}")
+            self.__init__(*self.thresholds)
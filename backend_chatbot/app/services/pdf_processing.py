@@ -1,61 +1,169 @@
 import os
 import csv
-from pdfminer.high_level import extract_text
-from docx import Document
 import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-import pandas as pd
-import pdfplumber
-import time
+from typing import List, Tuple
 
+# pypdfium2, pdfminer và python-docx chỉ được import khi trích xuất, để import module này vẫn nhẹ
+
+
+def _pdfium_pages(pdf_path, start, stop) -> List[str]:
+    """Text layer of pages [start, stop) read by pdfium (native, much faster than pdfminer)."""
+    import pypdfium2 as pdfium
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        texts = []
+        for index in range(start, stop):
+            page = pdf[index]
+            textpage = page.get_textpage()
+            texts.append(textpage.get_text_bounded().replace("\r\n", "\n"))
+            textpage.close()
+            page.close()
+        return texts
+    finally:
+        pdf.close()
+
+
+def _pdfminer_pages(pdf_path, start, stop) -> List[str]:
+    """Pages [start, stop) laid out by pdfminer."""
+    from pdfminer.high_level import extract_text
+    return [extract_text(pdf_path, page_numbers=range(start, stop))]
+
+
+def _read_pages(reader, pdf_path, page_count, page_workers, parallel_pages) -> List[str]:
+    # Mỗi process đọc ít nhất parallel_pages / 2 trang, nếu không thì chi phí fork lớn hơn phần tiết kiệm được
+    workers = min(page_workers, os.cpu_count() or 1, page_count // max(parallel_pages // 2, 1))
+    if workers < 2 or page_count < parallel_pages or "fork" not in multiprocessing.get_all_start_methods():
+        return reader(pdf_path, 0, page_count)
+    step = -(-page_count // workers)
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("fork")) as pool:
+        futures = [pool.submit(reader, pdf_path, start, min(start + step, page_count))
+                   for start in range(0, page_count, step)]
+        return [text for future in futures for text in future.result()]
+
+
+def extract_pdf(pdf_path, page_workers=1, parallel_pages=32) -> Tuple[str, str]:
+    """Text of a PDF and the tier that produced it: "pdfium", or "pdfminer" as fallback.
+
+    PDFs with at least `parallel_pages` pages are split into page ranges read by
+    up to `page_workers` forked processes; only call it with page_workers > 1
+    from a single-threaded process such as the extraction child.
+    """
+    if not os.path.exists(pdf_path):
+        raise FileNotFoundError(f"Error: File not found - {pdf_path}")
+    import pypdfium2 as pdfium
+    try:
+        pdf = pdfium.PdfDocument(pdf_path)
+        page_count = len(pdf)
+        pdf.close()
+    except pdfium.PdfiumError as e:
+        print(f"pdfium could not read {pdf_path}, falling back to pdfminer: {e}")
+        from pdfminer.high_level import extract_text
+        return extract_text(pdf_path), "pdfminer"
+    text = "\n".join(_read_pages(_pdfium_pages, pdf_path, page_count, page_workers, parallel_pages))
+    if text.strip():
+        return text, "pdfium"
+    # Không có lớp text mà pdfium đọc được (font lạ hoặc PDF scan): thử pdfminer
+    return "".join(_read_pages(_pdfminer_pages, pdf_path, page_count, page_workers, parallel_pages)), "pdfminer"
+
+
+def render_thumbnail(pdf_path, output_path, width=240, quality=80):
+    """Render the first page of a PDF into a JPEG `width` pixels wide at `output_path`."""
+    import pypdfium2 as pdfium
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        page = pdf[0]
+        image = page.render(scale=width / page.get_width()).to_pil().convert("RGB")
+        page.close()
+    finally:
+        pdf.close()
+    # Ghi ra file tạm rồi đổi tên để không bao giờ phục vụ ảnh ghi dở
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    image.save(tmp_path, format="JPEG", quality=quality, optimize=True)
+    os.replace(tmp_path, output_path)
 
 
 def extract_text_from_pdf(pdf_path):
     """Extract text from PDF file."""
     try:
-        if not os.path.exists(pdf_path):
-            raise FileNotFoundError(f"Error: File not found - {pdf_path}")
-        time.sleep(0.1)  # Đợi một chút để đảm bảo file được tạo xong
-        return extract_text(pdf_path)
+        return extract_pdf(pdf_path)[0]
     except Exception as e:
         print(f"Error extracting text from PDF: {e}")
         return ""
 
+
+def _docx_blocks(container) -> List[str]:
+    """Paragraphs and tables of a document or table cell, in document order."""
+    from docx.table import Table
+    blocks = []
+    for block in container.iter_inner_content():
+        if isinstance(block, Table):
+            for row in block.rows:
+                # Ô gộp (merged) xuất hiện lặp lại trong row.cells: chỉ lấy một lần
+                cells = list(dict.fromkeys(row.cells))
+                texts = ["\n".join(_docx_blocks(cell)).strip() for cell in cells]
+                line = " | ".join(text for text in texts if text)
+                if line:
+                    blocks.append(line)
+        elif block.text:
+            blocks.append(block.text)
+    return blocks
+
+
+def extract_doc(doc_path) -> Tuple[str, str]:
+    """Text of a DOCX file, tables included, and the tier that produced it ("docx")."""
+    from docx import Document
+    return "\n".join(_docx_blocks(Document(doc_path))), "docx"
+
+
 def extract_text_from_doc(doc_path):
     """Extract text from DOC/DOCX file."""
     try:
-        document = Document(doc_path)
-        return "\n".join([paragraph.text for paragraph in document.paragraphs])
+        return extract_doc(doc_path)[0]
     except Exception as e:
         print(f"Error extracting text from DOC/DOCX: {e}")
         return ""
 
+def clean_text(text):
+    """Collapse line breaks the same way the CSV export always has."""
+    return text.replace("\n", " ").replace("\r", " ")
+
 def save_text_to_csv(text, csv_path, source_pdf):
     """Save extracted text to a CSV file."""
     try:
-        cleaned_text = text.replace("\n", " ").replace("\r", " ")
-        with open(csv_path, mode='w', newline='', encoding='utf-8') as file:
+        cleaned_text = clean_text(text)
+        # Ghi ra file tạm rồi đổi tên để watcher không đọc phải CSV đang ghi dở
+        tmp_path = f"{csv_path}.tmp"
+        with open(tmp_path, mode='w', newline='', encoding='utf-8') as file:
             writer = csv.writer(file)
             writer.writerow(["source", "Resume"])  
             writer.writerow([source_pdf, cleaned_text])  # Dữ liệu
+        os.replace(tmp_path, csv_path)
         print(f"CSV file saved at: {csv_path}")
+        return True
     except Exception as e:
         print(f"Error saving to CSV: {e}")
+        return False
 
-def convert_to_csv(file_path, output_csv_path):
-    """Convert file (PDF/DOC/DOCX) to CSV."""
+def extract_text_from_file(file_path):
+    """Extract text from a PDF/DOC/DOCX file; None if the format is unsupported."""
     file_extension = os.path.splitext(file_path)[-1].lower()
     if file_extension == ".pdf":
-        text = extract_text_from_pdf(file_path)
-    elif file_extension in [".doc", ".docx"]:
-        text = extract_text_from_doc(file_path)
-    else:
-        print("Unsupported file format. Only PDF and DOC/DOCX are supported.")
-        return
-    
+        return extract_text_from_pdf(file_path)
+    if file_extension in [".doc", ".docx"]:
+        return extract_text_from_doc(file_path)
+    print("Unsupported file format. Only PDF and DOC/DOCX are supported.")
+    return None
+
+def convert_to_csv(file_path, output_csv_path):
+    """Convert file (PDF/DOC/DOCX) to CSV."""
+    text = extract_text_from_file(file_path)
     if text:
         last_folder = os.path.basename(os.path.normpath(file_path))
-        save_text_to_csv(text, output_csv_path, last_folder)
+        return save_text_to_csv(text, output_csv_path, last_folder)
+    return False
 
 # def process_file(input_file, output_csv):
 #     """Process file and convert it to CSV."""
@@ -75,10 +183,12 @@ def process_file(input_file, output_folder):
         output_csv = Path(output_folder) / input_path.with_suffix('.csv').name
 
         # Gọi hàm convert_to_csv với đường dẫn chính xác
-        convert_to_csv(input_file, str(output_csv))
-        print(f"File processed and saved to: {output_csv}")
+        if convert_to_csv(input_file, str(output_csv)):
+            print(f"File processed and saved to: {output_csv}")
+            return output_csv
     else:
         print(f"Error: File not found - {input_file}")
+    return None
 
 # Usage
 # # Đường dẫn tệp đầu vào
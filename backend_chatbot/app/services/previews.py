@@ -0,0 +1,68 @@
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger("app_logger")
+
+
+class PreviewStore:
+    """Page-1 thumbnails and text previews of CVs by file content hash.
+
+    Both are written at ingest, so a result list can show every CV without
+    downloading it. Entries are content-addressed: a CV uploaded again
+    under another name reuses them, and a changed file gets new ones.
+    """
+
+    def __init__(self, root: Path, text_chars: int = 500):
+        self.root = Path(root)
+        self.text_chars = text_chars
+
+    def _path(self, content_hash: str, suffix: str) -> Path:
+        return self.root / content_hash[:2] / f"{content_hash}{suffix}"
+
+    def thumbnail_path(self, content_hash: str) -> Path:
+        """Where the JPEG thumbnail of this content goes; the parent directory exists."""
+        path = self._path(content_hash, ".jpg")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return path
+
+    def has_thumbnail(self, content_hash: str) -> bool:
+        return self._path(content_hash, ".jpg").exists()
+
+    def text(self, content_hash: str) -> Optional[str]:
+        try:
+            return self._path(content_hash, ".txt").read_text(encoding="utf-8")
+        except FileNotFoundError:
+            return None
+
+    def has_text(self, content_hash: str) -> bool:
+        return self._path(content_hash, ".txt").exists()
+
+    def put_text(self, content_hash: str, text: str):
+        """Store the first `text_chars` characters of a CV, cut at a word boundary."""
+        preview = " ".join(text.split())
+        if len(preview) > self.text_chars:
+            preview = preview[:self.text_chars].rsplit(" ", 1)[0] + "…"
+        path = self._path(content_hash, ".txt")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f"{path.name}.{os.getpid()}.{time.monotonic_ns()}.tmp")
+            tmp.write_text(preview, encoding="utf-8")
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"Could not store the text preview of {content_hash}: {e}")
+
+
+_preview_store: Optional[PreviewStore] = None
+
+
+def get_preview_store() -> Optional[PreviewStore]:
+    """Process-wide preview store, or None when PREVIEW_DIR is unset."""
+    global _preview_store
+    if _preview_store is None and settings.PREVIEW_DIR:
+        _preview_store = PreviewStore(Path(settings.PREVIEW_DIR), text_chars=settings.PREVIEW_TEXT_CHARS)
+    return _preview_store
@@ -0,0 +1,527 @@
+import heapq
+import itertools
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+from langchain.docstore.document import Document as LangchainDocument
+
+from app.core.metrics import (
+    INDEX_BYTES, INDEX_CHUNKS, INDEX_SHARD_EVICTIONS, INDEX_SHARD_LOOKUPS, INDEX_SHARDS_LOADED, INDEX_VERSION,
+    SHARD_FANOUT
+)
+from app.services import index_store
+from app.services.batch_search import SourceHit
+from app.services.knowledge_index import IndexSnapshot, KnowledgeIndex
+from app.services.shards import ALL_SHARDS, DEFAULT_SHARD, group_by_shard, is_shard_name, shard_of
+
+logger = logging.getLogger("app_logger")
+
+# On-disk layout: the version directories of index_store, once per shard
+#   <root>/shards/<shard>/CURRENT
+#   <root>/shards/<shard>/v00000042/
+SHARDS_DIR = "shards"
+
+# Chunks of a ShardedSnapshot are keyed by (shard, chunk id)
+ChunkKey = Tuple[str, str]
+
+
+def version_bytes(version_dir: Path) -> int:
+    """On-disk size of a version directory: what serving it maps or reads into memory."""
+    try:
+        return sum(path.stat().st_size for path in Path(version_dir).iterdir() if path.is_file())
+    except FileNotFoundError:
+        return 0
+
+
+class ShardedKeywords:
+    """Keyword indexes of the shards of a ShardedSnapshot, searched as one."""
+
+    def __init__(self, snapshot: "ShardedSnapshot", names: List[str]):
+        self._snapshot = snapshot
+        self._names = names
+
+    def _map(self, func) -> List:
+        found = self._snapshot.map(
+            lambda name, snapshot: None if snapshot.keywords is None else func(snapshot.keywords), self._names
+        )
+        return [result for _, result in found if result is not None]
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[str, float]]:
+        # Each shard scores with its own statistics (document frequencies, average length):
+        # close to, but not exactly, the BM25 of one index over all of them
+        found = self._map(lambda keywords: keywords.search(query, k))
+        return heapq.nlargest(k, itertools.chain.from_iterable(found), key=lambda match: match[1])
+
+    def filter(self, expression, k: int = 20) -> Tuple[int, List[Tuple[str, float]]]:
+        found = self._map(lambda keywords: keywords.filter(expression, k))
+        matches = itertools.chain.from_iterable(matches for _, matches in found)
+        return sum(total for total, _ in found), heapq.nlargest(k, matches, key=lambda match: match[1])
+
+    def matching_sources(self, expression) -> List[str]:
+        return list(itertools.chain.from_iterable(self._map(lambda keywords: keywords.matching_sources(expression))))
+
+    def stats(self) -> dict:
+        totals: Dict[str, int] = {}
+        for stats in self._map(lambda keywords: keywords.stats()):
+            for key, value in stats.items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def __contains__(self, source: str) -> bool:
+        name = shard_of(source)
+        snapshot = self._snapshot.shard(name) if name in self._names else None
+        return snapshot is not None and snapshot.keywords is not None and source in snapshot.keywords
+
+    def __len__(self) -> int:
+        return sum(self._map(len))
+
+
+class ShardedSnapshot:
+    """Snapshots of several shards, taken together and searched as one index.
+
+    Searches fan out to the shards in parallel and merge the top results
+    of each, so a query costs what its largest shard costs. Chunks are
+    keyed by (shard, chunk id). `version` is the sum of the shard versions:
+    it grows with every version published to one of these shards.
+    """
+
+    def __init__(self, snapshots: Dict[str, IndexSnapshot], executor: Optional[ThreadPoolExecutor] = None):
+        self.snapshots = snapshots
+        self.versions = {name: snapshot.version for name, snapshot in snapshots.items()}
+        self.version = sum(self.versions.values())
+        self._executor = executor
+        with_keywords = [name for name, snapshot in snapshots.items() if snapshot.keywords is not None]
+        self.keywords = ShardedKeywords(self, with_keywords) if with_keywords else None
+
+    def __len__(self) -> int:
+        return sum(size for _, size in self.map(lambda name, snapshot: len(snapshot)))
+
+    def shard(self, name: str) -> Optional[IndexSnapshot]:
+        return self.snapshots.get(name)
+
+    def map(self, func: Callable[[str, IndexSnapshot], object], names: Optional[Iterable[str]] = None) -> List[Tuple[str, object]]:
+        """[(shard, func(shard, snapshot))] over `names` (default: every shard), in parallel."""
+        names = [name for name in (self.versions if names is None else names) if name in self.snapshots]
+        return self._parallel(func, {name: self.snapshots[name] for name in names})
+
+    def _parallel(self, func, snapshots: Dict[str, IndexSnapshot]) -> List[Tuple[str, object]]:
+        if len(snapshots) <= 1 or self._executor is None:
+            return [(name, func(name, snapshot)) for name, snapshot in snapshots.items()]
+        futures = [(name, self._executor.submit(func, name, snapshot)) for name, snapshot in snapshots.items()]
+        return [(name, future.result()) for name, future in futures]
+
+    def search_chunks(self, vector, k: int, sources: Optional[List[str]] = None) -> List[Tuple[ChunkKey, float]]:
+        if sources is None:
+            found = self.map(lambda name, snapshot: snapshot.search_chunks(vector, k))
+        else:
+            groups = group_by_shard(sources)
+            found = self.map(lambda name, snapshot: snapshot.search_chunks(vector, k, groups[name]), groups)
+        hits = (((name, cid), score) for name, chunks in found for cid, score in chunks)
+        return heapq.nlargest(k, hits, key=lambda hit: hit[1])
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4) -> List[Tuple[LangchainDocument, float]]:
+        found = self.map(lambda name, snapshot: snapshot.similarity_search_with_score_by_vector(embedding, k))
+        return heapq.nlargest(k, itertools.chain.from_iterable(docs for _, docs in found), key=lambda hit: hit[1])
+
+    def search_sources(self, vectors: np.ndarray, k: int = 5, fetch_k: Optional[int] = None,
+                       filter: Optional[dict] = None) -> List[List[SourceHit]]:
+        """Top `k` CVs for each row of `vectors`; a source filter only searches the shards of those sources."""
+        names, filters = list(self.versions), {}
+        sources = (filter or {}).get("source")
+        if sources is not None:
+            groups = group_by_shard(sources if isinstance(sources, (list, tuple, set)) else [sources])
+            names = list(groups)
+            filters = {name: dict(filter, source=group) for name, group in groups.items()}
+        found = self.map(
+            lambda name, snapshot: snapshot.search_sources(vectors, k, fetch_k, filters.get(name, filter)), names
+        )
+        merged: List[List[SourceHit]] = [[] for _ in range(len(vectors))]
+        for name, per_query in found:
+            for hits, shard_hits in zip(merged, per_query):
+                for hit in shard_hits:
+                    hit.shard = name
+                hits.extend(shard_hits)
+        return [heapq.nlargest(k, hits, key=lambda hit: hit.score) for hits in merged]
+
+    def document(self, key: ChunkKey) -> LangchainDocument:
+        shard, cid = key
+        return self.shard(shard).document(cid)
+
+    def chunk_owners(self, key: ChunkKey) -> List[str]:
+        shard, cid = key
+        return self.shard(shard).chunk_owners(cid)
+
+
+class StreamedSnapshot(ShardedSnapshot):
+    """A fan-out to more shards than the memory budget holds, searched without holding them all.
+
+    Each search first runs on the shards in memory, in parallel, then
+    loads the others one at a time, each released before the next one
+    is loaded: memory stays within the budget plus one shard. A shard
+    is held for the rest of the query once one of its chunks is read.
+    `versions` are those published when the snapshot was taken; a shard
+    published again meanwhile is searched at its new version.
+    """
+
+    def __init__(self, index: "ShardedIndex", versions: Dict[str, int], executor: Optional[ThreadPoolExecutor] = None):
+        super().__init__({}, executor)
+        self._index = index
+        self.versions = versions
+        self.version = sum(versions.values())
+        self.keywords = ShardedKeywords(self, list(versions)) if versions else None
+
+    def shard(self, name: str) -> Optional[IndexSnapshot]:
+        snapshot = self.snapshots.get(name)
+        if snapshot is None and name in self.versions:
+            index = self._index.get(name)
+            if index is not None:
+                snapshot = self.snapshots.setdefault(name, index.snapshot())
+        return snapshot
+
+    def map(self, func: Callable[[str, IndexSnapshot], object], names: Optional[Iterable[str]] = None) -> List[Tuple[str, object]]:
+        names = [name for name in (self.versions if names is None else names) if name in self.versions]
+        resident = {}
+        for name in names:
+            snapshot = self.snapshots.get(name)
+            if snapshot is None:
+                index = self._index.resident(name)
+                snapshot = index.snapshot() if index is not None else None
+            if snapshot is not None:
+                resident[name] = snapshot
+        found = dict(self._parallel(func, resident))
+        resident = set(resident)
+        for name in names:
+            if name in resident:
+                continue
+            index = self._index.get(name)
+            if index is not None:
+                found[name] = func(name, index.snapshot())
+            # Not kept: loading the next shard may drop this one from memory
+            del index
+        return [(name, found[name]) for name in names if name in found]
+
+
+class ShardedIndex:
+    """One KnowledgeIndex per shard, loaded on first use within a memory budget.
+
+    Each shard is published under <root>/shards/<shard>, so a change to
+    the CVs of one shard rebuilds and publishes that shard only. Shards
+    are loaded when a query or a build first needs them; once the loaded
+    versions take more than `memory_budget` bytes on disk (what they map
+    or read into memory), the least recently used ones are dropped. The
+    shard just used, shards being built and shards with unpublished
+    changes are kept; a query holding the snapshot of a dropped shard
+    finishes on it.
+
+    `snapshot(shards)` takes the snapshots of some shards ("*": all of
+    them) together; its searches fan out to them on `workers` threads.
+    A fan-out to more shards than `memory_budget` holds loads and
+    searches them one at a time instead (StreamedSnapshot).
+    """
+
+    def __init__(self, root: Path, factory: Callable[[], KnowledgeIndex], memory_budget: Optional[int] = None,
+                 mmap: bool = True, workers: Optional[int] = None):
+        self.root = Path(root)
+        self.factory = factory
+        self.memory_budget = memory_budget
+        self.mmap = mmap
+        self._embedding_model = None
+        # Least recently used first
+        self._loaded: "OrderedDict[str, KnowledgeIndex]" = OrderedDict()
+        self._bytes: Dict[str, int] = {}
+        self._known: Set[str] = set()
+        self._pinned: Dict[str, int] = {}
+        # Version directory of each shard whose checksums were verified: not verified again on reload
+        self._verified: Dict[str, str] = {}
+        self._loading: Dict[str, threading.Lock] = {}
+        self._lock = threading.RLock()
+        self.loads = 0
+        self.evictions = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1, thread_name_prefix="shard-search")
+
+    @property
+    def embedding_model(self):
+        return self._embedding_model
+
+    @embedding_model.setter
+    def embedding_model(self, model):
+        self._embedding_model = model
+        with self._lock:
+            for index in self._loaded.values():
+                index.embedding_model = model
+
+    def embed_query(self, query: str) -> List[float]:
+        return self._embedding_model.embed_query(query)
+
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        """Embeddings of many queries in one batched call, bypassing the chunk embedding cache."""
+        model = getattr(self._embedding_model, "underlying_embeddings", self._embedding_model)
+        return np.array(model.embed_documents(list(queries)), dtype=np.float32)
+
+    def path(self, shard: str) -> Path:
+        return self.root / SHARDS_DIR / shard
+
+    def discover(self) -> List[str]:
+        """Find the shards published on disk (by any process); returns their names."""
+        shards_dir = self.root / SHARDS_DIR
+        found = {
+            path.name for path in shards_dir.iterdir()
+            if is_shard_name(path.name) and (path / index_store.CURRENT_FILE).is_file()
+        } if shards_dir.is_dir() else set()
+        with self._lock:
+            self._known = found
+        return sorted(found)
+
+    def shards(self) -> List[str]:
+        return sorted(self._known)
+
+    def resolve(self, shards: Iterable[str]) -> List[str]:
+        """The published shards among `shards`; "*" stands for every shard."""
+        shards = list(shards)
+        if ALL_SHARDS in shards:
+            return self.shards()
+        known = self._known
+        return [name for name in shards if name in known]
+
+    def is_empty(self, shards: Iterable[str]) -> bool:
+        """No shard among `shards` has a published index."""
+        return not self.resolve(shards)
+
+    def resident(self, shard: str) -> Optional[KnowledgeIndex]:
+        """The index of `shard` if it is in memory; never loads it."""
+        with self._lock:
+            return self._touch(shard)
+
+    def get(self, shard: str) -> Optional[KnowledgeIndex]:
+        """The index of `shard`, loaded if needed; None if it has no readable published version."""
+        with self._lock:
+            index = self._touch(shard)
+            if index is not None:
+                return index
+            if shard not in self._known:
+                INDEX_SHARD_LOOKUPS.labels("missing").inc()
+                return None
+            loading = self._loading.setdefault(shard, threading.Lock())
+        # One load per shard at a time; other shards load meanwhile
+        with loading:
+            with self._lock:
+                index = self._touch(shard)
+            if index is not None:
+                return index
+            index = self._load(shard)
+            if index is None:
+                INDEX_SHARD_LOOKUPS.labels("missing").inc()
+                return None
+            INDEX_SHARD_LOOKUPS.labels("load").inc()
+            with self._lock:
+                self._loaded[shard] = index
+                self._account(shard, index)
+                self._evict()
+            return index
+
+    def _touch(self, shard: str) -> Optional[KnowledgeIndex]:
+        index = self._loaded.get(shard)
+        if index is not None:
+            self._loaded.move_to_end(shard)
+            INDEX_SHARD_LOOKUPS.labels("hit").inc()
+        return index
+
+    def _load(self, shard: str) -> Optional[KnowledgeIndex]:
+        index = self.factory()
+        index.embedding_model = self._embedding_model
+        name = index_store.current_version_name(self.path(shard))
+        if not index.load(self.path(shard), mmap=self.mmap, verify=self._verified.get(shard) != name):
+            return None
+        self._verified[shard] = index.snapshot().name
+        self.loads += 1
+        return index
+
+    def _account(self, shard: str, index: KnowledgeIndex):
+        name = index.snapshot().name
+        self._bytes[shard] = version_bytes(self.path(shard) / name) if name else 0
+        self._report()
+
+    def _evict(self):
+        if self.memory_budget is not None:
+            # Never the most recently used shard: the one a query or build is about to use
+            for shard in list(self._loaded)[:-1]:
+                if sum(self._bytes.values()) <= self.memory_budget:
+                    break
+                if self._pinned.get(shard) or self._loaded[shard].unsaved:
+                    continue
+                del self._loaded[shard]
+                self._bytes.pop(shard, None)
+                self.evictions += 1
+                INDEX_SHARD_EVICTIONS.inc()
+                logger.info(f"Dropped index shard {shard} from memory")
+        self._report()
+
+    def _report(self):
+        INDEX_SHARDS_LOADED.set(len(self._loaded))
+        INDEX_BYTES.set(sum(self._bytes.values()))
+        INDEX_CHUNKS.set(sum(len(index) for index in self._loaded.values()))
+        INDEX_VERSION.set(max((index.snapshot().version for index in self._loaded.values()), default=0))
+
+    @contextmanager
+    def building(self, shard: str) -> Iterator[KnowledgeIndex]:
+        """The working index of `shard` (empty for a new shard), kept in memory until the block exits."""
+        with self._lock:
+            self._pinned[shard] = self._pinned.get(shard, 0) + 1
+        index = None
+        try:
+            index = self.get(shard)
+            if index is None:
+                index = self.factory()
+                index.embedding_model = self._embedding_model
+                index.mmap = self.mmap
+                with self._lock:
+                    self._loaded[shard] = index
+                    self._bytes[shard] = 0
+            yield index
+        finally:
+            with self._lock:
+                self._pinned[shard] -= 1
+                if not self._pinned[shard]:
+                    del self._pinned[shard]
+                # A new shard that got nothing to index is not kept
+                if index is not None and index.vector_store is None and self._loaded.get(shard) is index:
+                    del self._loaded[shard]
+                    self._bytes.pop(shard, None)
+                self._evict()
+
+    def publish(self, shard: str, index: KnowledgeIndex) -> bool:
+        """Publish the working index of `shard` as a new version and serve it from now on."""
+        if not index.publish(self.path(shard)):
+            return False
+        with self._lock:
+            self._known.add(shard)
+            self._verified[shard] = index.snapshot().name
+            if self._loaded.get(shard) is index:
+                self._account(shard, index)
+        return True
+
+    def refresh(self) -> bool:
+        """Find new shards and switch the loaded ones to their newest published version.
+
+        Used by worker processes that only serve queries: one read of the
+        shards directory, and one of the CURRENT pointer of each loaded shard.
+        """
+        self.discover()
+        with self._lock:
+            loaded = list(self._loaded.items())
+        changed = False
+        for shard, index in loaded:
+            if index.refresh(self.path(shard), mmap=self.mmap):
+                changed = True
+                with self._lock:
+                    if self._loaded.get(shard) is index:
+                        self._account(shard, index)
+        return changed
+
+    def snapshot(self, shards: Iterable[str]) -> ShardedSnapshot:
+        """Snapshots of `shards` ("*": every shard) taken together, loading the missing ones in parallel.
+
+        When the shards take more than the memory budget, they are not
+        loaded here: the snapshot loads them one at a time as it searches.
+        """
+        names = self.resolve(shards)
+        SHARD_FANOUT.observe(len(names))
+        if len(names) > 1 and self.memory_budget is not None and sum(map(self._size, names)) > self.memory_budget:
+            return self._streamed(names)
+        with self._lock:
+            missing = [name for name in names if name not in self._loaded]
+        loaded = dict(zip(missing, self._executor.map(self.get, missing))) if len(missing) > 1 else {}
+        # Snapshots come from the indexes returned here: loading one shard may drop another from memory,
+        # but not from this snapshot
+        indexes = {name: loaded[name] if name in loaded else self.get(name) for name in names}
+        return ShardedSnapshot(
+            {name: index.snapshot() for name, index in indexes.items() if index is not None}, self._executor
+        )
+
+    def _size(self, shard: str) -> int:
+        with self._lock:
+            if shard in self._bytes:
+                return self._bytes[shard]
+        version_dir = index_store.current_version_dir(self.path(shard))
+        return version_bytes(version_dir) if version_dir is not None else 0
+
+    def _streamed(self, names: List[str]) -> StreamedSnapshot:
+        versions = {}
+        for name in names:
+            with self._lock:
+                index = self._loaded.get(name)
+            if index is not None:
+                versions[name] = index.snapshot().version
+                continue
+            try:
+                manifest = index_store.read_manifest(index_store.current_version_dir(self.path(name)), verify=False)
+            except Exception:
+                continue
+            versions[name] = manifest["version"]
+        return StreamedSnapshot(self, versions, self._executor)
+
+    def adopt_unsharded(self) -> bool:
+        """Move an index published before sharding (<root>/CURRENT) into the default shard, once."""
+        version_dir = index_store.current_version_dir(self.root)
+        target = self.path(DEFAULT_SHARD)
+        if version_dir is None or index_store.current_version_name(target) is not None:
+            return False
+        target.mkdir(parents=True, exist_ok=True)
+        os.replace(version_dir, target / version_dir.name)
+        index_store.set_current(target, version_dir.name)
+        (self.root / index_store.CURRENT_FILE).unlink()
+        index_store.prune(self.root, keep=0)
+        logger.info(f"Moved knowledge index {version_dir.name} into shard {DEFAULT_SHARD}")
+        return True
+
+    def stats(self) -> Dict[str, dict]:
+        """Version, size and residency of every shard; from the manifest for shards not loaded."""
+        with self._lock:
+            loaded, sizes, known = dict(self._loaded), dict(self._bytes), sorted(self._known)
+        shards = {}
+        for name in known:
+            index = loaded.get(name)
+            if index is not None and index.snapshot().name is not None:
+                snapshot = index.snapshot()
+                shards[name] = {"version": snapshot.version, "name": snapshot.name, "chunks": len(snapshot),
+                                "loaded": True, "bytes": sizes.get(name, 0)}
+                if snapshot.keywords is not None:
+                    shards[name]["documents"] = len(snapshot.keywords)
+                continue
+            version_dir = index_store.current_version_dir(self.path(name))
+            try:
+                manifest = index_store.read_manifest(version_dir, verify=False)
+            except Exception:
+                shards[name] = {"version": None, "loaded": False}
+                continue
+            shards[name] = {"version": manifest["version"], "name": version_dir.name, "chunks": manifest["ntotal"],
+                            "loaded": False, "bytes": version_bytes(version_dir)}
+        return shards
+
+    def residency(self) -> dict:
+        with self._lock:
+            return {
+                "shards": len(self._known),
+                "loaded": len(self._loaded),
+                "bytes": sum(self._bytes.values()),
+                "memory_budget": self.memory_budget,
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
+
+    def near_duplicate_stats(self) -> dict:
+        """Near-duplicate counts of the loaded shards, summed."""
+        totals: Dict[str, float] = {}
+        with self._lock:
+            indexes = list(self._loaded.values())
+        for index in indexes:
+            for key, value in index.near_duplicate_stats().items():
+                totals[key] = value if key.endswith("threshold") else totals.get(key, 0) + value
+        return totals
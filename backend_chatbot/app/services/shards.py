@@ -0,0 +1,64 @@
+import re
+from typing import Dict, Iterable, List, Optional
+
+# A shard groups the CVs of one tenant, job or upload collection: the folder of
+# UPLOAD_FOLDER they are uploaded to. CVs at the top of UPLOAD_FOLDER form the
+# default shard. The source of a CV in a shard folder is "<shard>/<file name>",
+# so the shard of any source, even a deleted one, is known without a lookup.
+DEFAULT_SHARD = "default"
+# Every shard, in a list of shards to search: only when asked for explicitly
+ALL_SHARDS = "*"
+SHARD_NAME = re.compile(r"[A-Za-z0-9][A-Za-z0-9_.-]{0,63}")
+
+
+def is_shard_name(name: Optional[str]) -> bool:
+    return bool(name) and SHARD_NAME.fullmatch(name) is not None
+
+
+def shard_of(source: str) -> str:
+    """Shard of a corpus source: its folder, or the default shard."""
+    folder, separator, _ = source.rpartition("/")
+    return folder if separator else DEFAULT_SHARD
+
+
+def record_shard(record: dict) -> str:
+    """Shard key recorded with a corpus record at ingest; derived from the source for older records."""
+    return record.get("shard") or shard_of(record["source"])
+
+
+def shard_source(shard: Optional[str], name: str) -> str:
+    """Source of the file `name` uploaded to `shard`."""
+    return name if shard in (None, DEFAULT_SHARD) else f"{shard}/{name}"
+
+
+def parse_shards(value: Optional[str]) -> Optional[List[str]]:
+    """Shards listed in a query parameter ("acme,globex"); None when absent."""
+    if value is None:
+        return None
+    return list(dict.fromkeys(name.strip() for name in value.split(",") if name.strip()))
+
+
+def shard_scope(names: Optional[List[str]], allow_all: bool = False) -> List[str]:
+    """Shards a request searches: those it names, or the default shard when it names none.
+
+    Raises ValueError for an invalid name, and for every shard ("*") unless `allow_all`.
+    """
+    if names is None:
+        return [DEFAULT_SHARD]
+    if not names:
+        raise ValueError("No shard given")
+    for name in names:
+        if name == ALL_SHARDS:
+            if not allow_all:
+                raise ValueError("Searching every shard is disabled (INDEX_ALLOW_ALL_SHARDS)")
+        elif not is_shard_name(name):
+            raise ValueError(f"Invalid shard name: {name!r}")
+    return [ALL_SHARDS] if ALL_SHARDS in names else list(dict.fromkeys(names))
+
+
+def group_by_shard(sources: Iterable[str]) -> Dict[str, List[str]]:
+    """{shard: [sources]} in first-seen order."""
+    groups: Dict[str, List[str]] = {}
+    for source in sources:
+        groups.setdefault(shard_of(source), []).append(source)
+    return groups
@@ -0,0 +1,144 @@
+"""Recall / latency / memory benchmark of the FAISS index types.
+
+Compares flat, IVF-Flat, IVF-PQ and HNSW at several nprobe / efSearch
+settings against exact flat search, on synthetic clustered vectors or on
+the vectors of a saved knowledge index.
+
+Run from backend_chatbot/:
+
+    python -m benchmarks.ann_benchmark --n 100000
+    python -m benchmarks.ann_benchmark --index-dir index_store --json ann.json
+"""
+import argparse
+import json
+import time
+from dataclasses import replace
+from pathlib import Path
+from typing import List, Tuple
+
+import faiss
+import numpy as np
+
+from app.services import index_store
+from app.services.ann_index import AnnConfig, build_index, index_memory_bytes, set_search_params
+
+
+def synthetic_vectors(n: int, dim: int, clusters: int, seed: int) -> np.ndarray:
+    """Normalized vectors around random centers, roughly like chunk embeddings."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, n)] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def saved_index_vectors(index_dir: Path) -> np.ndarray:
+    version_dir = index_store.current_version_dir(index_dir)
+    if version_dir is None:
+        raise SystemExit(f"No saved index in {index_dir}")
+    index = index_store.read_faiss_index(version_dir / "index.faiss", mmap=False)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def split_queries(vectors: np.ndarray, n_queries: int, seed: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Queries are perturbed copies of randomly picked vectors."""
+    rng = np.random.default_rng(seed)
+    picked = rng.choice(len(vectors), size=min(n_queries, len(vectors)), replace=False)
+    queries = vectors[picked] + 0.05 * rng.standard_normal((len(picked), vectors.shape[1])).astype(np.float32)
+    faiss.normalize_L2(queries)
+    return vectors, queries
+
+
+def configurations(base: AnnConfig, nprobes: List[int], ef_searches: List[int]) -> List[AnnConfig]:
+    configs = [replace(base, index_type="flat")]
+    for index_type in ("ivf_flat", "ivf_pq"):
+        configs += [replace(base, index_type=index_type, nprobe=nprobe) for nprobe in nprobes]
+    configs += [replace(base, index_type="hnsw", ef_search=ef) for ef in ef_searches]
+    return configs
+
+
+def run(vectors: np.ndarray, queries: np.ndarray, configs: List[AnnConfig], k: int) -> List[dict]:
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(queries, k)
+    labels = np.arange(len(vectors), dtype=np.int64)
+
+    results = []
+    built = {}
+    for config in configs:
+        # Indexes differing only in nprobe / efSearch are built once
+        key = (config.index_type, config.nlist, config.pq_m, config.pq_nbits, config.hnsw_m, config.ef_construction)
+        if key not in built:
+            started = time.perf_counter()
+            index = build_index(config, vectors)
+            if config.index_type == "flat":
+                index.add(vectors)
+            else:
+                index.add_with_ids(vectors, labels)
+            built[key] = (index, time.perf_counter() - started, index_memory_bytes(index))
+        index, build_seconds, memory = built[key]
+        set_search_params(index, config)
+
+        latencies = []
+        found = np.empty((len(queries), k), dtype=np.int64)
+        for i, query in enumerate(queries):
+            started = time.perf_counter()
+            _, found[i:i + 1] = index.search(query[None, :], k)
+            latencies.append(time.perf_counter() - started)
+        recall = np.mean([len(set(found[i]) & set(truth[i])) / k for i in range(len(queries))])
+        results.append({
+            "index": config.describe(),
+            "index_type": config.index_type,
+            "build_seconds": round(build_seconds, 3),
+            "memory_mb": round(memory / 2 ** 20, 2),
+            f"recall@{k}": round(float(recall), 4),
+            "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 3),
+            "p99_ms": round(float(np.percentile(latencies, 99)) * 1000, 3),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index-dir", type=Path, help="benchmark the vectors of a saved knowledge index")
+    parser.add_argument("--n", type=int, default=50000, help="number of synthetic vectors")
+    parser.add_argument("--dim", type=int, default=384, help="dimension of synthetic vectors (gte-small: 384)")
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 64, 256])
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--pq-m", type=int, default=48)
+    parser.add_argument("--hnsw-m", type=int, default=32)
+    parser.add_argument("--threads", type=int, default=1, help="FAISS OpenMP threads for search")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", type=Path, help="also write the results to this file")
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(args.threads)
+    if args.index_dir:
+        vectors = saved_index_vectors(args.index_dir)
+    else:
+        vectors = synthetic_vectors(args.n, args.dim, args.clusters, args.seed)
+    vectors, queries = split_queries(vectors, args.queries, args.seed + 1)
+    base = AnnConfig(nlist=args.nlist, pq_m=args.pq_m, hnsw_m=args.hnsw_m)
+    print(f"{len(vectors)} vectors of dim {vectors.shape[1]}, {len(queries)} queries, k={args.k}")
+
+    results = run(vectors, queries, configurations(base, args.nprobe, args.ef_search), args.k)
+    columns = list(results[0])
+    columns.remove("index_type")
+    widths = [max(len(c), *(len(str(r[c])) for r in results)) for c in columns]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    for r in results:
+        print("  ".join(str(r[c]).ljust(w) for c, w in zip(columns, widths)))
+    if args.json:
+        args.json.write_text(json.dumps({"vectors": len(vectors), "dim": int(vectors.shape[1]),
+                                         "queries": len(queries), "k": args.k, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""Throughput of the MongoDB chat log (app/services/chat_log.py).
+
+Concurrent chat sessions log one record per turn, shaped like the ones
+chat.py writes (question, answer, 20 retrieved chunks, stage timings).
+Reports, per scenario:
+
+    awaited        every turn awaits its own insert, as an inline write would
+    write_behind   ChatLog.log() per turn, drained with insert_many by
+                   --writers tasks in batches of --batch-sizes
+
+    hot_path       time a session spends logging one turn (µs)
+    turns_per_s    turns logged and written, end to end
+    dropped        turns dropped because the buffer was full
+
+Without --mongo-url the in-memory stand-in is used, with --insert-latency-ms
+as the round trip of one insert; with it, a real mongod (the collection is
+dropped before each scenario).
+
+Run from backend_chatbot/:
+
+    python -m benchmarks.chat_log_benchmark --turns 20000 --sessions 32
+    python -m benchmarks.chat_log_benchmark --mongo-url mongodb://localhost:27017 --pool-size 10
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import platform
+import random
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List
+
+import numpy as np
+
+from app.core.config import settings
+from app.database.memory import MemoryCollection
+from app.services.chat_log import ChatLog
+from benchmarks.pipeline_benchmark import git_revision, questions
+
+
+def make_records(count: int, seed: int) -> List[dict]:
+    rng = random.Random(seed)
+    texts = questions(min(count, 1000), seed)
+    records = []
+    for i in range(count):
+        chunks = [
+            {"id": hashlib.sha1(f"{i}-{j}".encode()).hexdigest(), "source": f"cv_{rng.randrange(1000)}.pdf",
+             "score": round(rng.random(), 6)}
+            for j in range(20)
+        ]
+        records.append({
+            "session": f"s{i % 64}", "request_id": i, "protocol": "stream", "question": texts[i % len(texts)],
+            "created_at": datetime.now(timezone.utc), "index_version": 1, "route": "llm",
+            "stages": {stage: round(rng.random() / 10, 6) for stage in ("embed_query", "search", "build_prompt", "llm")},
+            "chunks": chunks, "sources": sorted({chunk["source"] for chunk in chunks})[:8],
+            "answer": " ".join(rng.choice(("Candidate", "has", "Python", "experience", "years", "with")) for _ in range(120)),
+            "outcome": "answered",
+        })
+    return records
+
+
+def hot_path_summary(seconds: List[float]) -> dict:
+    us = np.array(seconds) * 1e6
+    return {
+        "mean_us": round(float(us.mean()), 2),
+        "p50_us": round(float(np.percentile(us, 50)), 2),
+        "p99_us": round(float(np.percentile(us, 99)), 2),
+        "max_us": round(float(us.max()), 2),
+    }
+
+
+async def run_sessions(records: List[dict], sessions: int, log_turn) -> List[float]:
+    """`sessions` concurrent producers, each logging its share of the turns one after the other."""
+    timings: List[float] = []
+
+    async def session(items: List[dict]):
+        for record in items:
+            started = time.perf_counter()
+            await log_turn(record)
+            timings.append(time.perf_counter() - started)
+            # The rest of the turn (retrieval, LLM, sending) happens between two logs
+            await asyncio.sleep(0)
+
+    await asyncio.gather(*(session(records[i::sessions]) for i in range(sessions)))
+    return timings
+
+
+async def bench_awaited(collection, records: List[dict], sessions: int) -> dict:
+    async def log_turn(record):
+        await collection.insert_many([record])
+
+    started = time.perf_counter()
+    timings = await run_sessions(records, sessions, log_turn)
+    seconds = time.perf_counter() - started
+    return {"turns_per_s": round(len(records) / seconds, 1), "hot_path": hot_path_summary(timings)}
+
+
+async def bench_write_behind(collection, records: List[dict], sessions: int, batch_size: int, writers: int,
+                             flush_interval: float, max_buffer: int) -> dict:
+    chat_log = ChatLog(batch_size=batch_size, flush_interval=flush_interval, max_buffer=max_buffer, writers=writers)
+    chat_log.start(collection)
+
+    async def log_turn(record):
+        chat_log.log(record)
+
+    started = time.perf_counter()
+    timings = await run_sessions(records, sessions, log_turn)
+    logged = time.perf_counter() - started
+    await chat_log.close(timeout=600)
+    seconds = time.perf_counter() - started
+    stats = chat_log.stats()
+    return {
+        "turns_per_s": round(stats["written"] / seconds, 1),
+        "logging_seconds": round(logged, 3),
+        "drain_seconds": round(seconds - logged, 3),
+        "hot_path": hot_path_summary(timings),
+        "written": stats["written"],
+        "dropped": stats["dropped"],
+        "batches": stats["batches"],
+    }
+
+
+async def run(args) -> dict:
+    if args.mongo_url:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(args.mongo_url, maxPoolSize=args.pool_size)
+        database = client[args.database]
+    else:
+        client = None
+
+    async def fresh_collection():
+        if client is None:
+            return MemoryCollection("chat_logs", latency=args.insert_latency_ms / 1000)
+        await database.drop_collection("chat_logs_benchmark")
+        return database["chat_logs_benchmark"]
+
+    results = {}
+    # Motor adds _id to the records it writes: every scenario gets its own copies
+    records = make_records(args.turns, args.seed)
+    if not args.skip_awaited:
+        results["awaited"] = await bench_awaited(await fresh_collection(), [dict(r) for r in records], args.sessions)
+        print("awaited", json.dumps(results["awaited"]))
+    for batch_size in args.batch_sizes:
+        name = f"write_behind_batch{batch_size}_writers{args.writers}"
+        results[name] = await bench_write_behind(
+            await fresh_collection(), [dict(r) for r in records], args.sessions, batch_size, args.writers,
+            args.flush_interval, args.max_buffer,
+        )
+        print(name, json.dumps(results[name]))
+    if client is not None:
+        await database.drop_collection("chat_logs_benchmark")
+        client.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=20000)
+    parser.add_argument("--sessions", type=int, default=32, help="concurrent chat sessions")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 50, settings.CHAT_LOG_BATCH_SIZE])
+    parser.add_argument("--writers", type=int, default=settings.CHAT_LOG_WRITERS)
+    parser.add_argument("--flush-interval", type=float, default=settings.CHAT_LOG_FLUSH_INTERVAL)
+    parser.add_argument("--max-buffer", type=int, default=settings.CHAT_LOG_MAX_BUFFER)
+    parser.add_argument("--skip-awaited", action="store_true", help="only the write-behind scenarios")
+    parser.add_argument("--mongo-url", help="a real mongod; default: the in-memory stand-in")
+    parser.add_argument("--database", default="chat_log_benchmark")
+    parser.add_argument("--pool-size", type=int, default=settings.MONGO_MAX_POOL_SIZE)
+    parser.add_argument("--insert-latency-ms", type=float, default=2.0,
+                        help="round trip of one insert in the stand-in")
+    parser.add_argument("--json", type=Path, default=Path("chat_log_benchmark.json"))
+    args = parser.parse_args()
+
+    report = {
+        "meta": {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": {k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()},
+        },
+        "scenarios": asyncio.run(run(args)),
+    }
+    args.json.write_text(json.dumps(report, indent=2))
+    print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
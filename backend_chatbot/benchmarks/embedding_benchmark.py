@@ -0,0 +1,178 @@
+"""Throughput and accuracy of the embedding backends (EMBEDDING_BACKEND).
+
+Embeds the chunks of a synthetic CV corpus and a set of questions with
+every backend and reports:
+
+    documents   chunk embedding throughput (embed_documents)
+    queries     questions/s and latency with N concurrent chat sessions, each
+                question embedded alone on the retrieval threads (QUERY_BATCH_MAX=1)
+                and through the QueryBatcher
+    drift       cosine between the vectors of each backend and of the reference
+                (the first of --backends), and overlap of the top-k chunks per question
+
+The ONNX models are exported on first use into --onnx-dir (needs torch once).
+
+Run from backend_chatbot/:
+
+    python -m benchmarks.embedding_benchmark --cvs 200 --sessions 32 --json embedding_benchmark.json
+    python -m benchmarks.embedding_benchmark --backends onnx onnx_int8 --threads 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.embeddings import EMBEDDING_BACKENDS, QueryBatcher, create_embeddings
+from app.services.knowledge_index import record_to_document, split_documents
+from benchmarks.pipeline_benchmark import git_revision, latency_summary, questions, rss_mb
+from benchmarks.synthetic_cvs import cv_text, make_cv
+
+
+def corpus_chunks(cvs: int, seed: int, chunk_size: int, model_name: str) -> List[str]:
+    rng = random.Random(seed)
+    records = [{"source": f"cv_{i}.pdf", "text": cv_text(make_cv(rng, i))} for i in range(cvs)]
+    return [chunk.page_content for chunk in split_documents(chunk_size, [record_to_document(r) for r in records], model_name)]
+
+
+async def run_sessions(embed, session_questions: List[List[str]]) -> Dict[str, object]:
+    """Concurrent sessions, each sending its questions one after the other, like chat.py."""
+    latencies: List[float] = []
+
+    async def session(items: List[str]):
+        for question in items:
+            started = time.perf_counter()
+            await embed(question)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(session(items) for items in session_questions))
+    seconds = time.perf_counter() - started
+    return {"questions_per_s": round(len(latencies) / seconds, 1), "latency": latency_summary(latencies)}
+
+
+def bench_queries(model, query_texts: List[str], sessions: int, max_batch: int, max_wait: float,
+                  retrieval_workers: int) -> dict:
+    per_session = [query_texts[i::sessions] for i in range(sessions)]
+
+    # As before: every question alone on one of the retrieval threads
+    executor = ThreadPoolExecutor(max_workers=retrieval_workers)
+
+    async def alone(question):
+        return await asyncio.get_running_loop().run_in_executor(executor, model.embed_query, question)
+
+    batcher = QueryBatcher(model, max_batch=max_batch, max_wait=max_wait)
+
+    async def batched(question):
+        return await asyncio.wrap_future(batcher.submit(question))
+
+    try:
+        result = {
+            "sessions": sessions,
+            "alone": asyncio.run(run_sessions(alone, per_session)),
+            "batched": asyncio.run(run_sessions(batched, per_session)),
+        }
+    finally:
+        batcher.close()
+        executor.shutdown()
+    result["batched"]["mean_batch_size"] = round(batcher.queries / batcher.batches, 2) if batcher.batches else None
+    result["speedup"] = round(result["batched"]["questions_per_s"] / result["alone"]["questions_per_s"], 2)
+    return result
+
+
+def drift(vectors: np.ndarray, reference: np.ndarray) -> dict:
+    # Both sides are L2-normalized
+    cosine = (vectors * reference).sum(axis=1)
+    return {
+        "mean_cosine": round(float(cosine.mean()), 6),
+        "min_cosine": round(float(cosine.min()), 6),
+        "p1_cosine": round(float(np.percentile(cosine, 1)), 6),
+    }
+
+
+def topk_overlap(queries: np.ndarray, docs: np.ndarray, ref_queries: np.ndarray, ref_docs: np.ndarray,
+                 k: int) -> float:
+    top = np.argsort(-(queries @ docs.T), axis=1)[:, :k]
+    ref_top = np.argsort(-(ref_queries @ ref_docs.T), axis=1)[:, :k]
+    return round(float(np.mean([len(set(a) & set(b)) / k for a, b in zip(top, ref_top)])), 4)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", choices=EMBEDDING_BACKENDS, default=list(EMBEDDING_BACKENDS),
+                        help="the first one is the reference for drift")
+    parser.add_argument("--model", default=settings.EMBEDDING_MODEL)
+    parser.add_argument("--onnx-dir", type=Path, default=Path(settings.EMBEDDING_ONNX_DIR))
+    parser.add_argument("--threads", type=int, default=settings.EMBEDDING_THREADS, help="onnxruntime threads")
+    parser.add_argument("--cvs", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--chunk-size", type=int, default=settings.CHUNK_SIZE)
+    parser.add_argument("--questions", type=int, default=400)
+    parser.add_argument("--sessions", type=int, default=32, help="concurrent chat sessions")
+    parser.add_argument("--max-batch", type=int, default=settings.QUERY_BATCH_MAX)
+    parser.add_argument("--max-wait-ms", type=float, default=settings.QUERY_BATCH_WAIT_MS)
+    parser.add_argument("--retrieval-workers", type=int, default=settings.RETRIEVAL_WORKERS)
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--json", type=Path, default=Path("embedding_benchmark.json"))
+    args = parser.parse_args()
+
+    chunks = corpus_chunks(args.cvs, args.seed, args.chunk_size, args.model)
+    query_texts = questions(args.questions, args.seed)
+    print(f"{len(chunks)} chunks of {args.cvs} CVs, {len(query_texts)} questions")
+    report = {
+        "meta": {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": {k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()},
+        },
+        "chunks": len(chunks),
+        "backends": {},
+    }
+
+    reference = None
+    for backend in args.backends:
+        rss_before = rss_mb()
+        started = time.perf_counter()
+        model = create_embeddings(backend, args.model, args.onnx_dir, threads=args.threads)
+        model.embed_documents(["warm up"])
+        result = {"load_seconds": round(time.perf_counter() - started, 2)}
+
+        started = time.perf_counter()
+        doc_vectors = np.array(model.embed_documents(chunks), dtype=np.float32)
+        seconds = time.perf_counter() - started
+        result["documents"] = {"chunks": len(chunks), "seconds": round(seconds, 3),
+                               "chunks_per_s": round(len(chunks) / seconds, 1)}
+        query_vectors = np.array(model.embed_documents(query_texts), dtype=np.float32)
+        result["rss_delta_mb"] = round(rss_mb() - rss_before, 1)
+
+        result["queries"] = bench_queries(model, query_texts, args.sessions, args.max_batch,
+                                          args.max_wait_ms / 1000, args.retrieval_workers)
+        if reference is None:
+            reference = (backend, doc_vectors, query_vectors)
+        else:
+            result["drift"] = {
+                "reference": reference[0],
+                "documents": drift(doc_vectors, reference[1]),
+                "queries": drift(query_vectors, reference[2]),
+                f"top{args.k}_overlap": topk_overlap(query_vectors, doc_vectors, reference[2], reference[1], args.k),
+            }
+        report["backends"][backend] = result
+        print(backend, json.dumps(result))
+
+    args.json.write_text(json.dumps(report, indent=2))
+    print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
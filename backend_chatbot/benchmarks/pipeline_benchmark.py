@@ -0,0 +1,542 @@
+"""Offline performance benchmark of CV ingestion, indexing and chat answers.
+
+Generates a synthetic CV corpus (benchmarks/synthetic_cvs.py) and measures:
+
+    extraction  PDF / DOCX text extraction throughput in time- and memory-limited
+                extraction processes, PDFs also with pdfminer alone
+    chunking    token-based splitting throughput: batched, per-piece tokenizer calls, process pool
+    embedding   chunk embedding throughput
+    index       index build time and memory, published size, search latency, queries/s
+                one by one (chat) and batched (/api/search/batch); with --near-duplicates,
+                also the size and build time near-duplicate detection saved
+    e2e         WebSocket answer latency p50/p99 under N concurrent clients, against
+                a uvicorn server whose Groq API is a local stub (benchmarks/stub_llm.py)
+
+Nothing leaves the machine. The embedding model has to be in the Hugging
+Face cache; --fake-embeddings replaces it in every stage but e2e. MongoDB
+is only connected lazily, so no database is needed either.
+
+Run from backend_chatbot/:
+
+    python -m benchmarks.pipeline_benchmark --cvs 500 --clients 16 --json bench.json
+    python -m benchmarks.pipeline_benchmark --stages e2e --llm-latency 0.8 --server-workers 4
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+import psutil
+import websockets
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain.storage import InMemoryByteStore
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from prometheus_client.parser import text_string_to_metric_families
+
+from app.core.config import settings
+from app.services.ann_index import INDEX_TYPES, AnnConfig, index_memory_bytes
+from app.services.batch_search import search_sources
+from app.services.index_store import INDEX_FILES, current_version_dir
+from app.services.extraction import run_limited
+from app.services.ingestion import _ingest_file
+from app.services.chunking import get_text_splitter, get_tokenizer, split_batches
+from app.services.knowledge_index import KnowledgeIndex, record_to_document, split_documents
+from benchmarks.stub_llm import StubLLMConfig, StubLLMServer
+from benchmarks.synthetic_cvs import FORMATS, SKILLS, TITLES, generate_corpus
+
+STAGES = ("extraction", "chunking", "embedding", "index", "e2e")
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def latency_summary(seconds: List[float]) -> dict:
+    if not seconds:
+        return {"count": 0}
+    ms = np.array(seconds) * 1000
+    return {
+        "count": len(ms),
+        "mean_ms": round(float(ms.mean()), 2),
+        "p50_ms": round(float(np.percentile(ms, 50)), 2),
+        "p90_ms": round(float(np.percentile(ms, 90)), 2),
+        "p99_ms": round(float(np.percentile(ms, 99)), 2),
+        "max_ms": round(float(ms.max()), 2),
+    }
+
+
+def rss_mb() -> float:
+    return psutil.Process().memory_info().rss / 2 ** 20
+
+
+def read_csv_records(csv_files: List[Path]) -> List[dict]:
+    records = []
+    for path in csv_files:
+        with open(path, newline="", encoding="utf-8") as f:
+            records += [{"source": row["source"], "text": row["Resume"]} for row in csv.DictReader(f)]
+    return records
+
+
+def questions(count: int, seed: int) -> List[str]:
+    rng = random.Random(seed)
+    return [
+        f"Which {rng.choice(TITLES).lower()} candidates know {rng.choice(SKILLS)} and {rng.choice(SKILLS)}?"
+        for _ in range(count)
+    ]
+
+
+def bench_extraction(files: Dict[str, List[Path]], workers: int) -> dict:
+    """Files per second through `_ingest_file` in limited child processes, as the ingestion queue runs it.
+
+    PDFs are also extracted with pdfminer alone, the extractor used before
+    the pdfium tier, for comparison.
+    """
+    results = {"workers": workers}
+    limits = {"timeout": settings.EXTRACT_TIMEOUT, "memory_mb": settings.EXTRACT_MAX_MEMORY_MB}
+
+    def extract(path: str):
+        return run_limited(
+            _ingest_file, (path, settings.EXTRACT_PAGE_WORKERS, settings.EXTRACT_PARALLEL_PAGES), **limits
+        )
+
+    for fmt in ("pdf", "docx"):
+        paths = [str(p) for p in files.get(fmt, [])]
+        if not paths:
+            continue
+        with ThreadPoolExecutor(workers) as pool:
+            # Start the fork server, which imports the extractors, before timing
+            list(pool.map(extract, paths[:workers]))
+            started = time.perf_counter()
+            outputs = list(pool.map(extract, paths))
+        seconds = time.perf_counter() - started
+        size_mb = sum(os.path.getsize(p) for p in paths) / 2 ** 20
+        results[fmt] = {
+            "files": len(paths),
+            "mb": round(size_mb, 2),
+            "seconds": round(seconds, 3),
+            "files_per_s": round(len(paths) / seconds, 1),
+            "mb_per_s": round(size_mb / seconds, 2),
+            "chars": sum(len(text) for text, _, _ in outputs),
+            "tiers": dict(Counter(method for _, _, method in outputs)),
+            "per_file": latency_summary([extract_seconds for _, extract_seconds, _ in outputs]),
+        }
+        if fmt == "pdf":
+            from pdfminer.high_level import extract_text
+
+            per_file = []
+            for path in paths:
+                started = time.perf_counter()
+                extract_text(path)
+                per_file.append(time.perf_counter() - started)
+            results[fmt]["pdfminer_per_file"] = latency_summary(per_file)
+            results[fmt]["speedup_vs_pdfminer"] = round(sum(per_file) / sum(s for _, s, _ in outputs), 2)
+    return results
+
+
+def bench_chunking(documents, chunk_size: int, model_name: str, workers: int,
+                   batch_size: int = 64) -> Tuple[dict, list]:
+    started = time.perf_counter()
+    text_splitter = get_text_splitter(chunk_size, model_name)
+    tokenizer_seconds = time.perf_counter() - started
+
+    # The splitter as it was: one tokenizer call per piece, one document at a time
+    per_piece = RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
+        get_tokenizer(model_name), chunk_size=chunk_size, chunk_overlap=text_splitter._chunk_overlap,
+        strip_whitespace=True, separators=text_splitter._separators,
+    )
+    started = time.perf_counter()
+    per_piece_chunks = [c for doc in documents for c in per_piece.split_documents([doc])]
+    per_piece_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    chunks = split_documents(chunk_size, documents, model_name)
+    seconds = time.perf_counter() - started
+
+    texts = [doc.page_content for doc in documents]
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    pool_seconds = None
+    if workers > 1 and len(batches) > 1:
+        # pool_min=0: everything after the first batch goes to the pool, including its start-up
+        started = time.perf_counter()
+        for _ in split_batches(chunk_size, model_name, batches, workers=workers, pool_min=0):
+            pass
+        pool_seconds = time.perf_counter() - started
+    return {
+        "documents": len(documents),
+        "chunks": len(chunks),
+        "chunk_size": chunk_size,
+        "tokenizer_load_seconds": round(tokenizer_seconds, 3),
+        "seconds": round(seconds, 3),
+        "documents_per_s": round(len(documents) / seconds, 1),
+        "chunks_per_s": round(len(chunks) / seconds, 1),
+        "per_piece_seconds": round(per_piece_seconds, 3),
+        "speedup": round(per_piece_seconds / seconds, 2),
+        # split_documents also drops duplicate chunks
+        "same_chunks": list(dict.fromkeys(c.page_content for c in per_piece_chunks)) == [c.page_content for c in chunks],
+        "pool_workers": workers,
+        "pool_seconds": None if pool_seconds is None else round(pool_seconds, 3),
+    }, chunks
+
+
+def bench_embedding(embedding_model, texts: List[str]) -> dict:
+    embedding_model.embed_query("warm up")
+    started = time.perf_counter()
+    vectors = embedding_model.embed_documents(texts)
+    seconds = time.perf_counter() - started
+    return {
+        "chunks": len(texts),
+        "dim": len(vectors[0]) if vectors else None,
+        "seconds": round(seconds, 3),
+        "chunks_per_s": round(len(texts) / seconds, 1),
+    }
+
+
+def bench_index(embedding_model, documents, chunk_size: int, model_name: str, ann: AnnConfig,
+                index_dir: Path, queries: List[str], similarity: Tuple[float, float] = (0.0, 0.0)) -> dict:
+    rss_before = rss_mb()
+    knowledge_index = KnowledgeIndex(embedding_model, chunk_size=chunk_size, model_name=model_name, ann=ann,
+                                     document_similarity=similarity[0], chunk_similarity=similarity[1])
+    started = time.perf_counter()
+    knowledge_index.rebuild(documents)
+    build_seconds = time.perf_counter() - started
+    rss_after = rss_mb()
+
+    started = time.perf_counter()
+    knowledge_index.publish(index_dir)
+    publish_seconds = time.perf_counter() - started
+    version_dir = current_version_dir(index_dir)
+
+    snapshot = knowledge_index.snapshot()
+    started = time.perf_counter()
+    vectors = [knowledge_index.embed_query(q) for q in queries]
+    latencies = []
+    for vector in vectors:
+        search_started = time.perf_counter()
+        snapshot.similarity_search_by_vector(vector, 5)
+        latencies.append(time.perf_counter() - search_started)
+    one_by_one_seconds = time.perf_counter() - started
+
+    # /api/search/batch: one embedding call and one FAISS call for all queries, grouped per CV
+    started = time.perf_counter()
+    search_sources(snapshot, knowledge_index.embed_queries(queries), 5)
+    batch_seconds = time.perf_counter() - started
+    return {
+        "index": ann.describe(),
+        "index_type": knowledge_index.index_type,
+        "chunks": len(snapshot),
+        "build_seconds": round(build_seconds, 3),
+        "rss_delta_mb": round(rss_after - rss_before, 1),
+        "index_memory_mb": round(index_memory_bytes(knowledge_index.vector_store.index) / 2 ** 20, 2),
+        "publish_seconds": round(publish_seconds, 3),
+        "disk_mb": round(sum((version_dir / name).stat().st_size for name in INDEX_FILES) / 2 ** 20, 2),
+        "search_k5": latency_summary(latencies),
+        "queries_per_s": {
+            "one_by_one": round(len(queries) / one_by_one_seconds, 1),
+            "batch": round(len(queries) / batch_seconds, 1),
+        },
+        "near_duplicates": knowledge_index.near_duplicate_stats(),
+    }
+
+
+def bench_near_duplicates(base_model, documents, chunk_size: int, model_name: str, ann: AnnConfig,
+                          work_dir: Path, queries: List[str]) -> dict:
+    """The index built with and without near-duplicate detection, each with a cold embedding cache."""
+    runs = {}
+    for name, similarity in (("off", (0.0, 0.0)), ("on", (settings.NEAR_DUPLICATE_DOCUMENT_SIMILARITY,
+                                                         settings.NEAR_DUPLICATE_CHUNK_SIMILARITY))):
+        embedding_model = CacheBackedEmbeddings.from_bytes_store(base_model, InMemoryByteStore(), namespace=model_name)
+        runs[name] = bench_index(embedding_model, documents, chunk_size, model_name, ann,
+                                 work_dir / f"index_store_dedup_{name}", queries, similarity)
+    off, on = runs["off"], runs["on"]
+    return {
+        "chunks": {"off": off["chunks"], "on": on["chunks"]},
+        "chunks_saved": off["chunks"] - on["chunks"],
+        "disk_mb_saved": round(off["disk_mb"] - on["disk_mb"], 2),
+        "build_seconds": {"off": off["build_seconds"], "on": on["build_seconds"]},
+        "build_seconds_saved": round(off["build_seconds"] - on["build_seconds"], 3),
+        "detected": on["near_duplicates"],
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until_ready(base_url: str, process: subprocess.Popen, timeout: float) -> dict:
+    """Wait until the server answers and serves a fully built index."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with code {process.returncode}")
+        try:
+            if httpx.get(f"{base_url}/api/health/ready", timeout=2).status_code == 200:
+                status = httpx.get(f"{base_url}/api/chat/index", timeout=2).json()
+                if status["chunks"] and not status.get("building") and not status.get("pending_changes"):
+                    return status
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise TimeoutError(f"server not ready after {timeout}s")
+
+
+async def run_client(url: str, client_questions: List[str], stream: bool, totals: List[float],
+                     first_tokens: List[float], errors: Dict[str, int]):
+    async with websockets.connect(url, max_size=None) as ws:
+        for question in client_questions:
+            started = time.perf_counter()
+            await ws.send(question)
+            if stream:
+                first = None
+                while True:
+                    frame = json.loads(await ws.recv())
+                    if frame["type"] == "delta" and first is None:
+                        first = time.perf_counter() - started
+                    if frame["type"] in ("end", "error"):
+                        break
+                if frame["type"] == "error":
+                    errors[frame["code"]] = errors.get(frame["code"], 0) + 1
+                    continue
+                first_tokens.append(first)
+            else:
+                message = await ws.recv()
+                # Plain protocol errors are human-readable strings (see app/routers/chat.py)
+                if message == "No data available" or message.startswith(("Error:", "The chatbot is busy")):
+                    errors[message[:40]] = errors.get(message[:40], 0) + 1
+                    continue
+            totals.append(time.perf_counter() - started)
+
+
+async def run_clients(url: str, clients: int, per_client: int, stream: bool, seed: int) -> dict:
+    # One unmeasured question first, so lazy initialization is not counted
+    await run_client(url, questions(1, seed), stream, [], [], {})
+    totals, first_tokens, errors = [], [], {}
+    pool = questions(clients * per_client, seed + 1)
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        run_client(url, pool[i * per_client:(i + 1) * per_client], stream, totals, first_tokens, errors)
+        for i in range(clients)
+    ))
+    seconds = time.perf_counter() - started
+    return {
+        "clients": clients,
+        "questions": clients * per_client,
+        "stream": stream,
+        "seconds": round(seconds, 3),
+        "answers_per_s": round(len(totals) / seconds, 2),
+        "latency": latency_summary(totals),
+        "first_token": latency_summary(first_tokens) if stream else None,
+        "errors": errors,
+    }
+
+
+def server_stage_means(metrics_text: str) -> dict:
+    """Mean time per chat stage as recorded by the server (see app/core/metrics.py)."""
+    sums, counts = {}, {}
+    for family in text_string_to_metric_families(metrics_text):
+        if family.name != "chat_stage_seconds":
+            continue
+        for sample in family.samples:
+            stage = sample.labels.get("stage")
+            if sample.name.endswith("_sum"):
+                sums[stage] = sample.value
+            elif sample.name.endswith("_count"):
+                counts[stage] = sample.value
+    return {stage: round(sums[stage] / counts[stage] * 1000, 2) for stage in sums if counts.get(stage)}
+
+
+def bench_e2e(args, corpus_dir: Path, work_dir: Path) -> dict:
+    stub = StubLLMServer(StubLLMConfig(args.llm_latency, args.llm_tokens, args.llm_token_interval, args.llm_jitter))
+    stub.start()
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    env = dict(
+        os.environ,
+        GROQ_BASE_URL=stub.base_url,
+        GROQ_API_KEY="stub",
+        # The chat log goes to the in-memory stand-in unless a real MongoDB is given
+        MONGO_URL=os.environ.get("MONGO_URL", "memory://"),
+        MONGO_DB_NAME=os.environ.get("MONGO_DB_NAME", "benchmark"),
+        # The server imports the pre-extracted CSVs into a fresh corpus and builds its own index
+        CSV_FOLDER=str(corpus_dir / "csv_files"),
+        UPLOAD_FOLDER=str(work_dir / "e2e_uploads"),
+        CORPUS_DIR=str(work_dir / "e2e_corpus_store"),
+        INDEX_DIR=str(work_dir / "e2e_index_store"),
+        EMBEDDING_CACHE_DIR=str(work_dir / "e2e_embedding_cache"),
+        INDEX_TYPE=args.index_type,
+        INDEX_DEBOUNCE="0.1",
+        ANSWER_CACHE_SIZE=os.environ.get("ANSWER_CACHE_SIZE", "1024" if args.answer_cache else "0"),
+    )
+    command = [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+               "--workers", str(args.server_workers), "--log-level", "warning"]
+    log_path = work_dir / "e2e_server.log"
+    started = time.perf_counter()
+    with open(log_path, "wb") as log:
+        server = subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+        try:
+            status = wait_until_ready(base_url, server, args.ready_timeout)
+            ready_seconds = time.perf_counter() - started
+            ws_url = f"ws://127.0.0.1:{port}/api/chat/ws" + ("?stream=true" if not args.no_stream else "")
+            result = asyncio.run(run_clients(ws_url, args.clients, args.questions, not args.no_stream, args.seed))
+            result["server_stage_mean_ms"] = server_stage_means(httpx.get(f"{base_url}/api/metrics").text)
+        except Exception:
+            print(f"e2e failed, server log: {log_path}", file=sys.stderr)
+            raise
+        finally:
+            server.terminate()
+            try:
+                server.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+            stub.stop()
+    result.update({
+        "server_workers": args.server_workers,
+        "ready_seconds": round(ready_seconds, 2),
+        "index_chunks": status["chunks"],
+        "llm_stub": {"latency": args.llm_latency, "tokens": args.llm_tokens,
+                     "token_interval": args.llm_token_interval, "jitter": args.llm_jitter,
+                     "requests": stub.requests},
+    })
+    return result
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--cvs", type=int, default=200, help="number of synthetic CVs (each in every format)")
+    parser.add_argument("--formats", nargs="+", choices=FORMATS, default=list(FORMATS))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--near-duplicates", type=float, default=0.0,
+                        help="fraction of CVs also uploaded with small edits; the index stage then reports what "
+                             "near-duplicate detection saved")
+    parser.add_argument("--workdir", type=Path, help="where the corpus and indexes go (default: a temp dir)")
+    parser.add_argument("--keep", action="store_true", help="keep the temp workdir")
+    parser.add_argument("--extract-workers", type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument("--chunk-size", type=int, default=settings.CHUNK_SIZE)
+    parser.add_argument("--chunk-workers", type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument("--embedding-model", default=settings.EMBEDDING_MODEL)
+    parser.add_argument("--fake-embeddings", action="store_true",
+                        help="deterministic hash embeddings instead of the model (not used by e2e)")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default=settings.INDEX_TYPE)
+    parser.add_argument("--clients", type=int, default=8, help="concurrent WebSocket clients")
+    parser.add_argument("--questions", type=int, default=20, help="questions per client")
+    parser.add_argument("--no-stream", action="store_true", help="use the plain protocol instead of ?stream=true")
+    parser.add_argument("--answer-cache", action="store_true", help="leave the server's answer cache on")
+    parser.add_argument("--server-workers", type=int, default=1)
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="stub LLM seconds before the first token")
+    parser.add_argument("--llm-tokens", type=int, default=80)
+    parser.add_argument("--llm-token-interval", type=float, default=0.005)
+    parser.add_argument("--llm-jitter", type=float, default=0.0)
+    parser.add_argument("--ready-timeout", type=float, default=600)
+    parser.add_argument("--json", type=Path, default=Path("pipeline_benchmark.json"))
+    args = parser.parse_args()
+
+    work_dir = args.workdir or Path(tempfile.mkdtemp(prefix="cv-bench-"))
+    corpus_dir = work_dir / "corpus"
+    if corpus_dir.exists():
+        shutil.rmtree(corpus_dir)
+    started = time.perf_counter()
+    files = generate_corpus(corpus_dir, args.cvs, args.seed, args.formats, args.near_duplicates)
+    report = {
+        "meta": {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": {k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()},
+        },
+        "corpus": {"cvs": args.cvs, "generate_seconds": round(time.perf_counter() - started, 2),
+                   **{fmt: len(paths) for fmt, paths in files.items()}},
+    }
+    print(f"Corpus of {args.cvs} CVs in {corpus_dir}")
+
+    try:
+        if "extraction" in args.stages:
+            report["extraction"] = bench_extraction(files, args.extract_workers)
+            print("extraction", json.dumps(report["extraction"]))
+
+        needs_text = {"chunking", "embedding", "index"} & set(args.stages)
+        if needs_text:
+            if not files.get("csv"):
+                raise SystemExit("chunking, embedding and index need --formats csv")
+            documents = [record_to_document(r) for r in read_csv_records(files["csv"])]
+            if args.fake_embeddings:
+                from langchain_community.embeddings import DeterministicFakeEmbedding
+                base_model = DeterministicFakeEmbedding(size=384)
+                model_seconds = 0.0
+            else:
+                from langchain_huggingface import HuggingFaceEmbeddings
+                started = time.perf_counter()
+                base_model = HuggingFaceEmbeddings(
+                    model_name=args.embedding_model,
+                    model_kwargs={"device": "cpu"},
+                    encode_kwargs={"normalize_embeddings": True},
+                )
+                model_seconds = time.perf_counter() - started
+            # The index stage then reuses the vectors, like a restart with a warm embedding cache
+            embedding_model = CacheBackedEmbeddings.from_bytes_store(
+                base_model, InMemoryByteStore(), namespace=args.embedding_model
+            )
+
+            chunking, chunks = bench_chunking(documents, args.chunk_size, args.embedding_model, args.chunk_workers)
+            if "chunking" in args.stages:
+                report["chunking"] = chunking
+                print("chunking", json.dumps(chunking))
+            if "embedding" in args.stages:
+                report["embedding"] = dict(bench_embedding(embedding_model, [c.page_content for c in chunks]),
+                                           model=args.embedding_model if not args.fake_embeddings else "fake",
+                                           model_load_seconds=round(model_seconds, 3))
+                print("embedding", json.dumps(report["embedding"]))
+            if "index" in args.stages:
+                ann = AnnConfig.from_settings(settings)
+                ann.index_type = args.index_type
+                report["index"] = dict(
+                    bench_index(embedding_model, documents, args.chunk_size, args.embedding_model, ann,
+                                work_dir / "index_store", questions(200, args.seed),
+                                (settings.NEAR_DUPLICATE_DOCUMENT_SIMILARITY, settings.NEAR_DUPLICATE_CHUNK_SIMILARITY)),
+                    embeddings_cached="embedding" in args.stages,
+                )
+                print("index", json.dumps(report["index"]))
+                if args.near_duplicates:
+                    report["near_duplicates"] = bench_near_duplicates(
+                        base_model, documents, args.chunk_size, args.embedding_model, ann, work_dir,
+                        questions(200, args.seed),
+                    )
+                    print("near_duplicates", json.dumps(report["near_duplicates"]))
+
+        if "e2e" in args.stages:
+            if not files.get("csv"):
+                raise SystemExit("e2e needs --formats csv")
+            report["e2e"] = bench_e2e(args, corpus_dir, work_dir)
+            print("e2e", json.dumps(report["e2e"]))
+    finally:
+        args.json.write_text(json.dumps(report, indent=2))
+        print(f"Results written to {args.json}")
+        if args.workdir is None and not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""One global knowledge index vs one index per shard (app/services/sharded_index.py).
+
+Generates a synthetic corpus spread over --tenants shards (benchmarks/
+synthetic_cvs.py) and indexes it both ways. Reports:
+
+    build       time to index the whole corpus, once in one index and shard by shard
+    upload      one tenant uploads one CV: build and publish time, incrementally
+                (INDEX_MODE=incremental) and from scratch (INDEX_MODE=full)
+    query       hybrid retrieval latency (as the chat does it) on the global
+                index, on one shard (?shards=<tenant>) and fanned out to every shard
+    residency   a reader with room for --budget-shards shards answers questions
+                of tenants drawn from a Zipf distribution: shard hit rate, loads,
+                evictions and the latency of questions that had to load their shard;
+                then questions fanned out to every shard, searched one at a time
+
+The embedding model has to be in the Hugging Face cache (the chunker needs
+its tokenizer either way); --fake-embeddings replaces it for the vectors.
+
+Run from backend_chatbot/:
+
+    python -m benchmarks.shard_benchmark --cvs 2000 --tenants 20 --fake-embeddings
+    python -m benchmarks.shard_benchmark --cvs 5000 --tenants 50 --budget-shards 10 --json shards.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain.storage import InMemoryByteStore
+
+from app.core.config import settings
+from app.services.ann_index import INDEX_TYPES, AnnConfig
+from app.services.hybrid_search import hybrid_chunks
+from app.services.index_store import current_version_dir
+from app.services.knowledge_index import KnowledgeIndex, load_corpus
+from app.services.sharded_index import ShardedIndex, version_bytes
+from app.services.shards import ALL_SHARDS, shard_source
+from benchmarks.pipeline_benchmark import git_revision, latency_summary, questions
+from benchmarks.synthetic_cvs import cv_text, make_cv
+
+
+def make_records(count: int, tenants: int, seed: int) -> Dict[str, List[dict]]:
+    """{tenant: corpus records}, CVs dealt round-robin to the tenants."""
+    rng = random.Random(seed)
+    corpus: Dict[str, List[dict]] = {f"tenant{t:03d}": [] for t in range(tenants)}
+    names = list(corpus)
+    for number in range(count):
+        tenant = names[number % tenants]
+        source = shard_source(tenant, f"cv_{number:05d}.pdf")
+        corpus[tenant].append({"source": source, "shard": tenant, "text": cv_text(make_cv(rng, number))})
+    return corpus
+
+
+def timed(func, *args) -> float:
+    started = time.perf_counter()
+    func(*args)
+    return round(time.perf_counter() - started, 3)
+
+
+def bench_upload(global_index: KnowledgeIndex, global_dir: Path, sharded: ShardedIndex,
+                 corpus: Dict[str, List[dict]], record: dict) -> dict:
+    tenant = record["shard"]
+    everything = [r for records in corpus.values() for r in records]
+    results = {}
+
+    def global_incremental():
+        global_index.apply_records([record])
+        global_index.publish(global_dir)
+
+    def global_full():
+        global_index.rebuild(load_corpus(everything + [record]))
+        global_index.publish(global_dir)
+
+    def shard_incremental():
+        with sharded.building(tenant) as index:
+            index.apply_records([record])
+            sharded.publish(tenant, index)
+
+    def shard_full():
+        with sharded.building(tenant) as index:
+            index.rebuild(load_corpus(corpus[tenant] + [record]))
+            sharded.publish(tenant, index)
+
+    for name, func in (("global_incremental", global_incremental), ("sharded_incremental", shard_incremental),
+                       ("global_full", global_full), ("sharded_full", shard_full)):
+        # Every scenario adds the same CV again: drop it in between so each one really indexes it
+        results[name] = {"seconds": timed(func)}
+        if name.startswith("global"):
+            global_index.apply_records([{"source": record["source"], "deleted": True}])
+            global_index.publish(global_dir)
+            results[name]["published_bytes"] = version_bytes(current_version_dir(global_dir))
+        else:
+            with sharded.building(tenant) as index:
+                index.apply_records([{"source": record["source"], "deleted": True}])
+                sharded.publish(tenant, index)
+            results[name]["published_bytes"] = sharded.stats()[tenant]["bytes"]
+    return results
+
+
+def query_latency(snapshot_of, embedding_model, texts: List[str], k: int, keyword_candidates: int) -> dict:
+    latencies = []
+    vectors = [embedding_model.embed_query(text) for text in texts]
+    for text, vector in zip(texts, vectors):
+        started = time.perf_counter()
+        hybrid_chunks(snapshot_of(), text, vector, k, keyword_candidates)
+        latencies.append(time.perf_counter() - started)
+    return latency_summary(latencies)
+
+
+def bench_residency(index_dir: Path, factory, embedding_model, tenants: List[str], budget_shards: int,
+                    texts: List[str], k: int, keyword_candidates: int, seed: int) -> dict:
+    probe = ShardedIndex(index_dir, factory)
+    probe.discover()
+    sizes = [shard["bytes"] for shard in probe.stats().values() if shard.get("bytes")]
+    budget = int(np.mean(sizes) * budget_shards)
+    reader = ShardedIndex(index_dir, factory, memory_budget=budget, workers=settings.INDEX_SHARD_WORKERS)
+    reader.embedding_model = embedding_model
+    reader.discover()
+
+    rng = np.random.default_rng(seed)
+    # Zipf: a few tenants ask most of the questions
+    weights = 1.0 / np.arange(1, len(tenants) + 1) ** 1.1
+    picks = rng.choice(len(tenants), size=len(texts), p=weights / weights.sum())
+    hot, cold = [], []
+    for text, pick in zip(texts, picks):
+        tenant = tenants[pick]
+        loads = reader.loads
+        vector = embedding_model.embed_query(text)
+        started = time.perf_counter()
+        hybrid_chunks(reader.snapshot([tenant]), text, vector, k, keyword_candidates)
+        (cold if reader.loads > loads else hot).append(time.perf_counter() - started)
+    residency = reader.residency()
+    # Every shard at once, more than the budget holds: searched one shard at a time
+    fan_out_texts = texts[:20]
+    loads = reader.loads
+    fan_out = query_latency(lambda: reader.snapshot([ALL_SHARDS]), embedding_model, fan_out_texts, k, keyword_candidates)
+    return {
+        "memory_budget_bytes": budget,
+        "questions": len(texts),
+        "shard_hit_rate": round(len(hot) / len(texts), 3),
+        "loads": residency["loads"],
+        "evictions": residency["evictions"],
+        "loaded_at_end": residency["loaded"],
+        "hit_latency": latency_summary(hot) if hot else None,
+        "load_latency": latency_summary(cold) if cold else None,
+        "fan_out_latency": fan_out,
+        "fan_out_loads_per_question": round((reader.loads - loads) / len(fan_out_texts), 1),
+        "fan_out_bytes_at_end": reader.residency()["bytes"],
+    }
+
+
+def run(args, work_dir: Path) -> dict:
+    if args.fake_embeddings:
+        from langchain_community.embeddings import DeterministicFakeEmbedding
+        base_model = DeterministicFakeEmbedding(size=384)
+    else:
+        from langchain_huggingface import HuggingFaceEmbeddings
+        base_model = HuggingFaceEmbeddings(
+            model_name=args.embedding_model, model_kwargs={"device": "cpu"}, encode_kwargs={"normalize_embeddings": True}
+        )
+    # Both layouts embed every chunk once; rebuilds then hit the cache, like a server with a warm one
+    embedding_model = CacheBackedEmbeddings.from_bytes_store(base_model, InMemoryByteStore(), namespace="benchmark")
+    ann = AnnConfig.from_settings(settings)
+    ann.index_type = args.index_type
+
+    def factory() -> KnowledgeIndex:
+        return KnowledgeIndex(embedding_model, chunk_size=args.chunk_size, model_name=args.embedding_model, ann=ann,
+                              report_metrics=False)
+
+    corpus = make_records(args.cvs, args.tenants, args.seed)
+    tenants = list(corpus)
+    everything = [record for records in corpus.values() for record in records]
+    report = {}
+
+    global_dir = work_dir / "global"
+    global_index = factory()
+    build_global = timed(global_index.rebuild, load_corpus(everything))
+    global_index.publish(global_dir)
+
+    sharded = ShardedIndex(work_dir / "sharded", factory, workers=args.shard_workers)
+    sharded.embedding_model = embedding_model
+    started = time.perf_counter()
+    for tenant, records in corpus.items():
+        with sharded.building(tenant) as index:
+            index.rebuild(load_corpus(records))
+            sharded.publish(tenant, index)
+    report["build"] = {
+        "chunks": len(global_index.snapshot()),
+        "global_seconds": build_global,
+        "sharded_seconds": round(time.perf_counter() - started, 3),
+        "global_bytes": version_bytes(current_version_dir(global_dir)),
+    }
+    print("build", json.dumps(report["build"]))
+
+    upload = {"source": shard_source(tenants[0], "new_cv.pdf"), "shard": tenants[0],
+              "text": cv_text(make_cv(random.Random(args.seed + 1), args.cvs))}
+    report["upload"] = bench_upload(global_index, global_dir, sharded, corpus, upload)
+    print("upload", json.dumps(report["upload"]))
+
+    texts = questions(args.questions, args.seed)
+    k, candidates = settings.CONTEXT_CANDIDATES, settings.KEYWORD_CANDIDATES
+    report["query"] = {
+        "global": query_latency(global_index.snapshot, embedding_model, texts, k, candidates),
+        "one_shard": query_latency(lambda: sharded.snapshot([tenants[0]]), embedding_model, texts, k, candidates),
+        "fan_out": query_latency(lambda: sharded.snapshot([ALL_SHARDS]), embedding_model, texts, k, candidates),
+    }
+    print("query", json.dumps(report["query"]))
+
+    report["residency"] = bench_residency(
+        work_dir / "sharded", factory, embedding_model, tenants, args.budget_shards, texts, k, candidates, args.seed
+    )
+    print("residency", json.dumps(report["residency"]))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cvs", type=int, default=2000)
+    parser.add_argument("--tenants", type=int, default=20, help="shards the CVs are spread over")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--questions", type=int, default=200)
+    parser.add_argument("--budget-shards", type=int, default=5,
+                        help="memory budget of the residency scenario, in average shard sizes")
+    parser.add_argument("--shard-workers", type=int, default=settings.INDEX_SHARD_WORKERS)
+    parser.add_argument("--chunk-size", type=int, default=settings.CHUNK_SIZE)
+    parser.add_argument("--embedding-model", default=settings.EMBEDDING_MODEL)
+    parser.add_argument("--fake-embeddings", action="store_true", help="deterministic fake vectors instead of the model")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default=settings.INDEX_TYPE)
+    parser.add_argument("--workdir", type=Path, help="where the indexes go (default: a temp dir)")
+    parser.add_argument("--keep", action="store_true", help="keep the temp workdir")
+    parser.add_argument("--json", type=Path, default=Path("shard_benchmark.json"))
+    args = parser.parse_args()
+
+    work_dir = args.workdir or Path(tempfile.mkdtemp(prefix="shard-benchmark-"))
+    work_dir.mkdir(parents=True, exist_ok=True)
+    try:
+        results = run(args, work_dir)
+    finally:
+        if args.workdir is None and not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    report = {
+        "meta": {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": {k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()},
+        },
+        **results,
+    }
+    args.json.write_text(json.dumps(report, indent=2))
+    print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
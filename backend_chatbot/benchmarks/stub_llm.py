@@ -0,0 +1,128 @@
+"""Local stand-in for the Groq chat completions API with configurable latency.
+
+Speaks the OpenAI-compatible endpoint the Groq SDK calls, both plain and
+streamed (server-sent events), so the app runs unchanged against it:
+
+    python -m benchmarks.stub_llm --port 8090 --latency 0.4 --tokens 120 --token-interval 0.01
+    GROQ_BASE_URL=http://127.0.0.1:8090 GROQ_API_KEY=stub uvicorn app.main:app
+"""
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+WORDS = ("candidate experience python backend team project data skills years cloud service "
+         "strong fit role senior developer built led designed pipeline api").split()
+
+
+@dataclass
+class StubLLMConfig:
+    latency: float = 0.3          # seconds before the first token
+    tokens: int = 80              # tokens per answer
+    token_interval: float = 0.0   # seconds between streamed tokens
+    jitter: float = 0.0           # +/- fraction applied to latency
+
+
+def create_app(config: StubLLMConfig) -> FastAPI:
+    app = FastAPI()
+    app.state.requests = 0
+
+    def answer_tokens():
+        return [random.choice(WORDS) + " " for _ in range(config.tokens)]
+
+    async def first_token_delay():
+        jitter = 1 + random.uniform(-config.jitter, config.jitter) if config.jitter else 1
+        await asyncio.sleep(max(0.0, config.latency * jitter))
+
+    @app.post("/openai/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        app.state.requests += 1
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        model = body.get("model", "stub")
+        prompt_tokens = sum(len(m.get("content", "").split()) for m in body.get("messages", []))
+        tokens = answer_tokens()
+
+        if not body.get("stream"):
+            await first_token_delay()
+            await asyncio.sleep(config.token_interval * len(tokens))
+            return JSONResponse({
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)},
+                             "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                          "total_tokens": prompt_tokens + len(tokens)},
+            })
+
+        async def events():
+            await first_token_delay()
+            for i, token in enumerate(tokens):
+                if i and config.token_interval:
+                    await asyncio.sleep(config.token_interval)
+                chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                         "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+            done = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+            yield f"data: {json.dumps(done)}\n\ndata: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+class StubLLMServer:
+    """Runs the stub on a background thread, e.g. inside a benchmark."""
+
+    def __init__(self, config: StubLLMConfig, host: str = "127.0.0.1", port: int = 0):
+        self.app = create_app(config)
+        self.server = uvicorn.Server(uvicorn.Config(self.app, host=host, port=port, log_level="warning"))
+        self._thread = threading.Thread(target=self.server.run, name="stub-llm", daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.servers[0].sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def requests(self) -> int:
+        return self.app.state.requests
+
+    def start(self, timeout: float = 10.0) -> "StubLLMServer":
+        self._thread.start()
+        deadline = time.monotonic() + timeout
+        while not self.server.started:
+            if time.monotonic() > deadline or not self._thread.is_alive():
+                raise RuntimeError("stub LLM server did not start")
+            time.sleep(0.01)
+        return self
+
+    def stop(self):
+        self.server.should_exit = True
+        self._thread.join(timeout=10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", type=float, default=0.3, help="seconds before the first token")
+    parser.add_argument("--tokens", type=int, default=80, help="tokens per answer")
+    parser.add_argument("--token-interval", type=float, default=0.0, help="seconds between streamed tokens")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random +/- fraction of --latency")
+    args = parser.parse_args()
+    config = StubLLMConfig(args.latency, args.tokens, args.token_interval, args.jitter)
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
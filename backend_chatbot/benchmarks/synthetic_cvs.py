@@ -0,0 +1,208 @@
+"""Synthetic resumes for the benchmarks, written as PDF, DOCX and legacy CSV.
+
+Every CV is generated from a seeded RNG, so the same --count and --seed
+always produce the same corpus. --near-duplicates adds that fraction of
+re-uploads with small edits, as recruiters' corpora have. The PDFs are written directly (one
+Helvetica text layer per page), so no PDF library is needed.
+
+Run from backend_chatbot/:
+
+    python -m benchmarks.synthetic_cvs --count 1000 --out /tmp/cvs
+"""
+import argparse
+import csv
+import random
+from pathlib import Path
+from typing import Dict, Iterable, List
+
+from docx import Document
+
+FORMATS = ("pdf", "docx", "csv")
+
+FIRST_NAMES = ["Nguyen", "Tran", "Le", "Pham", "Hoang", "Vu", "Dang", "Bui", "Do", "Ngo", "Alex", "Sam", "Jordan",
+               "Taylor", "Morgan", "Casey", "Riley", "Jamie", "Avery", "Quinn"]
+LAST_NAMES = ["Anh", "Binh", "Cuong", "Dung", "Giang", "Hai", "Khanh", "Linh", "Minh", "Nam", "Phuong", "Quang",
+              "Smith", "Garcia", "Kim", "Chen", "Novak", "Silva", "Patel", "Weber"]
+TITLES = ["Backend Developer", "Frontend Developer", "Data Engineer", "Data Scientist", "DevOps Engineer",
+          "Mobile Developer", "Machine Learning Engineer", "QA Engineer", "Software Engineer", "Product Manager"]
+SKILLS = ["Python", "Java", "Go", "Rust", "C++", "C#", "JavaScript", "TypeScript", "React", "Vue", "Angular",
+          "Node.js", "Django", "FastAPI", "Spring Boot", "SQL", "PostgreSQL", "MySQL", "MongoDB", "Redis", "Kafka",
+          "Spark", "Airflow", "dbt", "Docker", "Kubernetes", "Terraform", "AWS", "GCP", "Azure", "Linux", "Git",
+          "PyTorch", "TensorFlow", "scikit-learn", "Pandas", "NLP", "Computer Vision", "Flutter", "Kotlin", "Swift",
+          "GraphQL", "REST APIs", "CI/CD", "Elasticsearch", "FAISS", "LangChain", "Selenium", "Figma", "Scrum"]
+COMPANIES = ["FPT Software", "VNG", "Viettel", "Tiki", "Shopee", "Grab", "MoMo", "VinAI", "KMS Technology",
+             "NashTech", "Axon", "Katalon", "Zalo", "One Mount", "Techcombank", "Acme Corp", "Globex", "Initech"]
+UNIVERSITIES = ["HCMC University of Technology", "University of Science, VNU-HCM", "Hanoi University of Science and "
+                "Technology", "University of Information Technology", "FPT University", "RMIT Vietnam"]
+VERBS = ["Built", "Designed", "Maintained", "Migrated", "Optimized", "Led", "Automated", "Deployed", "Refactored",
+         "Monitored", "Scaled", "Tested"]
+OBJECTS = ["a payment service", "the recommendation pipeline", "an internal analytics dashboard", "REST APIs",
+           "the data warehouse", "a real-time chat backend", "the CI/CD pipeline", "a search service",
+           "ETL jobs", "the mobile checkout flow", "microservices", "a feature store", "the monitoring stack"]
+RESULTS = ["cutting latency by {n}%", "serving {n}k users per day", "reducing cloud cost by {n}%",
+           "raising test coverage to {n}%", "processing {n}M events per day", "with {n}% fewer incidents"]
+
+
+def make_cv(rng: random.Random, number: int) -> Dict[str, object]:
+    """One resume as a title and a list of (heading, lines) sections."""
+    name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+    title = rng.choice(TITLES)
+    skills = rng.sample(SKILLS, rng.randint(6, 14))
+    years = rng.randint(1, 12)
+    experience = []
+    end_year = 2024
+    for _ in range(rng.randint(1, 4)):
+        start_year = end_year - rng.randint(1, 4)
+        experience.append(f"{rng.choice(TITLES)} at {rng.choice(COMPANIES)} ({start_year} - {end_year})")
+        for _ in range(rng.randint(2, 5)):
+            result = rng.choice(RESULTS).format(n=rng.randint(5, 90))
+            experience.append(f"- {rng.choice(VERBS)} {rng.choice(OBJECTS)} using {rng.choice(skills)}, {result}.")
+        end_year = start_year
+    return {
+        "number": number,
+        "name": name,
+        "sections": [
+            (f"{name} - {title}", [f"Email: cv{number:05d}@example.com", f"Phone: +84 9{rng.randint(10000000, 99999999)}"]),
+            ("Summary", [f"{title} with {years} years of experience in {', '.join(skills[:3])}. "
+                         f"Comfortable with {', '.join(skills[3:6])} and working in agile teams."]),
+            ("Skills", [", ".join(skills)]),
+            ("Experience", experience),
+            ("Education", [f"Bachelor of Computer Science, {rng.choice(UNIVERSITIES)} ({end_year - 4} - {end_year})"]),
+        ],
+    }
+
+
+def revise_cv(rng: random.Random, cv: Dict[str, object]) -> Dict[str, object]:
+    """A re-upload of `cv` with small edits: another phone number and one more line of experience."""
+    sections = [(heading, list(lines)) for heading, lines in cv["sections"]]
+    sections[0][1][1] = f"Phone: +84 9{rng.randint(10000000, 99999999)}"
+    result = rng.choice(RESULTS).format(n=rng.randint(5, 90))
+    sections[3][1].append(f"- {rng.choice(VERBS)} {rng.choice(OBJECTS)}, {result}.")
+    return dict(cv, sections=sections)
+
+
+def cv_text(cv: Dict[str, object]) -> str:
+    return "\n".join(line for heading, lines in cv["sections"] for line in [heading, *lines])
+
+
+def _wrap(line: str, width: int) -> List[str]:
+    words, out, current = line.split(), [], ""
+    for word in words:
+        if current and len(current) + 1 + len(word) > width:
+            out.append(current)
+            current = word
+        else:
+            current = f"{current} {word}" if current else word
+    return out + [current] if current else out or [""]
+
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)").encode("latin-1", "replace").decode("latin-1")
+
+
+def write_pdf(path: Path, lines: Iterable[str], lines_per_page: int = 60, width: int = 95):
+    """Minimal PDF 1.4 with a text layer that pdfminer and pdfium can extract."""
+    wrapped = [part for line in lines for part in _wrap(line, width)]
+    pages = [wrapped[i:i + lines_per_page] for i in range(0, len(wrapped), lines_per_page)] or [[]]
+    # Objects: 1 catalog, 2 page tree, 3 font, then a (page, content) pair per page
+    objects = [None, None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for page in pages:
+        body = "BT /F1 10 Tf 12 TL 50 800 Td\n" + "".join(f"({_pdf_escape(line)}) '\n" for line in page) + "ET"
+        stream = body.encode("latin-1")
+        objects.append(None)
+        page_number = len(objects)
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects[page_number - 1] = (
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> "
+            b"/Contents %d 0 R >>" % (page_number + 1)
+        )
+        kids.append(page_number)
+    objects[0] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        " ".join(f"{k} 0 R" for k in kids).encode(), len(kids)
+    )
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, obj)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    Path(path).write_bytes(bytes(out))
+
+
+def write_docx(path: Path, cv: Dict[str, object]):
+    document = Document()
+    for heading, lines in cv["sections"]:
+        document.add_heading(heading, level=1)
+        for line in lines:
+            document.add_paragraph(line)
+    document.save(str(path))
+
+
+def write_csv(path: Path, source: str, text: str):
+    """Same layout as save_text_to_csv: header row, then (source, Resume)."""
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["source", "Resume"])
+        writer.writerow([source, text.replace("\n", " ")])
+
+
+def generate_corpus(out_dir: Path, count: int, seed: int = 0, formats: Iterable[str] = FORMATS,
+                    near_duplicates: float = 0.0) -> Dict[str, List[Path]]:
+    """Write `count` CVs in each format to <out_dir>/files and <out_dir>/csv_files.
+
+    The CSV of a CV names the PDF as its source, like an extracted upload.
+    A `near_duplicates` fraction of them also gets a revised copy (`_rev`).
+    """
+    rng = random.Random(seed)
+    # Own RNG: the original CVs stay the same whatever the fraction
+    revisions = random.Random(seed + 1)
+    files_dir, csv_dir = Path(out_dir) / "files", Path(out_dir) / "csv_files"
+    files_dir.mkdir(parents=True, exist_ok=True)
+    csv_dir.mkdir(parents=True, exist_ok=True)
+    written: Dict[str, List[Path]] = {fmt: [] for fmt in formats}
+    for number in range(count):
+        cv = make_cv(rng, number)
+        stem = f"cv_{number:05d}_{cv['name'].replace(' ', '')}"
+        versions = [(stem, cv)]
+        if revisions.random() < near_duplicates:
+            versions.append((f"{stem}_rev", revise_cv(revisions, cv)))
+        for stem, cv in versions:
+            _write_cv(written, files_dir, csv_dir, stem, cv)
+    return written
+
+
+def _write_cv(written: Dict[str, List[Path]], files_dir: Path, csv_dir: Path, stem: str, cv: Dict[str, object]):
+    if "pdf" in written:
+        path = files_dir / f"{stem}.pdf"
+        write_pdf(path, cv_text(cv).splitlines())
+        written["pdf"].append(path)
+    if "docx" in written:
+        path = files_dir / f"{stem}.docx"
+        write_docx(path, cv)
+        written["docx"].append(path)
+    if "csv" in written:
+        path = csv_dir / f"{stem}.csv"
+        write_csv(path, f"{stem}.pdf", cv_text(cv))
+        written["csv"].append(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=100)
+    parser.add_argument("--out", type=Path, required=True)
+    parser.add_argument("--formats", nargs="+", choices=FORMATS, default=list(FORMATS))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--near-duplicates", type=float, default=0.0, help="fraction of CVs also uploaded revised")
+    args = parser.parse_args()
+    written = generate_corpus(args.out, args.count, args.seed, args.formats, args.near_duplicates)
+    print(", ".join(f"{len(paths)} {fmt}" for fmt, paths in written.items()), f"written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+import numpy as np
+
+from app.services.answer_cache import AnswerCache
+
+
+def unit(*values):
+    vector = np.array(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def test_clear_forgets_semantic_matches():
+    cache = AnswerCache(max_entries=4, similarity_threshold=0.9)
+    cache.put("who knows django?", 3, "Alice", [{"source": "alice.pdf"}], unit(1, 0, 0))
+    assert cache.get("which candidates know django", 3, unit(1, 0.1, 0)).answer == "Alice"
+
+    cache.clear()
+
+    assert cache.stats()["size"] == cache.stats()["scopes"] == 0
+    # An older index version is accepted again after a clear
+    cache.put("who knows flask?", 2, "Bob", [{"source": "bob.pdf"}], unit(0, 1, 0))
+    assert cache.get("which candidates know django", 2, unit(1, 0.1, 0)) is None
+    # Every slot is free again
+    for n in range(3):
+        cache.put(f"question {n}", 2, "answer", [], unit(n + 1, 0, 1))
+    assert len(cache) == 4
@@ -0,0 +1,114 @@
+import asyncio
+
+from app.database.memory import MemoryCollection
+from app.services.chat_log import ChatLog
+
+
+class FlakyCollection(MemoryCollection):
+    """Fails the first `failures` inserts, as an unreachable MongoDB would."""
+
+    def __init__(self, failures: int):
+        super().__init__("chat_logs")
+        self.failures = failures
+
+    async def insert_many(self, documents, ordered=True):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("mongod unreachable")
+        await super().insert_many(documents, ordered)
+
+
+class GatedCollection(MemoryCollection):
+    """Holds every insert until `gate` is set."""
+
+    def __init__(self):
+        super().__init__("chat_logs")
+        self.gate = asyncio.Event()
+
+    async def insert_many(self, documents, ordered=True):
+        await self.gate.wait()
+        await super().insert_many(documents, ordered)
+
+
+def test_failed_batch_is_requeued_and_retried_in_order():
+    async def scenario():
+        collection = FlakyCollection(failures=2)
+        chat_log = ChatLog(batch_size=5, flush_interval=0.01, max_buffer=10, writers=1)
+        chat_log.start(collection)
+        for n in range(5):
+            assert chat_log.log({"n": n})
+        await asyncio.sleep(0.3)
+        await chat_log.close(timeout=1)
+        return collection, chat_log.stats()
+
+    collection, stats = asyncio.run(scenario())
+    assert [document["n"] for document in collection.documents] == [0, 1, 2, 3, 4]
+    assert collection.inserts == 1
+    assert (stats["written"], stats["failed"], stats["dropped"], stats["buffered"]) == (5, 0, 0, 0)
+
+
+def test_put_waits_for_room():
+    async def scenario():
+        collection = GatedCollection()
+        chat_log = ChatLog(batch_size=2, flush_interval=0.01, max_buffer=2, writers=1)
+        chat_log.start(collection)
+        # The writer takes the first record and blocks on its insert; the next two fill the buffer
+        for n in range(3):
+            assert await asyncio.wait_for(chat_log.put({"n": n}), 1)
+            await asyncio.sleep(0.02)
+        waiting = asyncio.ensure_future(chat_log.put({"n": 3}))
+        await asyncio.sleep(0.05)
+        blocked = not waiting.done()
+        # log() drops instead of waiting
+        dropped = not chat_log.log({"n": 99})
+        collection.gate.set()
+        queued = await asyncio.wait_for(waiting, 1)
+        await chat_log.close(timeout=1)
+        return blocked, dropped, queued, collection, chat_log.stats()
+
+    blocked, dropped, queued, collection, stats = asyncio.run(scenario())
+    assert blocked and dropped and queued
+    assert [document["n"] for document in collection.documents] == [0, 1, 2, 3]
+    assert stats["dropped"] == 1
+
+
+def test_close_drains_the_buffer():
+    async def scenario():
+        collection = MemoryCollection("chat_logs")
+        # Neither a full batch nor a flush interval would write these before close()
+        chat_log = ChatLog(batch_size=100, flush_interval=60, max_buffer=100, writers=2)
+        chat_log.start(collection)
+        for n in range(7):
+            chat_log.log({"n": n})
+        await asyncio.wait_for(chat_log.close(timeout=1), 2)
+        after_close = (chat_log.log({"n": 7}), await asyncio.wait_for(chat_log.put({"n": 8}), 1))
+        return collection, chat_log, after_close
+
+    collection, chat_log, after_close = asyncio.run(scenario())
+    assert sorted(document["n"] for document in collection.documents) == list(range(7))
+    assert not chat_log.running
+    assert after_close == (False, False)
+
+
+def test_close_drops_what_cannot_be_written_in_time():
+    async def scenario():
+        collection = GatedCollection()
+        chat_log = ChatLog(batch_size=100, flush_interval=60, max_buffer=100, writers=1)
+        chat_log.start(collection)
+        for n in range(3):
+            chat_log.log({"n": n})
+        await asyncio.wait_for(chat_log.close(timeout=0.05), 1)
+        return collection, chat_log.stats()
+
+    collection, stats = asyncio.run(scenario())
+    assert collection.documents == []
+    assert stats["dropped"] == 3
+    assert stats["buffered"] == 0 and not stats["running"]
+
+
+def test_put_before_start_does_not_wait():
+    async def scenario():
+        chat_log = ChatLog(batch_size=1, max_buffer=1)
+        return await asyncio.wait_for(chat_log.put({"n": 0}), 1)
+
+    assert asyncio.run(scenario()) is False
@@ -0,0 +1,89 @@
+import shutil
+
+import pyarrow.parquet as pq
+
+from app.services.corpus_store import CorpusStore
+
+
+def record(n: int, version: int = 1, shard: str = "acme") -> dict:
+    return {"source": f"{shard}/cv{n}.pdf", "text": f"CV {n} v{version}", "content_hash": f"h{n}-{version}"}
+
+
+def texts(store: CorpusStore, **kwargs) -> dict:
+    return {r["source"]: r["text"] for r in store.iter_records(**kwargs)}
+
+
+def test_compaction_is_tiered(tmp_path):
+    store = CorpusStore(tmp_path, compact_after=4)
+    for n in range(200):
+        store.append([record(n, shard=("acme", "globex")[n % 2])])
+        store.wait_for_compaction()
+    assert len(store._segments) <= 4 + 8
+    assert len(texts(store)) == 200
+    assert texts(store, shard="globex") == {f"globex/cv{n}.pdf": f"CV {n} v1" for n in range(1, 200, 2)}
+    # Older records sit in large segments that are no longer rewritten
+    sizes = [pq.ParquetFile(path).metadata.num_rows for _, path in store._segments]
+    assert sizes[0] > sum(sizes[1:])
+    assert sorted(path.name for path in tmp_path.glob("seg-*")) == sorted(path.name for _, path in store._segments)
+
+
+def test_tombstones_survive_partial_merges(tmp_path):
+    store = CorpusStore(tmp_path, compact_after=1000)
+    store.append([record(n) for n in range(50)])
+    store.append([record(1, version=2)])
+    store.delete(["acme/cv2.pdf"])
+    store.append([record(50)])
+    # Only the small newest segments are merged: the tombstone must keep hiding cv2
+    assert store.compact()
+    assert len(store._segments) == 2
+    reopened = CorpusStore(tmp_path, compact_after=1000)
+    for current in (store, reopened):
+        records = texts(current)
+        assert "acme/cv2.pdf" not in records and records["acme/cv1.pdf"] == "CV 1 v2" and len(records) == 50
+        assert current.content_hash("acme/cv2.pdf") is None
+        assert current.source_for_hash("h1-2", "acme") == "acme/cv1.pdf"
+    # Merging everything drops the tombstone for good
+    store.append([record(51)])
+    while store.compact():
+        pass
+    assert len(store._segments) == 1
+    assert "acme/cv2.pdf" not in store._latest
+    assert len(texts(CorpusStore(tmp_path))) == 51
+
+
+def test_appends_during_a_merge_win(tmp_path, monkeypatch):
+    store = CorpusStore(tmp_path, compact_after=1000)
+    for n in range(4):
+        store.append([record(n)])
+    write_merged = store._write_merged
+
+    def with_concurrent_append(*args):
+        # An ingest while the merged segment is being written: no lock is held here
+        store.append([record(0, version=2), record(9)])
+        return write_merged(*args)
+
+    monkeypatch.setattr(store, "_write_merged", with_concurrent_append)
+    assert store.compact()
+    for current in (store, CorpusStore(tmp_path)):
+        assert texts(current) == {"acme/cv0.pdf": "CV 0 v2", "acme/cv1.pdf": "CV 1 v1", "acme/cv2.pdf": "CV 2 v1",
+                                  "acme/cv3.pdf": "CV 3 v1", "acme/cv9.pdf": "CV 9 v1"}
+
+
+def test_reopen_after_interrupted_compaction(tmp_path):
+    store = CorpusStore(tmp_path, compact_after=1000)
+    for n in range(5):
+        store.append([record(n)])
+    store.delete(["acme/cv3.pdf"])
+    backup = tmp_path / "backup"
+    backup.mkdir()
+    for _, path in store._segments:
+        shutil.copy(path, backup / path.name)
+    while store.compact():
+        pass
+    # The merged segment was published, but the process stopped before deleting the old ones
+    for path in backup.iterdir():
+        shutil.copy(path, tmp_path / path.name)
+    reopened = CorpusStore(tmp_path)
+    assert len(reopened._segments) == 1
+    assert sorted(texts(reopened)) == ["acme/cv0.pdf", "acme/cv1.pdf", "acme/cv2.pdf", "acme/cv4.pdf"]
+    assert len(list(tmp_path.glob("seg-*"))) == 1
@@ -0,0 +1,91 @@
+import pytest
+from starlette.applications import Starlette
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from app.services.file_delivery import RangeNotSatisfiable, file_response, parse_range
+
+BODY = bytes(range(256)) * 4
+ETAG = '"0123456789abcdef"'
+
+
+@pytest.fixture
+def client(tmp_path):
+    path = tmp_path / "cv.pdf"
+    path.write_bytes(BODY)
+
+    async def cv(request):
+        response, _ = file_response(request, open(path, "rb"), ETAG, "application/pdf", filename="cv.pdf")
+        return response
+
+    return TestClient(Starlette(routes=[Route("/cv", cv, methods=["GET", "HEAD"])]))
+
+
+@pytest.mark.parametrize("header, span", [
+    ("bytes=0-99", (0, 100)),
+    ("bytes=1000-", (1000, 1024)),          # open-ended
+    ("bytes=-24", (1000, 1024)),            # suffix
+    ("bytes=-5000", (0, 1024)),             # suffix longer than the file
+    ("bytes=1000-5000", (1000, 1024)),      # end past EOF is clamped
+    ("bytes=0-9,20-29", None),              # several ranges: the whole file
+    ("items=0-9", None),
+    ("bytes=9-0", None),
+    (None, None),
+])
+def test_parse_range(header, span):
+    assert parse_range(header, len(BODY)) == span
+
+
+@pytest.mark.parametrize("header, size", [("bytes=1024-", 1024), ("bytes=2000-2100", 1024), ("bytes=-0", 1024),
+                                          ("bytes=-10", 0)])
+def test_parse_range_not_satisfiable(header, size):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range(header, size)
+
+
+def test_suffix_range(client):
+    response = client.get("/cv", headers={"Range": "bytes=-100"})
+    assert response.status_code == 206
+    assert response.headers["content-range"] == "bytes 924-1023/1024"
+    assert response.content == BODY[-100:]
+
+
+def test_open_ended_range(client):
+    response = client.get("/cv", headers={"Range": "bytes=1000-"})
+    assert response.status_code == 206
+    assert response.headers["content-range"] == "bytes 1000-1023/1024"
+    assert response.content == BODY[1000:]
+
+
+def test_range_past_eof(client):
+    response = client.get("/cv", headers={"Range": "bytes=4096-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == "bytes */1024"
+    assert response.content == b""
+
+
+def test_if_range_match_and_mismatch(client):
+    matching = client.get("/cv", headers={"Range": "bytes=0-9", "If-Range": ETAG})
+    assert matching.status_code == 206 and matching.content == BODY[:10]
+    # A changed file: the whole new representation, not a range of it
+    for validator in ('"stale"', f"W/{ETAG}", "Wed, 21 Oct 2015 07:28:00 GMT"):
+        response = client.get("/cv", headers={"Range": "bytes=0-9", "If-Range": validator})
+        assert response.status_code == 200
+        assert response.content == BODY
+        assert "content-range" not in response.headers
+
+
+def test_if_none_match_weak_comparison(client):
+    for header in (ETAG, f"W/{ETAG}", f'"other", W/{ETAG}', "*"):
+        response = client.get("/cv", headers={"If-None-Match": header})
+        assert response.status_code == 304, header
+        assert response.headers["etag"] == ETAG
+        assert response.content == b""
+    assert client.get("/cv", headers={"If-None-Match": '"other"'}).status_code == 200
+
+
+def test_head_sends_headers_only(client):
+    response = client.head("/cv", headers={"Range": "bytes=0-9"})
+    assert response.status_code == 206
+    assert response.headers["content-length"] == "10"
+    assert response.content == b""
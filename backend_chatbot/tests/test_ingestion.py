@@ -0,0 +1,86 @@
+import time
+
+import pytest
+
+from app.services.corpus_store import CorpusStore
+from app.services.extraction import ExtractionCache
+from app.services.ingestion import IngestionQueue, file_content_hash
+
+
+def wait_done(ingestion: IngestionQueue, job, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while ingestion.get(job.id).status in ("queued", "running"):
+        assert time.monotonic() < deadline, f"{job.source} still {job.status}"
+        time.sleep(0.01)
+    return ingestion.get(job.id)
+
+
+@pytest.fixture
+def uploads(tmp_path):
+    root = tmp_path / "uploaded_files"
+    (root / "acme").mkdir(parents=True)
+    cache = ExtractionCache(tmp_path / "extraction_cache")
+    ingestion = IngestionQueue(CorpusStore(tmp_path / "corpus"), cache=cache, root=root)
+    notified = []
+    ingestion.add_listener(notified.extend)
+    yield root, cache, ingestion, notified
+    ingestion.shutdown()
+
+
+def upload(root, cache, name: str, content: bytes):
+    path = root / name
+    path.write_bytes(content)
+    # Extracted already: the test never starts an extraction process
+    cache.put(file_content_hash(path), f"text of {content.decode()}")
+    return path
+
+
+def test_duplicate_takes_over_when_the_original_is_removed(uploads):
+    root, cache, ingestion, notified = uploads
+    original = upload(root, cache, "acme/cv.pdf", b"same bytes")
+    copy = upload(root, cache, "acme/cv (1).pdf", b"same bytes")
+    assert wait_done(ingestion, ingestion.submit(original)).status == "done"
+    skipped = ingestion.submit(copy)
+    assert (skipped.status, skipped.detail) == ("skipped", "duplicate of acme/cv.pdf")
+
+    original.unlink()
+    assert ingestion.remove(original)
+
+    deadline = time.monotonic() + 5
+    while ingestion.corpus.content_hash("acme/cv (1).pdf") is None:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    assert ingestion.corpus.content_hash("acme/cv.pdf") is None
+    assert [record["source"] for record in notified] == ["acme/cv.pdf", "acme/cv.pdf", "acme/cv (1).pdf"]
+
+
+def test_duplicate_in_another_shard_is_not_promoted(uploads):
+    root, cache, ingestion, notified = uploads
+    (root / "globex").mkdir()
+    original = upload(root, cache, "acme/cv.pdf", b"same bytes")
+    other_shard = upload(root, cache, "globex/cv.pdf", b"same bytes")
+    copy = upload(root, cache, "cv.pdf", b"other bytes")
+    for path in (original, other_shard, copy):
+        wait_done(ingestion, ingestion.submit(path))
+
+    original.unlink()
+    assert ingestion.remove(original)
+    time.sleep(0.1)
+    assert len(notified) == 4
+    assert ingestion.corpus.content_hash("globex/cv.pdf") is not None
+
+
+def test_removed_duplicate_is_forgotten(uploads):
+    root, cache, ingestion, notified = uploads
+    original = upload(root, cache, "acme/cv.pdf", b"same bytes")
+    copy = upload(root, cache, "acme/copy.pdf", b"same bytes")
+    wait_done(ingestion, ingestion.submit(original))
+    ingestion.submit(copy)
+
+    copy.unlink()
+    assert not ingestion.remove(copy)
+    original.unlink()
+    assert ingestion.remove(original)
+    time.sleep(0.1)
+    assert [record["source"] for record in notified] == ["acme/cv.pdf", "acme/cv.pdf"]
+    assert len(ingestion.corpus) == 0
@@ -0,0 +1,72 @@
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from app.services import chunking
+from app.services.knowledge_index import KnowledgeIndex
+
+SHARED = "Built the hiring platform with FastAPI."
+
+
+class WordTokenizer:
+    """One token per word: enough for the splitter, without downloading a model."""
+
+    def encode(self, text):
+        return text.split()
+
+    def __call__(self, texts, **kwargs):
+        return {"input_ids": [text.split() for text in texts]}
+
+
+@pytest.fixture(autouse=True)
+def word_tokenizer(monkeypatch):
+    monkeypatch.setattr(chunking, "get_tokenizer", lambda model_name: WordTokenizer())
+
+
+def make_index(chunk_size: int = 8, **kwargs) -> KnowledgeIndex:
+    return KnowledgeIndex(DeterministicFakeEmbedding(size=16), chunk_size=chunk_size, model_name="test-words", **kwargs)
+
+
+def chat_sources(index: KnowledgeIndex, tmp_path, text: str):
+    """Sources the chat would cite for the chunks nearest to `text`, as served after publishing."""
+    index.publish(tmp_path)
+    snapshot = index.snapshot()
+    vector = index.embed_query(text)
+    return {doc.metadata["source"] for doc, _ in snapshot.similarity_search_with_score_by_vector(vector, k=len(snapshot))}
+
+
+def test_shared_chunk_cites_remaining_owner(tmp_path):
+    index = make_index()
+    index.apply_records([
+        {"source": "alice.pdf", "text": f"Alice Nguyen, backend developer. {SHARED}"},
+        {"source": "bob.pdf", "text": f"Bob Tran, data engineer. {SHARED}"},
+    ])
+    shared = [cid for cid, owners in index.chunk_sources.items() if owners == {"alice.pdf", "bob.pdf"}]
+    assert shared
+
+    index.apply_records([{"source": "alice.pdf", "deleted": True}])
+
+    assert chat_sources(index, tmp_path, SHARED) == {"bob.pdf"}
+    for cid in shared:
+        assert index.snapshot().document(cid).metadata["source"] == "bob.pdf"
+
+
+def test_aliases_cited_after_canonical_removed(tmp_path):
+    text = " ".join(f"Project {n}: built the candidate matching service." for n in range(12))
+    index = make_index(document_similarity=0.8)
+    index.apply_records([{"source": "cv.pdf", "text": text}, {"source": "cv_copy.pdf", "text": f"{text} Hobbies: chess."}])
+    assert index.source_aliases == {"cv_copy.pdf": "cv.pdf"}
+
+    index.apply_records([{"source": "cv.pdf", "deleted": True}])
+
+    assert chat_sources(index, tmp_path, text) == {"cv_copy.pdf"}
+
+
+def test_reupload_with_small_edit_replaces_chunk():
+    profile = " ".join(f"skill{n}" for n in range(30))
+    index = make_index(chunk_size=64, chunk_similarity=0.9)
+    index.apply_records([{"source": "an.pdf", "text": f"{profile} phone 0901234567"}])
+    index.apply_records([{"source": "an.pdf", "text": f"{profile} phone 0901234568"}])
+
+    texts = [index.vector_store.docstore.search(cid).page_content for cid in index.source_chunk_ids["an.pdf"]]
+    assert texts == [f"Resume: {profile} phone 0901234568"]
+    assert index.vector_store.index.ntotal == len(index.chunk_sources) == 1
@@ -0,0 +1,101 @@
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from app.services import chunking
+from app.services.hybrid_search import hybrid_chunks
+from app.services.knowledge_index import KnowledgeIndex
+from app.services.sharded_index import ShardedIndex, StreamedSnapshot
+from app.services.shards import ALL_SHARDS, DEFAULT_SHARD, shard_scope
+
+TENANTS = ["acme", "globex", "initech", "umbrella"]
+EMBEDDING = DeterministicFakeEmbedding(size=16)
+
+
+class WordTokenizer:
+    """One token per word: enough for the splitter, without downloading a model."""
+
+    def encode(self, text):
+        return text.split()
+
+    def __call__(self, texts, **kwargs):
+        return {"input_ids": [text.split() for text in texts]}
+
+
+@pytest.fixture(autouse=True)
+def word_tokenizer(monkeypatch):
+    monkeypatch.setattr(chunking, "get_tokenizer", lambda model_name: WordTokenizer())
+
+
+def factory() -> KnowledgeIndex:
+    return KnowledgeIndex(EMBEDDING, chunk_size=16, model_name="test-words", report_metrics=False)
+
+
+def reader(root, memory_budget=None) -> ShardedIndex:
+    index = ShardedIndex(root, factory, memory_budget=memory_budget, workers=2)
+    index.embedding_model = EMBEDDING
+    index.discover()
+    return index
+
+
+@pytest.fixture
+def root(tmp_path):
+    builder = ShardedIndex(tmp_path, factory)
+    builder.embedding_model = EMBEDDING
+    for tenant in TENANTS:
+        with builder.building(tenant) as index:
+            index.apply_records([
+                {"source": f"{tenant}/cv{n}.pdf", "text": f"{tenant} candidate {n} knows python django and sql {n}"}
+                for n in range(3)
+            ])
+            assert builder.publish(tenant, index)
+    return tmp_path
+
+
+def search(snapshot, question: str = "python django candidate"):
+    vector = EMBEDDING.embed_query(question)
+    return [(doc.metadata["source"], score) for doc, score in hybrid_chunks(snapshot, question, vector, k=8)]
+
+
+def test_fan_out_over_budget_is_searched_one_shard_at_a_time(root):
+    unbounded = reader(root)
+    expected = search(unbounded.snapshot([ALL_SHARDS]))
+    size = max(shard["bytes"] for shard in unbounded.stats().values())
+
+    bounded = reader(root, memory_budget=int(size * 1.5))
+    snapshot = bounded.snapshot([ALL_SHARDS])
+    assert isinstance(snapshot, StreamedSnapshot)
+    assert snapshot.versions == unbounded.snapshot([ALL_SHARDS]).versions
+    assert bounded.residency()["loaded"] == 0
+
+    assert search(snapshot) == expected
+    residency = bounded.residency()
+    assert residency["loaded"] == 1 and residency["bytes"] <= bounded.memory_budget
+    assert residency["evictions"] >= len(TENANTS) - 1
+
+
+def test_fan_out_within_budget_loads_every_shard(root):
+    index = reader(root, memory_budget=10 ** 9)
+    snapshot = index.snapshot([ALL_SHARDS])
+    assert not isinstance(snapshot, StreamedSnapshot)
+    assert sorted(snapshot.versions) == TENANTS
+    assert index.residency()["loaded"] == len(TENANTS)
+
+
+def test_snapshot_only_loads_the_shards_asked_for(root):
+    index = reader(root)
+    snapshot = index.snapshot(["globex", "missing"])
+    assert list(snapshot.versions) == ["globex"]
+    assert {source.split("/")[0] for source, _ in search(snapshot)} == {"globex"}
+    assert index.residency()["loaded"] == 1
+    assert index.is_empty([DEFAULT_SHARD]) and not index.is_empty([ALL_SHARDS])
+    with pytest.raises(TypeError):
+        index.snapshot(None)
+
+
+def test_shard_scope():
+    assert shard_scope(None) == [DEFAULT_SHARD]
+    assert shard_scope(["acme", "globex", "acme"]) == ["acme", "globex"]
+    assert shard_scope(["acme", ALL_SHARDS], allow_all=True) == [ALL_SHARDS]
+    for names in ([], [ALL_SHARDS], ["../acme"]):
+        with pytest.raises(ValueError):
+            shard_scope(names)